@@ -0,0 +1,164 @@
+import collections
+import threading
+import time
+import wave
+import numpy as np
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Discards the mixed audio in real time, for headless runs and machines without audio output
+class NullSink(object):
+
+    def __init__(self, rate):
+        self.Rate = rate
+    # ------------------------------------------------------------------------------------------
+
+    def write(self, block):
+        time.sleep(len(block) / float(self.Rate))
+    # ------------------------------------------------------------------------------------------
+
+    def close(self):
+        pass
+    # ------------------------------------------------------------------------------------------
+
+
+# Blocking 16 bit mono output stream of the default sound device
+class SoundDeviceSink(object):
+
+    def __init__(self, rate, block_size):
+        import sounddevice
+        self.Stream = sounddevice.RawOutputStream(
+            samplerate=rate, channels=1, dtype='int16', blocksize=block_size)
+        self.Stream.start()
+    # ------------------------------------------------------------------------------------------
+
+    def write(self, block):
+        self.Stream.write(block)
+    # ------------------------------------------------------------------------------------------
+
+    def close(self):
+        self.Stream.stop()
+        self.Stream.close()
+    # ------------------------------------------------------------------------------------------
+
+
+class Voice(object):
+
+    def __init__(self, samples):
+        self.Samples = samples
+        self.Position = 0
+    # ------------------------------------------------------------------------------------------
+
+
+# Plays preloaded sounds on a single long-lived mixer thread. At most Voices sounds play at once,
+# starting one more drops the oldest
+class AudioMixer(object):
+
+    def __init__(self, sounds, sink, rate, voices, block_size=512):
+        self.Rate = rate
+        self.Sink = sink
+        self.Buffers = dict()
+        for (sound_id, path) in sounds.items():
+            try:
+                self.Buffers[sound_id] = AudioMixer.load_wav(path, rate)
+            except Exception as e:
+                logger.error("Failed to load sound " + path + ": " + str(e))
+
+        self.Voices = collections.deque(maxlen=max(1, voices))
+        self.Condition = threading.Condition()
+        self.Mix = np.zeros(block_size, np.int32)
+        self.Output = np.zeros(block_size, np.int16)
+        self.Dropped = 0
+        self.Running = True
+        self.Thread = threading.Thread(target=self.run, name="AudioMixer", daemon=True)
+        self.Thread.start()
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def create(settings, sounds):
+        rate = settings.SoundRate
+        sink = None
+        if settings.SoundSink == "device" and not settings.Headless:
+            try:
+                sink = SoundDeviceSink(rate, 512)
+            except Exception as e:
+                logger.error("Failed to open sound device, sounds are muted: " + str(e))
+        if sink is None:
+            sink = NullSink(rate)
+        return AudioMixer(sounds, sink, rate, settings.SoundVoices)
+    # ------------------------------------------------------------------------------------------
+
+    # Decodes a PCM wav file to 16 bit mono samples at the given rate
+    @staticmethod
+    def load_wav(path, rate):
+        with wave.open(path, 'rb') as wav:
+            width = wav.getsampwidth()
+            channels = wav.getnchannels()
+            source_rate = wav.getframerate()
+            data = wav.readframes(wav.getnframes())
+
+        if width == 1:
+            samples = (np.frombuffer(data, np.uint8).astype(np.int16) - 128) << 8
+        elif width == 2:
+            samples = np.frombuffer(data, '<i2')
+        else:
+            raise ValueError("unsupported sample width {}".format(width))
+
+        samples = samples.reshape(-1, channels).mean(axis=1)
+        if source_rate != rate:
+            count = int(len(samples) * rate / float(source_rate))
+            samples = np.interp(np.arange(count) * source_rate / float(rate), np.arange(len(samples)), samples)
+        return samples.astype(np.int16)
+    # ------------------------------------------------------------------------------------------
+
+    # Never blocks, only queues the sound for the mixer thread
+    def play(self, sound_id):
+        samples = self.Buffers.get(sound_id)
+        if samples is None:
+            return False
+
+        with self.Condition:
+            if len(self.Voices) == self.Voices.maxlen:
+                self.Dropped += 1
+            self.Voices.append(Voice(samples))
+            self.Condition.notify()
+        return True
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        with self.Condition:
+            self.Running = False
+            self.Condition.notify()
+        self.Thread.join(timeout=1.0)
+        self.Sink.close()
+    # ------------------------------------------------------------------------------------------
+
+    def run(self):
+        while True:
+            with self.Condition:
+                self.Condition.wait_for(lambda: self.Voices or not self.Running)
+                if not self.Running:
+                    break
+
+                self.Mix.fill(0)
+                for voice in list(self.Voices):
+                    chunk = voice.Samples[voice.Position:voice.Position + len(self.Mix)]
+                    self.Mix[:len(chunk)] += chunk
+                    voice.Position += len(chunk)
+                    if voice.Position >= len(voice.Samples):
+                        self.Voices.remove(voice)
+
+            np.clip(self.Mix, -32768, 32767, out=self.Mix)
+            self.Output[:] = self.Mix
+            try:
+                self.Sink.write(self.Output)
+            except Exception as e:
+                logger.error("Sound output failed: " + str(e))
+    # ------------------------------------------------------------------------------------------
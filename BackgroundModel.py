@@ -0,0 +1,137 @@
+import cv2
+import numpy as np
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Static background, the first frame after reset is used as the reference forever
+class BackgroundModel(object):
+
+    def __init__(self, settings):
+        self.Settings = settings
+        self.Background = None
+        self.Ready = False
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def create(settings):
+        model = settings.BackgroundModel
+        if model == "average":
+            return RunningAverageBackground(settings)
+        if model == "mog2" or model == "knn":
+            return SubtractorBackground(settings)
+        if model != "static":
+            logger.error("Unknown background model " + model + ", using static")
+        return BackgroundModel(settings)
+    # ------------------------------------------------------------------------------------------
+
+    def allocate(self, shape):
+        self.Background = np.empty(shape, np.uint8)
+        self.Ready = False
+    # ------------------------------------------------------------------------------------------
+
+    def reset(self):
+        self.Ready = False
+    # ------------------------------------------------------------------------------------------
+
+    def get_background(self):
+        return self.Background
+    # ------------------------------------------------------------------------------------------
+
+    # Writes the difference between the frame and the background to delta.
+    # Returns False if the model has just been seeded with this frame and there is nothing to compare
+    def difference(self, gray, delta):
+        if not self.Ready:
+            np.copyto(self.Background, gray)
+            self.Ready = True
+            return False
+
+        cv2.absdiff(self.Background, gray, dst=delta)
+        return True
+    # ------------------------------------------------------------------------------------------
+
+    # Learns the frame into the background, only where mask is set if the mask is given
+    def learn(self, gray, mask=None):
+        pass
+    # ------------------------------------------------------------------------------------------
+
+
+# Running weighted average of the frames, updated in place so lighting drift is absorbed over time.
+# Pixels kept out by the mask are still learned at the slow absorb rate, so an object that stops in the scene
+# or the ghost of one that was there at the seed frame fades into the background instead of staying a target
+class RunningAverageBackground(BackgroundModel):
+
+    def __init__(self, settings):
+        super(RunningAverageBackground, self).__init__(settings)
+        self.Accumulator = None
+        self.Masked = None
+        self.LearningRate = settings.BackgroundLearningRate
+        self.AbsorbRate = settings.BackgroundAbsorbRate
+    # ------------------------------------------------------------------------------------------
+
+    def allocate(self, shape):
+        super(RunningAverageBackground, self).allocate(shape)
+        self.Accumulator = np.empty(shape, np.float32)
+        self.Masked = np.empty(shape, np.uint8)
+    # ------------------------------------------------------------------------------------------
+
+    def difference(self, gray, delta):
+        if not self.Ready:
+            np.copyto(self.Accumulator, gray)
+            np.copyto(self.Background, gray)
+            self.Ready = True
+            return False
+
+        cv2.absdiff(self.Background, gray, dst=delta)
+        return True
+    # ------------------------------------------------------------------------------------------
+
+    def learn(self, gray, mask=None):
+        cv2.accumulateWeighted(gray, self.Accumulator, self.LearningRate, mask=mask)
+        if mask is not None and self.AbsorbRate > 0:
+            cv2.bitwise_not(mask, dst=self.Masked)
+            cv2.accumulateWeighted(gray, self.Accumulator, self.AbsorbRate, mask=self.Masked)
+        cv2.convertScaleAbs(self.Accumulator, dst=self.Background)
+    # ------------------------------------------------------------------------------------------
+
+
+# OpenCV MOG2/KNN subtractor. The delta it produces is already a foreground mask (0 or 255).
+# Subtractors can not exclude pixels from learning, so the update mask is ignored
+class SubtractorBackground(BackgroundModel):
+
+    def __init__(self, settings):
+        super(SubtractorBackground, self).__init__(settings)
+        self.LearningRate = settings.BackgroundLearningRate
+        self.Subtractor = None
+    # ------------------------------------------------------------------------------------------
+
+    def allocate(self, shape):
+        super(SubtractorBackground, self).allocate(shape)
+        self.reset()
+    # ------------------------------------------------------------------------------------------
+
+    def reset(self):
+        if self.Settings.BackgroundModel == "knn":
+            self.Subtractor = cv2.createBackgroundSubtractorKNN(detectShadows=False)
+        else:
+            self.Subtractor = cv2.createBackgroundSubtractorMOG2(detectShadows=False)
+        self.Ready = False
+    # ------------------------------------------------------------------------------------------
+
+    def get_background(self):
+        return self.Subtractor.getBackgroundImage()
+    # ------------------------------------------------------------------------------------------
+
+    def difference(self, gray, delta):
+        self.Subtractor.apply(gray, fgmask=delta, learningRate=self.LearningRate)
+        if not self.Ready:
+            self.Ready = True
+            return False
+        return True
+    # ------------------------------------------------------------------------------------------
@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Blob array columns
+BLOB_X = 0
+BLOB_Y = 1
+BLOB_W = 2
+BLOB_H = 3
+BLOB_AREA = 4
+BLOB_CX = 5
+BLOB_CY = 6
+BLOB_COLUMNS = 7
+
+
+# Extracts blobs from a binary mask as one N x BLOB_COLUMNS array (bounding box, area, center),
+# only blobs of at least min_area are returned
+class BlobExtractor(object):
+
+    def __init__(self, settings):
+        self.Settings = settings
+        self.Labels = None
+        # Minimum blob area at the current processing resolution
+        self.MinArea = settings.DetectorMinArea
+        self.Empty = np.empty((0, BLOB_COLUMNS), np.float64)
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def create(settings):
+        if settings.DetectorBlobs == "components":
+            return BlobExtractor(settings)
+        if settings.DetectorBlobs != "contours":
+            logger.error("Unknown blob extractor " + settings.DetectorBlobs + ", using contours")
+        return ContourBlobExtractor(settings)
+    # ------------------------------------------------------------------------------------------
+
+    def allocate(self, shape):
+        self.Labels = np.empty(shape, np.int32)
+    # ------------------------------------------------------------------------------------------
+
+    # Connected component statistics of all regions in one pass, filtered with a vectorized mask
+    def extract(self, mask, offset=(0, 0)):
+        (height, width) = mask.shape
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(
+            mask, labels=self.Labels[:height, :width], connectivity=8, ltype=cv2.CV_32S)
+        if count <= 1:
+            return self.Empty
+
+        # Label 0 is the background
+        stats = stats[1:]
+        keep = stats[:, cv2.CC_STAT_AREA] >= self.MinArea
+        if not keep.any():
+            return self.Empty
+
+        blobs = np.empty((np.count_nonzero(keep), BLOB_COLUMNS), np.float64)
+        blobs[:, BLOB_X:BLOB_AREA + 1] = stats[keep][:, [cv2.CC_STAT_LEFT, cv2.CC_STAT_TOP, cv2.CC_STAT_WIDTH,
+                                                         cv2.CC_STAT_HEIGHT, cv2.CC_STAT_AREA]]
+        blobs[:, BLOB_CX:BLOB_CY + 1] = centroids[1:][keep]
+        blobs[:, [BLOB_X, BLOB_CX]] += offset[0]
+        blobs[:, [BLOB_Y, BLOB_CY]] += offset[1]
+        return blobs
+    # ------------------------------------------------------------------------------------------
+
+
+# Contour based extraction, blob area is the contour area and the center is the bounding box center
+class ContourBlobExtractor(BlobExtractor):
+
+    def allocate(self, shape):
+        pass
+    # ------------------------------------------------------------------------------------------
+
+    def extract(self, mask, offset=(0, 0)):
+        # findContours does not modify its input since OpenCV 3.2, so no defensive copy. Outer contours only,
+        # holes are not blobs, so the blobs are the same regions the connected components pass finds
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)[-2]
+        if len(contours) == 0:
+            return self.Empty
+
+        # Every blob is returned, the detector counts them before it picks the largest one
+        areas = np.fromiter((cv2.contourArea(contour) for contour in contours), np.float64, len(contours))
+        keep = np.flatnonzero(areas >= self.MinArea)
+
+        blobs = np.empty((len(keep), BLOB_COLUMNS), np.float64)
+        for row, index in enumerate(keep):
+            blobs[row, BLOB_X:BLOB_H + 1] = cv2.boundingRect(contours[index])
+            blobs[row, BLOB_AREA] = areas[index]
+        blobs[:, BLOB_CX] = blobs[:, BLOB_X] + blobs[:, BLOB_W] / 2
+        blobs[:, BLOB_CY] = blobs[:, BLOB_Y] + blobs[:, BLOB_H] / 2
+        return blobs
+    # ------------------------------------------------------------------------------------------
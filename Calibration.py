@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import cv2
+import numpy as np
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Maps processing pixels to servo yaw/pitch through dense lookup tables built once per resolution.
+# Without a calibration file the tables hold the plain linear mapping over the yaw/pitch ranges.
+# With one, every pixel is undistorted with the camera intrinsics, cast as a ray to the nominal target
+# distance and rotated and shifted into the turret frame, so lens distortion and parallax are accounted for
+class Calibration(object):
+
+    def __init__(self, settings):
+        self.Settings = settings
+        self.Directory = settings.CalibrationDirectory
+        self.Distance = settings.CalibrationDistance
+        self.Undistort = settings.CalibrationUndistort
+        self.Model = None
+        self.Tables = dict()
+        self.Table = None
+        self.TableSize = None
+
+        if settings.CalibrationEnabled:
+            path = os.path.join(self.Directory, settings.CalibrationFile)
+            try:
+                self.Model = Calibration.load(path)
+                logger.info("Loaded calibration {}, residual {:.2f} deg".format(path, self.Model.get("rms_deg", 0)))
+            except (OSError, ValueError, KeyError) as e:
+                logger.error("Failed to load calibration, using the linear mapping: " + str(e))
+        # Frames are only remapped when there is a distortion model to remove
+        self.Undistort = self.Undistort and self.Model is not None
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def load(path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        return {"image_size": tuple(data["image_size"]),
+                "camera_matrix": np.array(data["camera_matrix"], np.float64).reshape(3, 3),
+                "distortion": np.array(data["distortion"], np.float64).ravel(),
+                "rotation": np.array(data.get("rotation", [0, 0, 0]), np.float64).ravel(),
+                "translation": np.array(data.get("translation", [0, 0, 0]), np.float64).ravel(),
+                "rms_deg": float(data.get("rms_deg", 0))}
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def save(path, model):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = {"image_size": [int(v) for v in model["image_size"]],
+                "camera_matrix": model["camera_matrix"].tolist(),
+                "distortion": model["distortion"].tolist(),
+                "rotation": model["rotation"].tolist(),
+                "translation": model["translation"].tolist(),
+                "rms_deg": float(model.get("rms_deg", 0))}
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4)
+    # ------------------------------------------------------------------------------------------
+
+    # Pinhole camera without distortion for a horizontal field of view, when there are no chessboard shots
+    @staticmethod
+    def default_model(width, height, fov):
+        focal = width / 2.0 / np.tan(np.radians(fov) / 2.0)
+        camera_matrix = np.array([[focal, 0, (width - 1) / 2.0], [0, focal, (height - 1) / 2.0], [0, 0, 1]])
+        return {"image_size": (width, height), "camera_matrix": camera_matrix, "distortion": np.zeros(5),
+                "rotation": np.zeros(3), "translation": np.zeros(3), "rms_deg": 0}
+    # ------------------------------------------------------------------------------------------
+
+    # Yaw/pitch of the processing pixel, a table lookup
+    def lookup(self, width, height, x, y):
+        if self.TableSize != (width, height):
+            self.Table = self.get_table(width, height)
+            self.TableSize = (width, height)
+        col = min(max(int(x + 0.5), 0), width - 1)
+        row = min(max(int(y + 0.5), 0), height - 1)
+        (yaw, pitch) = self.Table[row, col]
+        return float(yaw), float(pitch)
+    # ------------------------------------------------------------------------------------------
+
+    def get_table(self, width, height):
+        table = self.Tables.get((width, height))
+        if table is not None:
+            return table
+
+        path = None
+        if self.Model is not None:
+            path = os.path.join(self.Directory, "lut_{}x{}_{}.npy".format(width, height, self.get_key()))
+            if os.path.exists(path):
+                table = np.load(path)
+
+        if table is None or table.shape != (height, width, 2):
+            table = self.compute_table(width, height)
+            if path is not None:
+                try:
+                    np.save(path, table)
+                    logger.info("Saved lookup table " + path)
+                except OSError as e:
+                    logger.error("Failed to save lookup table: " + str(e))
+
+        self.Tables[(width, height)] = table
+        return table
+    # ------------------------------------------------------------------------------------------
+
+    # Tables on disk are only valid for the model and settings they were computed from
+    def get_key(self):
+        digest = hashlib.sha1()
+        for name in ("camera_matrix", "distortion", "rotation", "translation"):
+            digest.update(np.ascontiguousarray(self.Model[name]).tobytes())
+        digest.update(np.array([self.Distance, self.Undistort, self.Settings.TurretYawMin, self.Settings.TurretYawMax,
+                                self.Settings.TurretPitchMin, self.Settings.TurretPitchMax], np.float64).tobytes())
+        return digest.hexdigest()[:12]
+    # ------------------------------------------------------------------------------------------
+
+    def compute_table(self, width, height):
+        (cols, rows) = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+        if self.Model is None:
+            # Same mapping as the turret always had, just evaluated once
+            yaw = self.Settings.TurretYawMin + \
+                (self.Settings.TurretYawMax - self.Settings.TurretYawMin) / width * cols
+            pitch = self.Settings.TurretPitchMin + \
+                (self.Settings.TurretPitchMax - self.Settings.TurretPitchMin) / -height * (rows - height)
+            return np.dstack((yaw, pitch)).astype(np.float32)
+
+        points = np.dstack((cols, rows)).reshape(-1, 1, 2)
+        rays = Calibration.get_rays(self.Model, points, width, height, self.Undistort)
+        angles = Calibration.project(self.Model, rays, self.Distance)
+        self.check_range(angles)
+        return angles.reshape(height, width, 2).astype(np.float32)
+    # ------------------------------------------------------------------------------------------
+
+    def check_range(self, angles):
+        outside = (angles[:, 0] < self.Settings.TurretYawMin) | (angles[:, 0] > self.Settings.TurretYawMax) | \
+            (angles[:, 1] < self.Settings.TurretPitchMin) | (angles[:, 1] > self.Settings.TurretPitchMax)
+        if outside.any():
+            logger.warning("{:.1f}% of the view is outside of the yaw/pitch range".format(100.0 * outside.mean()))
+    # ------------------------------------------------------------------------------------------
+
+    # Camera matrix for the processing resolution, pixel centers are scaled from the calibration size
+    @staticmethod
+    def scale_camera_matrix(model, width, height):
+        (calib_width, calib_height) = model["image_size"]
+        scale = np.array([[width / float(calib_width)], [height / float(calib_height)], [1.0]])
+        camera_matrix = model["camera_matrix"] * scale
+        camera_matrix[0, 2] = (model["camera_matrix"][0, 2] + 0.5) * scale[0, 0] - 0.5
+        camera_matrix[1, 2] = (model["camera_matrix"][1, 2] + 0.5) * scale[1, 0] - 0.5
+        return camera_matrix
+    # ------------------------------------------------------------------------------------------
+
+    # Normalized camera rays (x, y) for pixels of the given resolution, Nx1x2 in and Nx2 out.
+    # Pixels of an undistorted frame only need the pinhole inverse
+    @staticmethod
+    def get_rays(model, points, width, height, undistorted=False):
+        camera_matrix = Calibration.scale_camera_matrix(model, width, height)
+        distortion = None if undistorted else model["distortion"]
+        return cv2.undistortPoints(points.astype(np.float64), camera_matrix, distortion).reshape(-1, 2)
+    # ------------------------------------------------------------------------------------------
+
+    # Yaw/pitch in degrees the turret needs to hit points on the rays at the given distance
+    @staticmethod
+    def project(model, rays, distance):
+        rotation = cv2.Rodrigues(model["rotation"])[0]
+        directions = np.hstack((rays, np.ones((len(rays), 1))))
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        if np.ndim(distance) == 1:
+            distance = np.asarray(distance, np.float64).reshape(-1, 1)
+        points = directions * distance
+        points = points.dot(rotation.T) + model["translation"]
+        yaw = np.degrees(np.arctan2(points[:, 0], points[:, 2]))
+        pitch = np.degrees(np.arctan2(-points[:, 1], np.hypot(points[:, 0], points[:, 2])))
+        return np.column_stack((yaw, pitch))
+    # ------------------------------------------------------------------------------------------
+
+    # Remap maps of the processing resolution, computed once per resolution
+    def get_undistort_maps(self, width, height):
+        if not self.Undistort:
+            return None
+        camera_matrix = Calibration.scale_camera_matrix(self.Model, width, height)
+        return cv2.initUndistortRectifyMap(camera_matrix, self.Model["distortion"], None, camera_matrix,
+                                           (width, height), cv2.CV_16SC2)
+    # ------------------------------------------------------------------------------------------
+
+    # Camera matrix and distortion from chessboard shots, returns the model and the reprojection error in px
+    @staticmethod
+    def fit_intrinsics(images, board_size, square_size):
+        (cols, rows) = board_size
+        board = np.zeros((rows * cols, 3), np.float32)
+        board[:, :2] = np.mgrid[0:cols, 0:rows].T.reshape(-1, 2) * square_size
+
+        object_points = []
+        image_points = []
+        image_size = None
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+        for path in images:
+            gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if gray is None:
+                logger.warning("Failed to read " + path)
+                continue
+            image_size = (gray.shape[1], gray.shape[0])
+            found, corners = cv2.findChessboardCorners(gray, (cols, rows), None)
+            if not found:
+                logger.warning("No chessboard in " + path)
+                continue
+            corners = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
+            object_points.append(board)
+            image_points.append(corners)
+
+        if len(image_points) < 3:
+            raise ValueError("Need at least 3 chessboard shots, found {}".format(len(image_points)))
+
+        (error, camera_matrix, distortion, _, _) = cv2.calibrateCamera(
+            object_points, image_points, image_size, None, None)
+        model = {"image_size": image_size, "camera_matrix": camera_matrix, "distortion": distortion.ravel()[:5],
+                 "rotation": np.zeros(3), "translation": np.zeros(3), "rms_deg": 0}
+        return model, error
+    # ------------------------------------------------------------------------------------------
+
+    # Camera to turret rotation and translation from aim points: pixel (u, v) at the calibration size,
+    # the servo yaw/pitch that hit it and the distance to it. Levenberg-Marquardt over the 6 pose parameters
+    @staticmethod
+    def fit_turret(model, pixels, angles, distances, iterations=100):
+        (width, height) = model["image_size"]
+        rays = Calibration.get_rays(model, pixels.reshape(-1, 1, 2), width, height)
+        measured = angles.reshape(-1)
+
+        def residuals(params):
+            trial = dict(model, rotation=params[:3], translation=params[3:])
+            return Calibration.project(trial, rays, distances).reshape(-1) - measured
+
+        params = np.zeros(6)
+        error = residuals(params)
+        damping = 1e-3
+        for i in range(iterations):
+            jacobian = np.empty((len(error), 6))
+            for j in range(6):
+                step = np.zeros(6)
+                step[j] = 1e-6
+                jacobian[:, j] = (residuals(params + step) - error) / 1e-6
+
+            gradient = jacobian.T.dot(error)
+            hessian = jacobian.T.dot(jacobian)
+            update = -np.linalg.solve(hessian + damping * np.diag(np.diag(hessian) + 1e-9), gradient)
+            trial_error = residuals(params + update)
+            if trial_error.dot(trial_error) < error.dot(error):
+                params += update
+                error = trial_error
+                damping = max(damping / 10.0, 1e-9)
+                if np.abs(update).max() < 1e-10:
+                    break
+            else:
+                damping *= 10.0
+                if damping > 1e9:
+                    break
+
+        fitted = dict(model, rotation=params[:3], translation=params[3:])
+        fitted["rms_deg"] = float(np.sqrt(np.mean(error ** 2)))
+        return fitted
+    # ------------------------------------------------------------------------------------------
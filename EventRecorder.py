@@ -0,0 +1,197 @@
+import collections
+import datetime
+import os
+import threading
+import cv2
+import numpy as np
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Keeps the last pre_roll seconds of frames and, once triggered, hands them together with the live frames
+# up to post_roll seconds after the last trigger to an encoder thread writing a video file.
+# All frames live in a fixed pool of preallocated slots shared by the pre-roll ring and the encoder queue.
+# When the encoder falls behind the pool runs dry and new frames are dropped, record() never waits
+class EventRecorder(object):
+
+    def __init__(self, directory, pre_roll, post_roll, fps, queue_size, codec):
+        self.Directory = directory
+        self.PostRoll = post_roll * 1000.0
+        self.Fps = fps
+        self.Period = 1000.0 / fps
+        self.Codec = codec
+        self.PreRoll = collections.deque(maxlen=max(1, int(round(pre_roll * fps))))
+        self.SlotCount = self.PreRoll.maxlen + max(1, queue_size)
+        self.FreeSlots = collections.deque()
+        self.SlotShape = None
+
+        # Encoder commands: ("start", path), ("frame", slot), ("end", None)
+        self.Queue = collections.deque()
+        self.Condition = threading.Condition()
+        self.Thread = None
+        self.Running = False
+
+        self.Recording = False
+        self.EndTime = 0
+        self.LastFrameTime = None
+        self.Events = 0
+        self.RecordedFrames = 0
+        self.DroppedFrames = 0
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def create(settings):
+        if not settings.RecorderEnabled:
+            return None
+        return EventRecorder(settings.RecorderDirectory, settings.RecorderPreRoll, settings.RecorderPostRoll,
+                             settings.RecorderFps, settings.RecorderQueue, settings.RecorderCodec).start()
+    # ------------------------------------------------------------------------------------------
+
+    def start(self):
+        self.Running = True
+        self.Thread = threading.Thread(target=self.run, name="EventRecorder", daemon=True)
+        self.Thread.start()
+        return self
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self, timeout=5.0):
+        with self.Condition:
+            if self.Recording:
+                self.end_event()
+            self.Running = False
+            self.Condition.notify_all()
+
+        # Let the encoder finish the clip in progress
+        if self.Thread is not None:
+            self.Thread.join(timeout=timeout)
+            self.Thread = None
+
+        logger.info("Events: {}, recorded frames: {}, dropped: {}".format(
+            self.Events, self.RecordedFrames, self.DroppedFrames))
+    # ------------------------------------------------------------------------------------------
+
+    # Starts an event or extends the current one, timestamp is monotonic ms
+    def trigger(self, timestamp):
+        with self.Condition:
+            self.EndTime = timestamp + self.PostRoll
+            if self.Recording:
+                return
+
+            self.Recording = True
+            self.Events += 1
+            name = datetime.datetime.now().strftime("event_%Y%m%d_%H%M%S.avi")
+            self.Queue.append(("start", os.path.join(self.Directory, name)))
+            # The pre-roll goes first, its slots now belong to the encoder
+            for slot in self.PreRoll:
+                self.Queue.append(("frame", slot))
+            self.PreRoll.clear()
+            self.Condition.notify()
+    # ------------------------------------------------------------------------------------------
+
+    # Called for every processed frame, copies it only at the recording frame rate
+    def record(self, frame, timestamp):
+        if self.LastFrameTime is not None and timestamp - self.LastFrameTime < self.Period:
+            return
+        self.LastFrameTime = timestamp
+
+        if self.SlotShape is None:
+            self.allocate(frame.shape)
+
+        with self.Condition:
+            if self.Recording and timestamp > self.EndTime:
+                self.end_event()
+
+            if not self.Recording and len(self.PreRoll) == self.PreRoll.maxlen:
+                # The oldest pre-roll frame is not needed anymore
+                slot = self.PreRoll.popleft()
+            elif self.FreeSlots:
+                slot = self.FreeSlots.popleft()
+            elif not self.Recording and self.PreRoll:
+                slot = self.PreRoll.popleft()
+            else:
+                # Every slot waits for the encoder
+                self.DroppedFrames += 1
+                return
+
+        # Clips keep the size of the first frame even if the processing resolution changes later
+        if frame.shape == self.SlotShape:
+            np.copyto(slot, frame)
+        else:
+            cv2.resize(frame, (self.SlotShape[1], self.SlotShape[0]), dst=slot, interpolation=cv2.INTER_AREA)
+
+        with self.Condition:
+            if self.Recording:
+                self.Queue.append(("frame", slot))
+                self.Condition.notify()
+            else:
+                self.PreRoll.append(slot)
+    # ------------------------------------------------------------------------------------------
+
+    def allocate(self, shape):
+        self.SlotShape = shape
+        with self.Condition:
+            for i in range(self.SlotCount):
+                self.FreeSlots.append(np.empty(shape, np.uint8))
+        logger.info("Allocated {} frame slots, {:.1f} MB".format(
+            self.SlotCount, self.SlotCount * np.prod(shape) / (1024.0 * 1024.0)))
+    # ------------------------------------------------------------------------------------------
+
+    def end_event(self):
+        self.Recording = False
+        self.Queue.append(("end", None))
+        self.Condition.notify()
+    # ------------------------------------------------------------------------------------------
+
+    def run(self):
+        writer = None
+        path = None
+        while True:
+            with self.Condition:
+                self.Condition.wait_for(lambda: self.Queue or not self.Running)
+                if not self.Queue:
+                    break
+                (command, argument) = self.Queue.popleft()
+
+            try:
+                if command == "start":
+                    path = argument
+                elif command == "frame":
+                    # The file is opened with the first frame, which gives the clip size
+                    if path is not None:
+                        writer = self.open_writer(path, argument.shape)
+                        path = None
+                    if writer is not None:
+                        writer.write(argument)
+                        self.RecordedFrames += 1
+                elif command == "end":
+                    path = None
+                    if writer is not None:
+                        writer.release()
+                        writer = None
+            except Exception as e:
+                logger.error("Recording failed: " + str(e))
+
+            if command == "frame":
+                with self.Condition:
+                    self.FreeSlots.append(argument)
+
+        if writer is not None:
+            writer.release()
+    # ------------------------------------------------------------------------------------------
+
+    def open_writer(self, path, shape):
+        os.makedirs(self.Directory, exist_ok=True)
+        (height, width) = shape[:2]
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.Codec), self.Fps, (width, height))
+        if not writer.isOpened():
+            logger.error("Failed to open " + path)
+            return None
+        logger.info("Recording " + path)
+        return writer
+    # ------------------------------------------------------------------------------------------
@@ -0,0 +1,169 @@
+from LatencyMonitor import LatencyMonitor
+
+import random
+import threading
+import time
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Drives the trigger from its own timer thread on the monotonic clock, so the fire cadence does not depend
+# on the frame loop. While armed, and for the shots of a burst, it fires a pulse of exactly duration ms
+# every rate ms plus a random spread of up to a quarter of the rate, with the trigger released for at least
+# release ms in between. Start lateness and pulse length error of every shot are measured
+class FireControl(object):
+
+    # The last stretch before a deadline is waited out without sleeping, sleeps overshoot by up to a ms
+    SPIN_TIME = 0.001
+
+    def __init__(self, write_trigger, rate, duration, ammo, on_shot=None, window=300, metrics=None, release=30):
+        self.WriteTrigger = write_trigger
+        self.Rate = int(rate)
+        self.Duration = duration / 1000.0
+        self.Release = release / 1000.0
+        self.Ammo = ammo
+        self.OnShot = on_shot
+        self.Armed = False
+        self.Burst = 0
+        self.NextShotTime = 0.0
+        self.Shots = 0
+        self.StartError = LatencyMonitor("Trigger start", window)
+        self.PulseError = LatencyMonitor("Trigger pulse", window)
+
+        self.Condition = threading.Condition()
+        self.Running = False
+        self.Thread = None
+
+        self.PulseHistogram = None
+        if metrics is not None:
+            metrics.callback("turret_trigger_pulses_total", "Trigger pulses fired", "counter", lambda: self.Shots)
+            self.PulseHistogram = metrics.histogram("turret_trigger_start_error_seconds",
+                                                    "Lateness of trigger pulses against their schedule")
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def create(settings, write_trigger, on_shot=None, metrics=None):
+        if settings.ShooterTriggerDuration + settings.ShooterTriggerRelease > settings.ShooterRate:
+            logger.warning("Trigger duration {} ms and release {} ms do not fit the shot rate of {} ms, "
+                           "shots are spaced {} ms".format(settings.ShooterTriggerDuration,
+                                                            settings.ShooterTriggerRelease, settings.ShooterRate,
+                                                            settings.ShooterTriggerDuration +
+                                                            settings.ShooterTriggerRelease))
+        return FireControl(write_trigger, settings.ShooterRate, settings.ShooterTriggerDuration, settings.ShooterAmmo,
+                           on_shot, settings.LatencyWindow, metrics, settings.ShooterTriggerRelease).start()
+    # ------------------------------------------------------------------------------------------
+
+    def start(self):
+        self.Running = True
+        self.Thread = threading.Thread(target=self.run, name="FireControl", daemon=True)
+        self.Thread.start()
+        return self
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        with self.Condition:
+            self.Running = False
+            self.Condition.notify()
+        if self.Thread is not None:
+            self.Thread.join(timeout=1.0)
+        logger.info("Shots: {}, ammo left: {}".format(self.Shots, self.Ammo))
+        logger.info(self.StartError.format())
+        logger.info(self.PulseError.format())
+    # ------------------------------------------------------------------------------------------
+
+    # Fires at the rate until disarmed, the first shot as soon as the previous one allows
+    def arm(self):
+        with self.Condition:
+            self.resume()
+            self.Armed = True
+            self.Condition.notify()
+    # ------------------------------------------------------------------------------------------
+
+    # A pulse already started still ends after its full duration
+    def disarm(self):
+        with self.Condition:
+            self.Armed = False
+            self.Burst = 0
+            self.Condition.notify()
+    # ------------------------------------------------------------------------------------------
+
+    def burst(self, count):
+        with self.Condition:
+            self.resume()
+            self.Burst += count
+            self.Condition.notify()
+    # ------------------------------------------------------------------------------------------
+
+    # Idle time is not owed shots, the schedule restarts from now
+    def resume(self):
+        if not self.is_firing():
+            self.NextShotTime = max(self.NextShotTime, time.monotonic())
+    # ------------------------------------------------------------------------------------------
+
+    def is_firing(self):
+        return (self.Armed or self.Burst > 0) and self.Ammo > 0
+    # ------------------------------------------------------------------------------------------
+
+    def run(self):
+        while True:
+            with self.Condition:
+                # Idle until there is something to fire, then until the shot is due or the command changes
+                while self.Running:
+                    if self.is_firing():
+                        wait = self.NextShotTime - time.monotonic() - FireControl.SPIN_TIME
+                        if wait <= 0:
+                            break
+                        self.Condition.wait(wait)
+                    else:
+                        self.Condition.wait()
+                if not self.Running:
+                    break
+                if self.Burst > 0:
+                    self.Burst -= 1
+                self.Ammo -= 1
+                self.Shots += 1
+                scheduled = self.NextShotTime
+
+            try:
+                self.fire(scheduled)
+            except Exception as e:
+                logger.error("Trigger I/O failed: " + str(e))
+    # ------------------------------------------------------------------------------------------
+
+    def fire(self, scheduled):
+        start = FireControl.wait_until(scheduled)
+        self.WriteTrigger(1)
+        if self.OnShot is not None:
+            self.OnShot()
+        end = FireControl.wait_until(start + self.Duration)
+        self.WriteTrigger(0)
+
+        # A late shot does not shift the ones after it, the schedule follows the rate and not the shots.
+        # The trigger must be seen released before the next pulse, or consecutive pulses merge into one
+        period = (self.Rate + random.randint(0, self.Rate // 4)) / 1000.0
+        self.NextShotTime = max(scheduled + period, end + self.Release)
+
+        late = (start - scheduled) * 1000.0
+        self.StartError.add(late)
+        self.PulseError.add((end - start - self.Duration) * 1000.0)
+        if self.PulseHistogram is not None:
+            self.PulseHistogram.observe(late / 1000.0)
+    # ------------------------------------------------------------------------------------------
+
+    # Sleeps most of the way and spins the rest, returns the monotonic time reached
+    @staticmethod
+    def wait_until(deadline):
+        remaining = deadline - time.monotonic()
+        if remaining > FireControl.SPIN_TIME:
+            time.sleep(remaining - FireControl.SPIN_TIME)
+        now = time.monotonic()
+        while now < deadline:
+            now = time.monotonic()
+        return now
+    # ------------------------------------------------------------------------------------------
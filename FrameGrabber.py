@@ -0,0 +1,123 @@
+from Utils import Utils
+
+import collections
+import threading
+import time
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Reads frames from the capture on a dedicated thread into a small bounded ring buffer.
+# The consumer always takes the newest frame, stale ones are dropped.
+class FrameGrabber(object):
+
+    def __init__(self, capture, buffer_size=2, read_timeout=0.1, on_frame=None):
+        self.Capture = capture
+        self.Buffer = collections.deque(maxlen=max(1, buffer_size))
+        # Frame slots are recycled between the ring, the consumer and the capture thread,
+        # so after warm up the camera decodes straight into already allocated arrays
+        self.FreeSlots = collections.deque([None] * (self.Buffer.maxlen + 1))
+        self.Condition = threading.Condition()
+        self.ReadTimeout = read_timeout
+        # Called on the capture thread after every new frame
+        self.OnFrame = on_frame
+        self.Thread = None
+        self.Running = False
+        self.LastFrame = None
+        self.LastTimestamp = 0
+        self.CapturedFrames = 0
+        self.DroppedFrames = 0
+        self.DuplicateFrames = 0
+    # ------------------------------------------------------------------------------------------
+
+    def start(self):
+        if self.Running:
+            return self
+
+        self.Running = True
+        self.Thread = threading.Thread(target=self.run, name="FrameGrabber", daemon=True)
+        self.Thread.start()
+        return self
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        with self.Condition:
+            self.Running = False
+            self.Condition.notify_all()
+
+        if self.Thread is not None:
+            self.Thread.join(timeout=1.0)
+            self.Thread = None
+
+        logger.info("Captured: {}, dropped: {}, duplicates: {}".format(
+            self.CapturedFrames, self.DroppedFrames, self.DuplicateFrames))
+    # ------------------------------------------------------------------------------------------
+
+    def run(self):
+        while self.Running:
+            with self.Condition:
+                if self.FreeSlots:
+                    slot = self.FreeSlots.popleft()
+                else:
+                    # The oldest frame is pushed out of the ring without being consumed
+                    slot = self.Buffer.popleft()[0]
+                    self.DroppedFrames += 1
+
+            ok, frame = self.Capture.read(slot)
+            timestamp = Utils.now_ms()
+            if not ok or frame is None:
+                with self.Condition:
+                    self.FreeSlots.append(slot)
+                # Camera is not ready or got disconnected, do not spin
+                time.sleep(0.01)
+                continue
+
+            with self.Condition:
+                self.Buffer.append((frame, timestamp))
+                self.CapturedFrames += 1
+                self.Condition.notify_all()
+
+            if self.OnFrame is not None:
+                self.OnFrame()
+    # ------------------------------------------------------------------------------------------
+
+    # Same contract as cv2.VideoCapture.read(). Waits up to timeout seconds for a new frame,
+    # otherwise returns the previous one again and counts it as a duplicate.
+    # The monotonic capture time of the returned frame is in LastTimestamp
+    def read(self, timeout=None):
+        if timeout is None:
+            timeout = self.ReadTimeout
+
+        with self.Condition:
+            if not self.Buffer and self.Running and timeout > 0:
+                self.Condition.wait_for(lambda: self.Buffer or not self.Running, timeout)
+
+            if self.Buffer:
+                (frame, self.LastTimestamp) = self.Buffer.pop()
+                self.DroppedFrames += len(self.Buffer)
+                self.FreeSlots.extend(slot for (slot, _) in self.Buffer)
+                self.Buffer.clear()
+                # The previous frame is not referenced by the consumer anymore
+                if self.LastFrame is not None:
+                    self.FreeSlots.append(self.LastFrame)
+                self.LastFrame = frame
+            elif self.LastFrame is not None:
+                self.DuplicateFrames += 1
+
+        return self.LastFrame is not None, self.LastFrame
+    # ------------------------------------------------------------------------------------------
+
+    # A new frame is waiting, read() will return without waiting
+    def has_frame(self):
+        return len(self.Buffer) > 0
+    # ------------------------------------------------------------------------------------------
+
+    def get_stats(self):
+        return self.CapturedFrames, self.DroppedFrames, self.DuplicateFrames
+    # ------------------------------------------------------------------------------------------
@@ -0,0 +1,243 @@
+from Utils import Utils
+
+import datetime
+import glob
+import os
+import time
+import numpy as np
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MAGIC = b"TJRN"
+JOURNAL_VERSION = 1
+
+# Segment header, the clock pair maps the monotonic record times of the segment to the wall clock
+HEADER_DTYPE = np.dtype([("magic", "S4"), ("version", "<u4"), ("record_size", "<u4"), ("index_interval", "<u4"),
+                         ("capacity", "<u8"), ("count", "<u8"), ("wall_time", "<f8"), ("monotonic_time", "<f8"),
+                         ("reserved", "<u8", 2)])
+
+# One record per processed frame: capture time in monotonic ms, state machine state, detected flag,
+# target and largest blob area in capture pixels, commanded yaw/pitch and ammo left
+RECORD_DTYPE = np.dtype([("time", "<f8"), ("state", "u1"), ("detected", "u1"), ("blobs", "<u2"),
+                         ("x", "<f4"), ("y", "<f4"), ("area", "<f4"), ("yaw", "<f4"), ("pitch", "<f4"),
+                         ("ammo", "<i4"), ("reserved", "<u4")])
+
+# Query results carry the wall clock time of every record
+RESULT_DTYPE = np.dtype([("wall_time", "<f8")] + [(name, RECORD_DTYPE[name]) for name in RECORD_DTYPE.names
+                                                  if name != "reserved"])
+
+
+# Segment file layout: header | sparse index | records. The index holds the time of every index_interval-th
+# record, so a time window is found from the index alone and only the records inside it are touched
+class JournalSegment(object):
+
+    def __init__(self, path, mode="r", capacity=0, index_interval=0):
+        self.Path = path
+        if mode == "w+":
+            index_size = capacity // index_interval + 1
+            size = HEADER_DTYPE.itemsize + index_size * 8 + capacity * RECORD_DTYPE.itemsize
+            self.Map = np.memmap(path, np.uint8, mode="w+", shape=(size,))
+            header = self.Map[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+            header["magic"] = JOURNAL_MAGIC
+            header["version"] = JOURNAL_VERSION
+            header["record_size"] = RECORD_DTYPE.itemsize
+            header["index_interval"] = index_interval
+            header["capacity"] = capacity
+            header["count"] = 0
+            header["wall_time"] = time.time()
+            header["monotonic_time"] = Utils.now_ms()
+        else:
+            self.Map = np.memmap(path, np.uint8, mode=mode)
+
+        self.Header = self.Map[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if bytes(self.Header["magic"]) != JOURNAL_MAGIC or self.Header["record_size"] != RECORD_DTYPE.itemsize:
+            raise ValueError("Not a journal segment: " + path)
+        self.Capacity = int(self.Header["capacity"])
+        self.IndexInterval = int(self.Header["index_interval"])
+        offset = HEADER_DTYPE.itemsize
+        index_size = self.Capacity // self.IndexInterval + 1
+        self.Index = self.Map[offset:offset + index_size * 8].view("<f8")
+        offset += index_size * 8
+        self.Records = self.Map[offset:offset + self.Capacity * RECORD_DTYPE.itemsize].view(RECORD_DTYPE)
+        self.WallTime = float(self.Header["wall_time"])
+        self.MonotonicTime = float(self.Header["monotonic_time"])
+    # ------------------------------------------------------------------------------------------
+
+    def get_count(self):
+        return int(self.Header["count"])
+    # ------------------------------------------------------------------------------------------
+
+    # Wall clock seconds of monotonic record times
+    def to_wall(self, times):
+        return self.WallTime + (times - self.MonotonicTime) / 1000.0
+    # ------------------------------------------------------------------------------------------
+
+    def to_monotonic(self, wall_time):
+        return self.MonotonicTime + (wall_time - self.WallTime) * 1000.0
+    # ------------------------------------------------------------------------------------------
+
+    # Records from start to end wall clock seconds, located through the index
+    def query(self, start, end):
+        count = self.get_count()
+        if count == 0:
+            return np.empty(0, RESULT_DTYPE)
+        begin_time = self.to_monotonic(start)
+        end_time = self.to_monotonic(end)
+
+        # Index entries bound the records to a block range, the search inside only touches those blocks
+        entries = (count - 1) // self.IndexInterval + 1
+        index = self.Index[:entries]
+        first = max(int(np.searchsorted(index, begin_time, side="left")) - 1, 0) * self.IndexInterval
+        last = min(int(np.searchsorted(index, end_time, side="right")) * self.IndexInterval, count)
+        times = self.Records["time"][first:last]
+        lo = first + int(np.searchsorted(times, begin_time, side="left"))
+        hi = first + int(np.searchsorted(times, end_time, side="right"))
+
+        records = self.Records[lo:hi]
+        result = np.empty(len(records), RESULT_DTYPE)
+        for name in RESULT_DTYPE.names[1:]:
+            result[name] = records[name]
+        result["wall_time"] = self.to_wall(records["time"])
+        return result
+    # ------------------------------------------------------------------------------------------
+
+    def get_time_range(self):
+        count = self.get_count()
+        if count == 0:
+            return self.WallTime, self.WallTime
+        return float(self.to_wall(self.Records[0]["time"])), float(self.to_wall(self.Records[count - 1]["time"]))
+    # ------------------------------------------------------------------------------------------
+
+    def flush(self):
+        self.Map.flush()
+    # ------------------------------------------------------------------------------------------
+
+    def close(self):
+        # The mapping goes away with the last view of it
+        self.Header = self.Index = self.Records = None
+        self.Map = None
+    # ------------------------------------------------------------------------------------------
+
+
+# Append-only detection journal in memory-mapped segment files. An append is a store into the mapping,
+# the segment is preallocated and a new one started when it is full, segments past the retention are deleted
+class Journal(object):
+
+    def __init__(self, directory, segment_size, index_interval, retention, flush_interval):
+        self.Directory = directory
+        self.Capacity = max(1, segment_size // RECORD_DTYPE.itemsize)
+        self.IndexInterval = max(1, index_interval)
+        self.Retention = retention * 86400.0
+        self.FlushInterval = flush_interval * 1000.0
+        self.Segment = None
+        self.Count = 0
+        self.LastTime = None
+        self.LastFlushTime = Utils.now_ms()
+        self.Records = 0
+        os.makedirs(self.Directory, exist_ok=True)
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def create(settings):
+        if not settings.JournalEnabled:
+            return None
+        return Journal(settings.JournalDirectory, settings.JournalSegmentSize * 1024 * 1024,
+                       settings.JournalIndexInterval, settings.JournalRetention, settings.JournalFlushInterval)
+    # ------------------------------------------------------------------------------------------
+
+    def append(self, frame_time, state, detected, x, y, blobs, area, yaw, pitch, ammo):
+        # Times must not go back inside a segment, the index search relies on it
+        if self.LastTime is not None and frame_time < self.LastTime:
+            frame_time = self.LastTime
+        if self.Segment is None or self.Count == self.Capacity:
+            self.rotate()
+
+        self.Segment.Records[self.Count] = (frame_time, state, detected, min(blobs, 65535), x, y, area, yaw, pitch,
+                                            ammo, 0)
+        if self.Count % self.IndexInterval == 0:
+            self.Segment.Index[self.Count // self.IndexInterval] = frame_time
+        # The count is published last, a reader never sees a half written record
+        self.Count += 1
+        self.Segment.Header["count"] = self.Count
+        self.LastTime = frame_time
+        self.Records += 1
+
+        if self.FlushInterval > 0 and frame_time - self.LastFlushTime > self.FlushInterval:
+            self.Segment.flush()
+            self.LastFlushTime = frame_time
+    # ------------------------------------------------------------------------------------------
+
+    def rotate(self):
+        if self.Segment is not None:
+            self.Segment.flush()
+            self.Segment.close()
+        name = "journal_{}.jrn".format(datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f"))
+        path = os.path.join(self.Directory, name)
+        self.Segment = JournalSegment(path, "w+", self.Capacity, self.IndexInterval)
+        self.Count = 0
+        self.LastTime = None
+        logger.info("Journal segment {}, {} records".format(path, self.Capacity))
+        self.expire()
+    # ------------------------------------------------------------------------------------------
+
+    def expire(self):
+        if self.Retention <= 0:
+            return
+        limit = time.time() - self.Retention
+        for path in sorted(glob.glob(os.path.join(self.Directory, "journal_*.jrn"))):
+            if os.path.getmtime(path) < limit and path != self.Segment.Path:
+                os.remove(path)
+                logger.info("Removed expired journal segment " + path)
+    # ------------------------------------------------------------------------------------------
+
+    def close(self):
+        if self.Segment is not None:
+            self.Segment.flush()
+            self.Segment.close()
+            self.Segment = None
+        logger.info("Journal records: {}".format(self.Records))
+    # ------------------------------------------------------------------------------------------
+
+
+# Time window queries over all segments of a journal directory. Segments are picked by their header
+# time range, so a query opens only the few segments overlapping the window
+class JournalReader(object):
+
+    def __init__(self, directory):
+        self.Directory = directory
+    # ------------------------------------------------------------------------------------------
+
+    # (path, first wall time, last wall time, records) of every segment, oldest first
+    def get_segments(self):
+        segments = []
+        for path in glob.glob(os.path.join(self.Directory, "journal_*.jrn")):
+            try:
+                segment = JournalSegment(path)
+            except (OSError, ValueError) as e:
+                logger.error("Skipping journal segment {}: {}".format(path, str(e)))
+                continue
+            (first, last) = segment.get_time_range()
+            segments.append((path, first, last, segment.get_count()))
+            segment.close()
+        segments.sort(key=lambda item: item[1])
+        return segments
+    # ------------------------------------------------------------------------------------------
+
+    def query(self, start, end):
+        results = []
+        for (path, first, last, count) in self.get_segments():
+            if count == 0 or last < start or first > end:
+                continue
+            segment = JournalSegment(path)
+            results.append(segment.query(start, end))
+            segment.close()
+        if not results:
+            return np.empty(0, RESULT_DTYPE)
+        return np.concatenate(results)
+    # ------------------------------------------------------------------------------------------
@@ -0,0 +1,49 @@
+import threading
+import numpy as np
+
+
+# Rolling latency distribution over the last window samples, in milliseconds.
+# Samples may be added from any thread
+class LatencyMonitor(object):
+
+    def __init__(self, name, window=300):
+        self.Name = name
+        self.Samples = np.zeros(max(1, window), np.float64)
+        self.Index = 0
+        self.Count = 0
+        self.Total = 0
+        self.Lock = threading.Lock()
+    # ------------------------------------------------------------------------------------------
+
+    def add(self, latency):
+        with self.Lock:
+            self.Samples[self.Index] = latency
+            self.Index = (self.Index + 1) % len(self.Samples)
+            self.Count = min(self.Count + 1, len(self.Samples))
+            self.Total += 1
+    # ------------------------------------------------------------------------------------------
+
+    def get_percentile(self, percent):
+        with self.Lock:
+            if self.Count == 0:
+                return 0
+            return float(np.percentile(self.Samples[:self.Count], percent))
+    # ------------------------------------------------------------------------------------------
+
+    def get_stats(self):
+        with self.Lock:
+            samples = self.Samples[:self.Count].copy()
+
+        if len(samples) == 0:
+            return {"count": 0, "mean": 0, "p50": 0, "p95": 0, "p99": 0, "max": 0}
+
+        (p50, p95, p99) = np.percentile(samples, [50, 95, 99])
+        return {"count": self.Total, "mean": float(samples.mean()), "p50": float(p50), "p95": float(p95),
+                "p99": float(p99), "max": float(samples.max())}
+    # ------------------------------------------------------------------------------------------
+
+    def format(self):
+        stats = self.get_stats()
+        return "{} latency ms: mean {:.1f}, p50 {:.1f}, p95 {:.1f}, p99 {:.1f}, max {:.1f} ({} samples)".format(
+            self.Name, stats["mean"], stats["p50"], stats["p95"], stats["p99"], stats["max"], stats["count"])
+    # ------------------------------------------------------------------------------------------
@@ -0,0 +1,272 @@
+import bisect
+import os
+import threading
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+# Stage and I/O durations in seconds, from well below a millisecond up to a stalled frame
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+# Monotonically increasing value
+class Counter(object):
+
+    def __init__(self):
+        self.Value = 0
+        self.Lock = threading.Lock()
+    # ------------------------------------------------------------------------------------------
+
+    def inc(self, amount=1):
+        with self.Lock:
+            self.Value += amount
+    # ------------------------------------------------------------------------------------------
+
+    def export(self, name, labels):
+        return ["{}{} {}".format(name, MetricsRegistry.format_labels(labels), self.Value)]
+    # ------------------------------------------------------------------------------------------
+
+
+# Fixed bucket histogram, observing a value is a binary search and two additions
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.Buckets = tuple(sorted(buckets))
+        self.Counts = [0] * (len(self.Buckets) + 1)
+        self.Sum = 0
+        self.Lock = threading.Lock()
+    # ------------------------------------------------------------------------------------------
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.Buckets, value)
+        with self.Lock:
+            self.Counts[index] += 1
+            self.Sum += value
+    # ------------------------------------------------------------------------------------------
+
+    def export(self, name, labels):
+        with self.Lock:
+            counts = list(self.Counts)
+            total = self.Sum
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.Buckets + ("+Inf",), counts):
+            cumulative += count
+            lines.append("{}_bucket{} {}".format(name, MetricsRegistry.format_labels(labels, le=bound), cumulative))
+        lines.append("{}_sum{} {}".format(name, MetricsRegistry.format_labels(labels), total))
+        lines.append("{}_count{} {}".format(name, MetricsRegistry.format_labels(labels), cumulative))
+        return lines
+    # ------------------------------------------------------------------------------------------
+
+
+# Value read from its owner at export time, for counters the owner already keeps
+class Callback(object):
+
+    def __init__(self, func):
+        self.Func = func
+    # ------------------------------------------------------------------------------------------
+
+    def export(self, name, labels):
+        return ["{}{} {}".format(name, MetricsRegistry.format_labels(labels), self.Func())]
+    # ------------------------------------------------------------------------------------------
+
+
+# Stands for every metric when metrics are disabled
+class NullMetric(object):
+
+    def inc(self, amount=1):
+        pass
+    # ------------------------------------------------------------------------------------------
+
+    def observe(self, value):
+        pass
+    # ------------------------------------------------------------------------------------------
+
+
+# Named, labelled metrics shared by all modules. Metrics are created once and then updated
+# from any thread, the text exposition format is only built when somebody asks for it
+class MetricsRegistry(object):
+
+    def __init__(self, enabled=True):
+        self.Enabled = enabled
+        self.Families = dict()
+        self.Lock = threading.Lock()
+        self.Null = NullMetric()
+        self.Exporter = None
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def create(settings):
+        registry = MetricsRegistry(settings.MetricsEnabled)
+        if not settings.MetricsEnabled:
+            return registry
+
+        if settings.MetricsExport == "file":
+            registry.Exporter = MetricsFileWriter(registry, settings.MetricsFile, settings.MetricsInterval)
+        else:
+            registry.Exporter = MetricsServer(registry, settings.MetricsPort)
+        registry.Exporter.start()
+        return registry
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        if self.Exporter is not None:
+            self.Exporter.stop()
+            self.Exporter = None
+    # ------------------------------------------------------------------------------------------
+
+    def counter(self, name, help_text, **labels):
+        return self.get_metric(name, help_text, "counter", lambda: Counter(), labels)
+    # ------------------------------------------------------------------------------------------
+
+    def histogram(self, name, help_text, buckets=DURATION_BUCKETS, **labels):
+        return self.get_metric(name, help_text, "histogram", lambda: Histogram(buckets), labels)
+    # ------------------------------------------------------------------------------------------
+
+    # type is counter or gauge, func must be cheap and safe to call from the exporter thread
+    def callback(self, name, help_text, metric_type, func, **labels):
+        return self.get_metric(name, help_text, metric_type, lambda: Callback(func), labels)
+    # ------------------------------------------------------------------------------------------
+
+    def get_metric(self, name, help_text, metric_type, factory, labels):
+        if not self.Enabled:
+            return self.Null
+
+        key = MetricsRegistry.format_labels(labels)
+        with self.Lock:
+            family = self.Families.get(name)
+            if family is None:
+                family = self.Families[name] = (help_text, metric_type, dict())
+            entry = family[2].get(key)
+            if entry is None:
+                entry = family[2][key] = (labels, factory())
+        return entry[1]
+    # ------------------------------------------------------------------------------------------
+
+    # Prometheus text exposition format
+    def export(self):
+        with self.Lock:
+            families = [(name, family[0], family[1], list(family[2].values()))
+                        for name, family in sorted(self.Families.items())]
+
+        lines = []
+        for name, help_text, metric_type, metrics in families:
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for labels, metric in metrics:
+                try:
+                    lines.extend(metric.export(name, labels))
+                except Exception as e:
+                    logger.error("Failed to export {}: {}".format(name, str(e)))
+        return "\n".join(lines) + "\n"
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def format_labels(labels, **extra):
+        items = sorted(labels.items()) + list(extra.items())
+        if not items:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(key, value) for key, value in items) + "}"
+    # ------------------------------------------------------------------------------------------
+
+
+# Serves the registry on http://127.0.0.1:port/metrics for a local scraper or agent
+class MetricsServer(object):
+
+    def __init__(self, registry, port):
+        self.Registry = registry
+        self.Port = port
+        self.Server = None
+        self.Thread = None
+    # ------------------------------------------------------------------------------------------
+
+    def start(self):
+        registry = self.Registry
+
+        # Loaded only when metrics are served
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.export().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.Server = ThreadingHTTPServer(("127.0.0.1", self.Port), Handler)
+            self.Server.daemon_threads = True
+        except OSError as e:
+            logger.error("Failed to start metrics server on port {}: {}".format(self.Port, str(e)))
+            return
+
+        self.Thread = threading.Thread(target=self.Server.serve_forever, name="MetricsServer", daemon=True)
+        self.Thread.start()
+        logger.info("Serving metrics on http://127.0.0.1:{}/metrics".format(self.Port))
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        if self.Server is not None:
+            self.Server.shutdown()
+            self.Server.server_close()
+            self.Server = None
+        if self.Thread is not None:
+            self.Thread.join(timeout=1.0)
+            self.Thread = None
+    # ------------------------------------------------------------------------------------------
+
+
+# Rewrites the file every interval seconds, e.g. for the node exporter textfile collector.
+# The file is replaced atomically, so readers never see a partial export
+class MetricsFileWriter(object):
+
+    def __init__(self, registry, path, interval):
+        self.Registry = registry
+        self.Path = path
+        self.Interval = max(interval, 0.1)
+        self.Stopped = threading.Event()
+        self.Thread = None
+    # ------------------------------------------------------------------------------------------
+
+    def start(self):
+        self.Thread = threading.Thread(target=self.run, name="MetricsFileWriter", daemon=True)
+        self.Thread.start()
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        self.Stopped.set()
+        if self.Thread is not None:
+            self.Thread.join(timeout=1.0)
+            self.Thread = None
+        # Final values of the run
+        self.flush()
+    # ------------------------------------------------------------------------------------------
+
+    def run(self):
+        while not self.Stopped.wait(self.Interval):
+            self.flush()
+    # ------------------------------------------------------------------------------------------
+
+    def flush(self):
+        temp_path = self.Path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                f.write(self.Registry.export())
+            os.replace(temp_path, self.Path)
+        except OSError as e:
+            logger.error("Failed to write metrics to {}: {}".format(self.Path, str(e)))
+    # ------------------------------------------------------------------------------------------
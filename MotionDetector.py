@@ -1,8 +1,15 @@
 from Vector2 import Vector2
 from Utils import Utils
+from FrameGrabber import FrameGrabber
+from VideoSource import VideoSource
+from Profiler import Profiler
+from BackgroundModel import BackgroundModel
+from BlobExtractor import BlobExtractor, BLOB_X, BLOB_Y, BLOB_W, BLOB_H, BLOB_AREA
+from Tracker import Tracker
+from LatencyMonitor import LatencyMonitor
 
 import cv2
-import imutils
+import numpy as np
 import logging
 
 # Enable logging
@@ -15,22 +22,60 @@ logger = logging.getLogger(__name__)
 
 class MotionDetector(object):
 
-    def __init__(self, settings):
+    def __init__(self, settings, source=None, profiler=None, metrics=None):
         self.Settings = settings
         self.Detected = False
-        self.Capture = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+        self.Capture = VideoSource.open(source)
         #self.Capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
         #self.Capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        self.FirstFrame = None
+        self.Profiler = profiler if profiler is not None else Profiler(enabled=False)
+        self.EndOfStream = False
+        # Monotonic capture time of the current frame and the capture to detection latency
+        self.FrameTime = 0
+        self.DetectionLatency = LatencyMonitor("Detection", self.Settings.LatencyWindow)
+        self.Grabber = None
+        # Recorded sources are replayed frame by frame, only the live camera may drop frames
+        if self.Settings.CaptureThreaded and VideoSource.is_live(source):
+            self.Grabber = FrameGrabber(self.Capture, self.Settings.CaptureBufferSize).start()
+            if metrics is not None:
+                metrics.callback("turret_frames_captured_total", "Frames read from the camera", "counter",
+                                 lambda: self.Grabber.CapturedFrames)
+                metrics.callback("turret_frames_dropped_total", "Camera frames replaced before processed", "counter",
+                                 lambda: self.Grabber.DroppedFrames)
+                metrics.callback("turret_frames_duplicate_total", "Frames processed again for lack of a new one",
+                                 "counter", lambda: self.Grabber.DuplicateFrames)
+        # Processing quality, changed at runtime by the quality controller
+        self.ResizeWidth = 500
+        self.BlurKernel = 21
+        self.DilateIterations = 2
+        self.Threshold = 50
+        self.DetectEvery = 1
+        self.FrameCounter = 0
+        self.SkippedDelta = 0
+        self.CaptureWait = 0
+        self.set_quality(self.Settings.QualityTiers[0])
+        # Working buffers, allocated once per resolution and then reused through dst= outputs
+        self.SourceShape = None
+        self.RawFrame = None
+        self.Background = BackgroundModel.create(self.Settings)
+        self.Extractor = BlobExtractor.create(self.Settings)
+        self.Blobs = self.Extractor.Empty
+        # Blobs found in the frame, before trace_max_object keeps only the largest one
+        self.BlobCount = 0
+        self.UpdateMask = None
         self.Frame = None
+        # Lens undistortion, the frame is resized into Resized and remapped into Frame
+        self.Calibration = None
+        self.UndistortMaps = None
+        self.Resized = None
+        self.Mask = None
         self.Thresh = None
         self.FrameDelta = None
         self.Contours = None
         self.gray = None
         self.LastMotionTime = Utils.millis()
         self.Target = Vector2()
-        self.Targets = []
-        self.TargetPathLen = 20
+        self.Tracker = Tracker(self.Settings)
         self.Speed = Vector2()
         self.Active = False
 
@@ -50,8 +95,11 @@ class MotionDetector(object):
 
     def stop(self):
         logger.info("Stopping...")
+        if self.Grabber is not None:
+            self.Grabber.stop()
         self.Capture.release()
-        cv2.destroyAllWindows()
+        if not self.Settings.Headless and self.Settings.RenderMode != "headless":
+            cv2.destroyAllWindows()
     # ------------------------------------------------------------------------------------------
 
     def draw_cross(self, point, size):
@@ -66,13 +114,20 @@ class MotionDetector(object):
     # ------------------------------------------------------------------------------------------
 
     def draw(self):
+        for blob in self.Blobs:
+            self.draw_contour(int(blob[BLOB_X]), int(blob[BLOB_Y]), int(blob[BLOB_W]), int(blob[BLOB_H]),
+                              blob[BLOB_AREA])
+
         self.draw_cross(self.Target, 20)
 
-        for i in range(0, len(self.Targets) - 1):
-            target = self.Targets[i]
-            next_target = self.Targets[i+1]
-            cv2.line(self.Frame, (int(target.X), int(target.Y)), (int(next_target.X), int(next_target.Y)),
-                     (0, 255, 0), 2)
+        for track in self.Tracker.Tracks:
+            primary = track.Id == self.Tracker.PrimaryId
+            cv2.polylines(self.Frame, [track.get_history().astype(np.int32)], False,
+                          (0, 255, 0) if primary else (0, 128, 0), 2 if primary else 1)
+
+        lead = self.Tracker.predict(self.Settings.TrackerLeadTime)
+        if lead is not None:
+            self.draw_cross(lead, 10)
     # ------------------------------------------------------------------------------------------
 
     def flush(self):
@@ -98,7 +153,13 @@ class MotionDetector(object):
 
     def reset(self):
         logger.info("Reset")
-        self.FirstFrame = None
+        self.Background.reset()
+        # Tracks of the old background would pick up the first blobs after the reset
+        self.Tracker.reset()
+        self.Target = Vector2()
+        self.Speed = Vector2()
+        self.Blobs = self.Extractor.Empty
+        self.BlobCount = 0
     # ------------------------------------------------------------------------------------------
 
     def get_last_motion_time(self):
@@ -109,92 +170,235 @@ class MotionDetector(object):
         return self.Detected
     # ------------------------------------------------------------------------------------------
 
+    # Live cameras deliver frames at their own rate, recorded sources always have the next one ready
+    def is_live(self):
+        return self.Grabber is not None
+    # ------------------------------------------------------------------------------------------
+
+    def frame_ready(self):
+        return self.Grabber is None or self.Grabber.has_frame()
+    # ------------------------------------------------------------------------------------------
+
+    # Takes effect with the next buffer allocation
+    def set_calibration(self, calibration):
+        self.Calibration = calibration
+        self.SourceShape = None
+    # ------------------------------------------------------------------------------------------
+
+    def set_frame_callback(self, callback):
+        if self.Grabber is not None:
+            self.Grabber.OnFrame = callback
+    # ------------------------------------------------------------------------------------------
+
     def set_active(self, active):
         self.Active = active
     # ------------------------------------------------------------------------------------------
 
-    # TODO: add prediction
     def get_target(self):
         return self.Target
     # ------------------------------------------------------------------------------------------
 
+    # Blob count and largest blob area of the current frame, in processing pixels
+    def get_blob_stats(self):
+        if len(self.Blobs) == 0:
+            return self.BlobCount, 0
+        return self.BlobCount, float(self.Blobs[:, BLOB_AREA].max())
+    # ------------------------------------------------------------------------------------------
+
+    # Where the primary target is expected to be t_ahead_ms from now, the last target if nothing is tracked
+    def predict_target(self, t_ahead_ms):
+        target = self.Tracker.predict(t_ahead_ms)
+        return target if target is not None else self.Target
+    # ------------------------------------------------------------------------------------------
+
+    def set_quality(self, tier):
+        self.ResizeWidth = tier["width"]
+        self.BlurKernel = tier["blur"] | 1
+        self.DilateIterations = tier["dilate"]
+        self.Threshold = tier["threshold"]
+        self.DetectEvery = max(tier["detect_every"], 1)
+    # ------------------------------------------------------------------------------------------
+
+    def read_frame(self):
+        if self.Grabber is not None:
+            # Time spent waiting for the camera is not processing time
+            start = Utils.now_ms()
+            ok, frame = self.Grabber.read()
+            self.CaptureWait = Utils.now_ms() - start
+            self.FrameTime = self.Grabber.LastTimestamp
+            return ok, frame
+
+        # Let the capture decode into the previous frame when it can
+        ok, self.RawFrame = self.Capture.read(self.RawFrame)
+        self.FrameTime = Utils.now_ms()
+        return ok, self.RawFrame
+    # ------------------------------------------------------------------------------------------
+
+    def allocate_buffers(self, source_shape):
+        (src_height, src_width) = source_shape[:2]
+        width = self.ResizeWidth
+        height = int(src_height * width / float(src_width))
+
+        # Keep tracks and the minimum area consistent with the new resolution
+        if self.Frame is not None:
+            self.Tracker.rescale(width / float(self.Frame.shape[1]))
+        reference_width = self.Settings.QualityTiers[0]["width"]
+        self.Extractor.MinArea = self.Settings.DetectorMinArea * (width / float(reference_width)) ** 2
+
+        self.SourceShape = source_shape
+        self.Frame = np.empty((height, width, 3), np.uint8)
+        self.gray = np.empty((height, width), np.uint8)
+        self.FrameDelta = np.empty((height, width), np.uint8)
+        self.Mask = np.zeros((height, width), np.uint8)
+        self.Thresh = np.zeros((height, width), np.uint8)
+        self.ThreshRegion = None
+        self.UpdateMask = np.empty((height, width), np.uint8)
+        self.Tiles = np.empty((self.Settings.PrescreenRows, self.Settings.PrescreenCols), np.uint8)
+        self.TileMask = np.empty_like(self.Tiles)
+        self.Background.allocate((height, width))
+        self.Extractor.allocate((height, width))
+        self.UndistortMaps = None
+        if self.Calibration is not None:
+            self.UndistortMaps = self.Calibration.get_undistort_maps(width, height)
+        self.Resized = np.empty_like(self.Frame) if self.UndistortMaps is not None else None
+
+        logger.info("Processing dimensions: {} x {}".format(width, height))
+    # ------------------------------------------------------------------------------------------
+
+    # Reduces the frame delta to a grid of per-tile means. Returns the region (x, y, w, h) around the tiles
+    # exceeding the threshold, expanded by the margin, or None if the scene is still
+    def prescreen(self):
+        (height, width) = self.FrameDelta.shape
+        if not self.Settings.PrescreenEnabled:
+            return 0, 0, width, height
+
+        # Integer tile size keeps INTER_AREA on its fast path, the few remainder pixels
+        # at the right and bottom edges are left out of the grid
+        (rows, cols) = self.Tiles.shape
+        (tile_w, tile_h) = (width // cols, height // rows)
+        cv2.resize(self.FrameDelta[:rows * tile_h, :cols * tile_w], (cols, rows), dst=self.Tiles,
+                   interpolation=cv2.INTER_AREA)
+        cv2.threshold(self.Tiles, self.Settings.PrescreenThreshold, 255, cv2.THRESH_BINARY, dst=self.TileMask)
+        if cv2.countNonZero(self.TileMask) == 0:
+            return None
+
+        (tx, ty, tw, th) = cv2.boundingRect(self.TileMask)
+        margin = self.Settings.PrescreenMargin
+        x0 = max(tx - margin, 0) * tile_w
+        y0 = max(ty - margin, 0) * tile_h
+        x1 = width if tx + tw + margin >= cols else (tx + tw + margin) * tile_w
+        y1 = height if ty + th + margin >= rows else (ty + th + margin) * tile_h
+        return x0, y0, x1 - x0, y1 - y0
+    # ------------------------------------------------------------------------------------------
+
+    # Thresholds and dilates the delta inside the region only, everything outside stays zero
+    def threshold_region(self, region):
+        if self.ThreshRegion is not None and self.ThreshRegion != region:
+            (x, y, w, h) = self.ThreshRegion
+            self.Mask[y:y + h, x:x + w] = 0
+            self.Thresh[y:y + h, x:x + w] = 0
+        self.ThreshRegion = region
+
+        if region is None:
+            return None
+
+        (x, y, w, h) = region
+        mask = self.Mask[y:y + h, x:x + w]
+        thresh = self.Thresh[y:y + h, x:x + w]
+        cv2.threshold(self.FrameDelta[y:y + h, x:x + w], self.Threshold, 255, cv2.THRESH_BINARY, dst=mask)
+        # dilate the thresholded image to fill in holes
+        cv2.dilate(mask, None, dst=thresh, iterations=self.DilateIterations)
+        return thresh
+    # ------------------------------------------------------------------------------------------
+
     def update(self, delta):
-        _, self.Frame = self.Capture.read()
+        self.Profiler.begin()
+        ok, frame = self.read_frame()
+        self.Profiler.lap("capture")
 
-        prev_detected = self.Detected
-        self.Detected = False
+        if not ok or frame is None:
+            if self.Grabber is None:
+                self.EndOfStream = True
+            return
+
+        if frame.shape != self.SourceShape or self.Frame.shape[1] != self.ResizeWidth:
+            self.allocate_buffers(frame.shape)
 
         # resize the frame, convert it to grayscale, and blur it
-        self.Frame = imutils.resize(image=self.Frame, width=500)
+        if self.UndistortMaps is None:
+            cv2.resize(frame, (self.Frame.shape[1], self.Frame.shape[0]), dst=self.Frame, interpolation=cv2.INTER_AREA)
+        else:
+            cv2.resize(frame, (self.Frame.shape[1], self.Frame.shape[0]), dst=self.Resized, interpolation=cv2.INTER_AREA)
+            cv2.remap(self.Resized, self.UndistortMaps[0], self.UndistortMaps[1], cv2.INTER_LINEAR, dst=self.Frame)
+        self.Profiler.lap("resize")
 
         if not self.Active:
+            self.Detected = False
+            return
+
+        # Reduced detection frequency, the previous detection result stands for the skipped frames
+        self.FrameCounter += 1
+        if self.FrameCounter % self.DetectEvery != 0:
+            self.SkippedDelta += delta
             return
+        delta += self.SkippedDelta
+        self.SkippedDelta = 0
+
+        self.Detected = False
 
-        self.gray = cv2.cvtColor(self.Frame, cv2.COLOR_BGR2GRAY)
-        self.gray = cv2.GaussianBlur(self.gray, (21, 21), 0)
+        cv2.cvtColor(self.Frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        cv2.GaussianBlur(self.gray, (self.BlurKernel, self.BlurKernel), 0, dst=self.gray)
+        self.Profiler.lap("blur")
 
-        # if the first frame is None, initialize it
-        if self.FirstFrame is None:
-            self.FirstFrame = self.gray
+        # compute the absolute difference between the current frame and the background,
+        # the first frame after start or reset only seeds the background model
+        if not self.Background.difference(self.gray, self.FrameDelta):
             return
 
-        # compute the absolute difference between the current frame and first frame
-        self.FrameDelta = cv2.absdiff(self.FirstFrame, self.gray)
+        region = self.prescreen()
+        self.Profiler.lap("prescreen")
 
-        self.Thresh = cv2.threshold(self.FrameDelta, 50, 255, cv2.THRESH_BINARY)[1]
-        # dilate the thresholded image to fill in holes, then find contours on thresholded image
-        self.Thresh = cv2.dilate(self.Thresh, None, iterations=2)
+        thresh = self.threshold_region(region)
 
-        cntrs = cv2.findContours(self.Thresh.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)#RETR_EXTERNAL
-        contours = imutils.grab_contours(cntrs)
+        # Keep the pixels covered by targets out of the background. A change over most of the frame is
+        # lighting, not a target, and would never be learned through the mask
+        if self.Settings.BackgroundSelective and region is not None and \
+                cv2.countNonZero(thresh) < self.Settings.BackgroundGlobalChange * self.Thresh.size:
+            cv2.bitwise_not(self.Thresh, dst=self.UpdateMask)
+            self.Background.learn(self.gray, self.UpdateMask)
+        else:
+            self.Background.learn(self.gray)
+        self.Profiler.lap("diff")
+
+        # Still scene, skip the contour stage
+        if region is None:
+            self.Blobs = self.Extractor.Empty
+            self.BlobCount = 0
+            self.update_targets(delta)
+            return
 
-        summ = Vector2()
-        count = 0
+        blobs = self.Extractor.extract(thresh, region[:2])
+        self.BlobCount = len(blobs)
 
-        if len(contours) > 0:
-            # Use only largest contour or all contours, depending on settings
+        if len(blobs) > 0:
+            # Use only largest blob or track all blobs, depending on settings
             if self.Settings.DetectorTraceMaxObject:
-                max_contour = max(contours, key=cv2.contourArea)
-                area = cv2.contourArea(max_contour)
-                if area >= self.Settings.DetectorMinArea:
-                    (x, y, w, h) = cv2.boundingRect(max_contour)
-                    self.draw_contour(x, y, w, h, area)
-                    summ.X = x + w / 2
-                    summ.Y = y + h / 2
-                    count = 1
-                    self.Detected = True
-                    self.LastMotionTime = Utils.millis()
-            else:
-                # loop over the contours
-                for contour in contours:
-                    # if the contour is too small, ignore it
-                    area = cv2.contourArea(contour)
-                    if area < self.Settings.DetectorMinArea:
-                        continue
-
-                    (x, y, w, h) = cv2.boundingRect(contour)
-                    self.draw_contour(x, y, w, h, area)
-
-                    self.Detected = True
-                    self.LastMotionTime = Utils.millis()
-
-                    summ.add(x + w / 2, y + h / 2)
-                    count += 1
-
-        self.update_targets(summ, count)
-    # ------------------------------------------------------------------------------------------
-
-    def update_targets(self, summ, count):
-        prev_target = self.Target
-
-        if count > 0:
-            self.Target = Vector2(summ.X / count, summ.Y / count)
-            self.Targets.append(self.Target)
-            if len(self.Targets) > self.TargetPathLen:
-                self.Targets.pop(0)
-        else:
-            if len(self.Targets) > 0:
-                self.Targets.pop(0)
+                blobs = blobs[[blobs[:, BLOB_AREA].argmax()]]
+            self.Detected = True
+            self.LastMotionTime = Utils.millis()
+
+        self.Blobs = blobs
+        self.update_targets(delta)
+        self.Profiler.lap("contours")
+    # ------------------------------------------------------------------------------------------
+
+    def update_targets(self, delta):
+        self.Tracker.update(self.Blobs, delta)
+
+        primary = self.Tracker.get_primary()
+        if primary is not None:
+            self.Target = primary.get_position()
+            self.Speed = primary.get_velocity()
 
-        self.Speed = (self.Target.X - prev_target.X, self.Target.Y - prev_target.Y)
+        self.DetectionLatency.add(Utils.now_ms() - self.FrameTime)
     # ------------------------------------------------------------------------------------------
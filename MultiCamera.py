@@ -0,0 +1,419 @@
+from BlobExtractor import BLOB_AREA
+from Vector2 import Vector2
+from Utils import Utils
+from LatencyMonitor import LatencyMonitor
+from multiprocessing import shared_memory
+
+import multiprocessing
+import threading
+import cv2
+import numpy as np
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+# Detection result columns published with every frame
+RESULT_TIME = 0
+RESULT_DETECTED = 1
+RESULT_TRACKING = 2
+RESULT_X = 3
+RESULT_Y = 4
+RESULT_VX = 5
+RESULT_VY = 6
+RESULT_AREA = 7
+RESULT_BLOBS = 8
+RESULT_MOTION_TIME = 9
+RESULT_COLUMNS = 10
+
+# Ring status words
+STATUS_SEQUENCE = 0
+STATUS_END = 1
+STATUS_RESET = 2
+
+
+# Single writer, many readers ring of processed frames and their detection results in shared memory.
+# Every slot carries a sequence number that is cleared while the slot is written, so a reader can tell
+# a consistent slot from one being overwritten without any lock between the processes
+class SharedRing(object):
+
+    def __init__(self, name, slots, shape, create=False):
+        self.Slots = slots
+        self.Shape = tuple(shape)
+        frame_bytes = int(np.prod(self.Shape))
+        size = 8 * 3 + 8 * slots + 8 * slots * RESULT_COLUMNS + frame_bytes * slots
+        if create:
+            self.Memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.Memory = shared_memory.SharedMemory(name=name)
+        buffer = self.Memory.buf
+        offset = 0
+        self.Status = np.ndarray((3,), np.int64, buffer, offset)
+        offset += 8 * 3
+        self.Sequences = np.ndarray((slots,), np.int64, buffer, offset)
+        offset += 8 * slots
+        self.Results = np.ndarray((slots, RESULT_COLUMNS), np.float64, buffer, offset)
+        offset += 8 * slots * RESULT_COLUMNS
+        self.Frames = np.ndarray((slots,) + self.Shape, np.uint8, buffer, offset)
+        if create:
+            self.Status[:] = 0
+            self.Sequences[:] = -1
+    # ------------------------------------------------------------------------------------------
+
+    def close(self, unlink=False):
+        # Views must go before the mapping can be closed
+        self.Status = self.Sequences = self.Results = self.Frames = None
+        self.Memory.close()
+        if unlink:
+            self.Memory.unlink()
+    # ------------------------------------------------------------------------------------------
+
+    # Writer side: the slot to fill for the next sequence number
+    def begin_write(self):
+        sequence = int(self.Status[STATUS_SEQUENCE]) + 1
+        slot = sequence % self.Slots
+        self.Sequences[slot] = -1
+        return sequence, slot
+    # ------------------------------------------------------------------------------------------
+
+    def end_write(self, sequence, slot):
+        self.Sequences[slot] = sequence
+        self.Status[STATUS_SEQUENCE] = sequence
+    # ------------------------------------------------------------------------------------------
+
+    def get_sequence(self):
+        return int(self.Status[STATUS_SEQUENCE])
+    # ------------------------------------------------------------------------------------------
+
+    # Reader side: copy of the results of the latest slot, None if it is being overwritten
+    def read_results(self, sequence):
+        slot = sequence % self.Slots
+        results = self.Results[slot].copy()
+        if self.Sequences[slot] != sequence:
+            return None
+        return results
+    # ------------------------------------------------------------------------------------------
+
+    # Reader side: the frame of the slot in place, valid until the writer comes around the ring
+    def get_frame(self, sequence):
+        return self.Frames[sequence % self.Slots]
+    # ------------------------------------------------------------------------------------------
+
+    # Reader side: copies the frame of the slot to dst, False if it was overwritten during the copy
+    def read_frame(self, sequence, dst):
+        slot = sequence % self.Slots
+        np.copyto(dst, self.Frames[slot])
+        return self.Sequences[slot] == sequence
+    # ------------------------------------------------------------------------------------------
+
+
+# Processing resolution of a camera, the same rounding as the detector buffers
+def get_frame_shape(settings, camera):
+    width = settings.QualityTiers[0]["width"]
+    return int(camera["height"] * width / float(camera["width"])), width, 3
+# ------------------------------------------------------------------------------------------
+
+
+# Detection process of one camera, runs its own MotionDetector and publishes into the ring
+def run_camera(index, camera, settings_source, ring_name, slots, shape, stop_event, new_result):
+    from MotionDetector import MotionDetector
+    from Settings import Settings
+
+    settings = Settings(settings_source)
+    settings.Headless = True
+    settings.RenderMode = "headless"
+    settings.QualityEnabled = False
+    ring = SharedRing(ring_name, slots, shape)
+    source = camera["source"]
+    detector = MotionDetector(settings, int(source) if source.isdigit() else source)
+    detector.set_active(True)
+    reset = 0
+
+    last_time = Utils.now_ms()
+    while not stop_event.is_set():
+        now = Utils.now_ms()
+        detector.update(now - last_time)
+        last_time = now
+        if detector.EndOfStream:
+            ring.Status[STATUS_END] = 1
+            new_result.set()
+            break
+        if detector.Frame is None:
+            continue
+
+        if ring.Status[STATUS_RESET] != reset:
+            reset = ring.Status[STATUS_RESET]
+            detector.reset()
+
+        (sequence, slot) = ring.begin_write()
+        frame = detector.Frame
+        scale = 1.0
+        if frame.shape == ring.Shape:
+            np.copyto(ring.Frames[slot], frame)
+        else:
+            # The camera delivers another resolution than configured
+            cv2.resize(frame, (ring.Shape[1], ring.Shape[0]), dst=ring.Frames[slot], interpolation=cv2.INTER_AREA)
+            scale = ring.Shape[1] / float(frame.shape[1])
+
+        results = ring.Results[slot]
+        results[RESULT_TIME] = detector.FrameTime
+        results[RESULT_DETECTED] = detector.is_detected()
+        results[RESULT_BLOBS] = detector.BlobCount
+        results[RESULT_AREA] = detector.Blobs[:, BLOB_AREA].max() * scale * scale if len(detector.Blobs) > 0 else 0
+        results[RESULT_MOTION_TIME] = detector.get_last_motion_time()
+        primary = detector.Tracker.get_primary()
+        results[RESULT_TRACKING] = primary is not None
+        if primary is not None:
+            position = primary.get_position()
+            velocity = primary.get_velocity()
+            results[RESULT_X:RESULT_VY + 1] = (position.X * scale, position.Y * scale,
+                                               velocity.X * scale, velocity.Y * scale)
+        ring.end_write(sequence, slot)
+        new_result.set()
+
+    detector.stop()
+    ring.close()
+# ------------------------------------------------------------------------------------------
+
+
+# MotionDetector stand-in running one detection process per camera. The fusion picks the priority target
+# across the cameras and maps it into the turret yaw/pitch with the camera poses; the view shown, recorded
+# and aimed from is the one of the camera holding the priority target
+class MultiCameraDetector(object):
+
+    def __init__(self, settings, profiler=None):
+        self.Settings = settings
+        self.Cameras = settings.Cameras
+        self.EndOfStream = False
+        self.Active = False
+        self.Detected = False
+        self.FrameTime = 0
+        self.CaptureWait = 0
+        self.DetectionLatency = LatencyMonitor("Detection", self.Settings.LatencyWindow)
+        self.Primary = 0
+        self.Target = Vector2()
+        self.Angles = None
+        self.Results = [None] * len(self.Cameras)
+        self.Sequences = [0] * len(self.Cameras)
+        self.LastMotionTime = Utils.millis()
+        self.Frame = None
+        self.FrameCopy = None
+
+        context = multiprocessing.get_context("spawn")
+        self.StopEvent = context.Event()
+        self.NewResult = context.Event()
+        self.Rings = []
+        self.Processes = []
+        for index, camera in enumerate(self.Cameras):
+            shape = get_frame_shape(settings, camera)
+            ring = SharedRing(None, settings.CameraSlots, shape, create=True)
+            process = context.Process(
+                target=run_camera, name="Camera{}".format(index), daemon=True,
+                args=(index, camera, settings.Source, ring.Memory.name, settings.CameraSlots, shape,
+                      self.StopEvent, self.NewResult))
+            process.start()
+            self.Rings.append(ring)
+            self.Processes.append(process)
+            logger.info("Camera {} ({}): yaw {}, pitch {}, processing {} x {}".format(
+                index, camera["source"], camera["yaw"], camera["pitch"], shape[1], shape[0]))
+
+        self.Callback = None
+        self.Waiter = None
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        logger.info("Stopping cameras...")
+        self.StopEvent.set()
+        self.Callback = None
+        for process in self.Processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        if self.Waiter is not None:
+            self.Waiter.join(timeout=1.0)
+        self.Frame = None
+        self.FrameCopy = None
+        for ring in self.Rings:
+            ring.close(unlink=True)
+        if not self.Settings.Headless and self.Settings.RenderMode != "headless":
+            cv2.destroyAllWindows()
+    # ------------------------------------------------------------------------------------------
+
+    # Called from a waiter thread whenever any camera publishes a frame
+    def set_frame_callback(self, callback):
+        self.Callback = callback
+        if self.Waiter is None:
+            self.Waiter = threading.Thread(target=self.wait_results, name="CameraWaiter", daemon=True)
+            self.Waiter.start()
+    # ------------------------------------------------------------------------------------------
+
+    def wait_results(self):
+        while not self.StopEvent.is_set():
+            if self.NewResult.wait(0.1):
+                self.NewResult.clear()
+                callback = self.Callback
+                if callback is not None:
+                    callback()
+    # ------------------------------------------------------------------------------------------
+
+    def is_live(self):
+        return True
+    # ------------------------------------------------------------------------------------------
+
+    def frame_ready(self):
+        return any(ring.get_sequence() != sequence for ring, sequence in zip(self.Rings, self.Sequences)) or \
+            all(ring.Status[STATUS_END] for ring in self.Rings)
+    # ------------------------------------------------------------------------------------------
+
+    def update(self, delta):
+        now = Utils.now_ms()
+        for index, ring in enumerate(self.Rings):
+            sequence = ring.get_sequence()
+            if sequence == self.Sequences[index]:
+                continue
+            results = ring.read_results(sequence)
+            if results is None:
+                continue
+            self.Sequences[index] = sequence
+            self.Results[index] = results
+            self.DetectionLatency.add(now - results[RESULT_TIME])
+
+        if all(ring.Status[STATUS_END] for ring in self.Rings):
+            self.EndOfStream = True
+            return
+
+        self.fuse()
+        results = self.Results[self.Primary]
+        if results is None:
+            return
+
+        # Only the view of the priority camera leaves the ring. A frame torn by the camera process coming
+        # around the ring is dropped and the previous frame stays
+        ring = self.Rings[self.Primary]
+        frame = ring.get_frame(self.Sequences[self.Primary])
+        if self.FrameCopy is None or self.FrameCopy.shape != frame.shape:
+            self.FrameCopy = np.empty_like(frame)
+        if not ring.read_frame(self.Sequences[self.Primary], self.FrameCopy):
+            return
+        (self.Frame, self.FrameCopy) = (self.FrameCopy, self.Frame)
+        self.FrameTime = results[RESULT_TIME]
+    # ------------------------------------------------------------------------------------------
+
+    # Priority target: the camera holding the current target keeps it while it is tracked,
+    # otherwise the tracked target with the largest area wins
+    def fuse(self):
+        current = self.Results[self.Primary]
+        if current is None or not current[RESULT_TRACKING]:
+            best = None
+            for index, results in enumerate(self.Results):
+                if results is None or not results[RESULT_TRACKING]:
+                    continue
+                if best is None or results[RESULT_AREA] > self.Results[best][RESULT_AREA]:
+                    best = index
+            if best is not None and best != self.Primary:
+                logger.info("Priority target on camera {}".format(best))
+                self.Primary = best
+
+        self.Detected = False
+        for results in self.Results:
+            if results is None:
+                continue
+            self.Detected = self.Detected or bool(results[RESULT_DETECTED])
+            self.LastMotionTime = max(self.LastMotionTime, results[RESULT_MOTION_TIME])
+        self.Detected = self.Detected and self.Active
+
+        results = self.Results[self.Primary]
+        if results is not None and results[RESULT_TRACKING]:
+            self.Target = Vector2(results[RESULT_X], results[RESULT_Y])
+    # ------------------------------------------------------------------------------------------
+
+    # Turret yaw/pitch of the priority target t_ahead_ms from now, through the pose of its camera
+    def predict_angles(self, t_ahead_ms):
+        results = self.Results[self.Primary]
+        target = self.Target
+        if results is not None and results[RESULT_TRACKING]:
+            target = Vector2(results[RESULT_X] + results[RESULT_VX] * t_ahead_ms,
+                             results[RESULT_Y] + results[RESULT_VY] * t_ahead_ms)
+        return self.get_angles(self.Primary, target)
+    # ------------------------------------------------------------------------------------------
+
+    def get_angles(self, index, point):
+        camera = self.Cameras[index]
+        (height, width) = self.Rings[index].Shape[:2]
+        yaw = camera["yaw"] + (point.X / width - 0.5) * camera["hfov"]
+        pitch = camera["pitch"] + (0.5 - point.Y / height) * camera["vfov"]
+        return yaw, pitch
+    # ------------------------------------------------------------------------------------------
+
+    def predict_target(self, t_ahead_ms):
+        return self.Target
+    # ------------------------------------------------------------------------------------------
+
+    def get_target(self):
+        return self.Target
+    # ------------------------------------------------------------------------------------------
+
+    # Blob count and largest blob area on the priority camera
+    def get_blob_stats(self):
+        results = self.Results[self.Primary]
+        if results is None:
+            return 0, 0
+        return int(results[RESULT_BLOBS]), float(results[RESULT_AREA])
+    # ------------------------------------------------------------------------------------------
+
+    def is_detected(self):
+        return self.Detected
+    # ------------------------------------------------------------------------------------------
+
+    def get_last_motion_time(self):
+        return self.LastMotionTime
+    # ------------------------------------------------------------------------------------------
+
+    def set_active(self, active):
+        self.Active = active
+    # ------------------------------------------------------------------------------------------
+
+    def reset(self):
+        logger.info("Reset")
+        for ring in self.Rings:
+            ring.Status[STATUS_RESET] += 1
+    # ------------------------------------------------------------------------------------------
+
+    # Cameras run at their first quality tier and calibration is replaced by the camera poses
+    def set_quality(self, tier):
+        pass
+    # ------------------------------------------------------------------------------------------
+
+    def set_calibration(self, calibration):
+        pass
+    # ------------------------------------------------------------------------------------------
+
+    # Capture resolution of the priority camera, the one the target coordinates come from
+    def get_dimensions(self):
+        camera = self.Cameras[self.Primary]
+        return camera["width"], camera["height"]
+    # ------------------------------------------------------------------------------------------
+
+    def get_real_dimensions(self):
+        (height, width) = self.Rings[self.Primary].Shape[:2]
+        return width, height
+    # ------------------------------------------------------------------------------------------
+
+    def draw_text(self, text, x, y, scale, color, thickness):
+        cv2.putText(self.Frame, text, (int(x), int(y)), cv2.FONT_HERSHEY_SIMPLEX, scale, color, thickness)
+    # ------------------------------------------------------------------------------------------
+
+    def draw(self):
+        point = self.Target
+        cv2.line(self.Frame, (int(point.X - 10), int(point.Y)), (int(point.X + 10), int(point.Y)), (0, 255, 0))
+        cv2.line(self.Frame, (int(point.X), int(point.Y - 10)), (int(point.X), int(point.Y + 10)), (0, 255, 0))
+        self.draw_text("Camera {}".format(self.Primary), self.Frame.shape[1] - 80, 20, 0.5, (255, 255, 255), 1)
+    # ------------------------------------------------------------------------------------------
+
+    def flush(self):
+        cv2.imshow("Sentry Turret", self.Frame)
+    # ------------------------------------------------------------------------------------------
@@ -0,0 +1,142 @@
+from Utils import Utils
+
+import cv2
+import numpy as np
+import time
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Text pre-rasterized once, blitted through its mask
+class TextSprite(object):
+
+    def __init__(self, text, scale, color, thickness):
+        ((width, height), baseline) = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        self.Ascent = height + thickness
+        self.Indent = thickness
+        self.Mask = np.zeros((self.Ascent + baseline + thickness, width + 2 * thickness), np.uint8)
+        cv2.putText(self.Mask, text, (self.Indent, self.Ascent), cv2.FONT_HERSHEY_SIMPLEX, scale, 255, thickness)
+        self.Image = np.zeros(self.Mask.shape + (3,), np.uint8)
+        cv2.putText(self.Image, text, (self.Indent, self.Ascent), cv2.FONT_HERSHEY_SIMPLEX, scale, color, thickness)
+    # ------------------------------------------------------------------------------------------
+
+    # (x, y) is the bottom-left corner of the text, as in cv2.putText
+    def blit(self, frame, x, y):
+        (x0, y0) = (int(x) - self.Indent, int(y) - self.Ascent)
+        (x1, y1) = (x0 + self.Mask.shape[1], y0 + self.Mask.shape[0])
+        (cx0, cy0) = (max(x0, 0), max(y0, 0))
+        (cx1, cy1) = (min(x1, frame.shape[1]), min(y1, frame.shape[0]))
+        if cx0 >= cx1 or cy0 >= cy1:
+            return
+
+        cv2.copyTo(self.Image[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0], self.Mask[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0],
+                   frame[cy0:cy1, cx0:cx1])
+    # ------------------------------------------------------------------------------------------
+
+
+# Draws the overlay and shows the windows, decoupled from the control loop rate.
+# Modes: full renders every tick, reduced renders at the render rate, headless renders only for stream clients
+class OverlayRenderer(object):
+
+    SPRITE_CACHE_SIZE = 64
+
+    def __init__(self, settings, stream=None):
+        self.Settings = settings
+        self.Stream = stream
+        self.Mode = "headless" if settings.Headless else settings.RenderMode
+        self.Period = 1000.0 / settings.RenderRate if self.Mode == "reduced" and settings.RenderRate > 0 else 0
+        self.LastRenderTime = None
+        # The overlay is drawn into the detector frame, so only once per frame
+        self.DrawnFrameTime = None
+        self.Sprites = dict()
+        self.DateSecond = None
+        self.DateText = ""
+        self.Rendered = 0
+
+        logger.info("Render mode: " + self.Mode)
+    # ------------------------------------------------------------------------------------------
+
+    def is_headless(self):
+        return self.Mode == "headless"
+    # ------------------------------------------------------------------------------------------
+
+    # Text that does not change every frame (labels, state, ammo, date) is rasterized once per value
+    def draw_cached_text(self, frame, text, x, y, scale, color, thickness):
+        key = (text, scale, color, thickness)
+        sprite = self.Sprites.get(key)
+        if sprite is None:
+            if len(self.Sprites) >= OverlayRenderer.SPRITE_CACHE_SIZE:
+                self.Sprites.clear()
+            sprite = self.Sprites[key] = TextSprite(text, scale, color, thickness)
+        sprite.blit(frame, x, y)
+    # ------------------------------------------------------------------------------------------
+
+    def get_date_text(self):
+        second = int(time.time())
+        if second != self.DateSecond:
+            self.DateSecond = second
+            self.DateText = time.strftime("%A %d %B %Y %I:%M:%S%p", time.localtime(second))
+        return self.DateText
+    # ------------------------------------------------------------------------------------------
+
+    # Returns the key pressed in the window, -1 if none or nothing was rendered
+    def render(self, turret):
+        streaming = self.Stream is not None and self.Stream.has_clients()
+        if self.Mode == "headless" and not streaming:
+            return -1
+
+        detector = turret.Detector
+        if detector.Frame is None:
+            return -1
+        if detector.FrameTime == self.DrawnFrameTime:
+            return -1 if self.Mode == "headless" else cv2.waitKey(1) & 0xFF
+
+        now = Utils.now_ms()
+        if self.LastRenderTime is not None and now - self.LastRenderTime < self.Period:
+            return -1
+        self.LastRenderTime = now
+
+        self.DrawnFrameTime = detector.FrameTime
+        self.draw(turret, detector.Frame)
+        self.Rendered += 1
+        if streaming:
+            # The multi camera detector has no debug images
+            self.Stream.publish("view", detector.Frame)
+            self.Stream.publish("thresh", getattr(detector, "Thresh", None))
+            self.Stream.publish("delta", getattr(detector, "FrameDelta", None))
+        if self.Mode == "headless":
+            return -1
+        detector.flush()
+        return cv2.waitKey(1) & 0xFF
+    # ------------------------------------------------------------------------------------------
+
+    def draw(self, turret, frame):
+        detector = turret.Detector
+        detector.draw()
+
+        state = turret.State
+        self.draw_cached_text(frame, "State:", 4, 20, 0.5, (255, 255, 255), 1)
+        self.draw_cached_text(frame, turret.get_state_text(state), 70, 20, 0.5, turret.get_state_color(state), 2)
+
+        ammo = turret.FireControl.Ammo
+        self.draw_cached_text(frame, "Ammo:", 4, 40, 0.5, (255, 255, 255), 1)
+        self.draw_cached_text(
+            frame, str(ammo), 70, 40, 0.5,
+            (0, 255, 0) if ammo > 50 else (0, 255, 255) if ammo > 15 else (0, 0, 255), 2)
+
+        target = detector.get_target()
+        detector.draw_text("Target: {:2.1f} {:2.1f}".format(target.X, target.Y), 4, 60, 0.5, (255, 255, 255), 1)
+
+        (yaw, pitch) = turret.Turret.get_yaw_pitch()
+        (r_yaw, r_pitch) = turret.Turret.read_yaw_pitch()
+        detector.draw_text("YP: {:2.1f}({:2.1f}) {:2.1f}({:2.1f})".format(yaw, r_yaw, pitch, r_pitch), 4, 80, 0.5,
+                           (0, 0, 0), 1)
+
+        self.draw_cached_text(frame, self.get_date_text(), 10, frame.shape[0] - 10, 0.35, (255, 255, 255), 1)
+    # ------------------------------------------------------------------------------------------
@@ -0,0 +1,85 @@
+from Utils import Utils
+import collections
+import time
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Collects per-stage timings of the frame pipeline. Every lap() records the time passed since
+# the previous lap() or begin(), so stages are measured back to back without nesting.
+# With a metrics registry every stage also feeds a duration histogram, which unlike the
+# recorded timings stays the same size however long the turret runs
+class Profiler(object):
+
+    def __init__(self, enabled=True, metrics=None):
+        self.Enabled = enabled
+        self.Metrics = metrics
+        self.Timing = enabled or (metrics is not None and metrics.Enabled)
+        self.Histograms = dict()
+        self.FrameCounter = metrics.counter("turret_frames_total", "Processed frames") if metrics is not None else None
+        self.Stages = collections.OrderedDict()
+        self.LastTime = 0
+        self.StartTime = None
+        self.Frames = 0
+    # ------------------------------------------------------------------------------------------
+
+    def begin(self):
+        if not self.Timing:
+            return
+        self.LastTime = time.perf_counter()
+        if self.StartTime is None:
+            self.StartTime = self.LastTime
+    # ------------------------------------------------------------------------------------------
+
+    def lap(self, stage):
+        if not self.Timing:
+            return
+        now = time.perf_counter()
+        elapsed = now - self.LastTime
+        self.LastTime = now
+
+        if self.Metrics is not None:
+            histogram = self.Histograms.get(stage)
+            if histogram is None:
+                histogram = self.Histograms[stage] = self.Metrics.histogram(
+                    "turret_stage_duration_seconds", "Duration of the frame pipeline stages", stage=stage)
+            histogram.observe(elapsed)
+
+        if self.Enabled:
+            timings = self.Stages.get(stage)
+            if timings is None:
+                timings = self.Stages[stage] = []
+            timings.append(elapsed * 1000.0)
+    # ------------------------------------------------------------------------------------------
+
+    def frame(self):
+        if self.Enabled:
+            self.Frames += 1
+        if self.FrameCounter is not None:
+            self.FrameCounter.inc()
+    # ------------------------------------------------------------------------------------------
+
+    def get_fps(self):
+        if self.StartTime is None or self.Frames == 0:
+            return 0
+        elapsed = time.perf_counter() - self.StartTime
+        return self.Frames / elapsed if elapsed > 0 else 0
+    # ------------------------------------------------------------------------------------------
+
+    def report(self):
+        if not self.Enabled:
+            return
+
+        logger.info("Frames: {}, FPS: {:.1f}".format(self.Frames, self.get_fps()))
+        logger.info("{:<10} {:>8} {:>8} {:>8} {:>8} {:>8}".format("stage", "count", "mean", "p50", "p95", "p99"))
+        for stage, timings in self.Stages.items():
+            logger.info("{:<10} {:>8} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f}".format(
+                stage, len(timings), sum(timings) / len(timings),
+                Utils.percentile(timings, 50), Utils.percentile(timings, 95), Utils.percentile(timings, 99)))
+    # ------------------------------------------------------------------------------------------
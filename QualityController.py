@@ -0,0 +1,68 @@
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Holds the control loop at the target frame rate by stepping through the quality tiers declared
+# in the settings, tier 0 being the best one. Steps down when the work per loop does not fit the target
+# period, steps back up when there is headroom, with hysteresis in both directions
+class QualityController(object):
+
+    def __init__(self, settings):
+        self.Settings = settings
+        self.Tiers = settings.QualityTiers
+        self.Enabled = settings.QualityEnabled and len(self.Tiers) > 1
+        self.TargetPeriod = 1000.0 / settings.QualityTargetFps
+        self.Tier = 0
+        self.WorkTime = None
+        self.OverBudget = 0
+        self.UnderBudget = 0
+    # ------------------------------------------------------------------------------------------
+
+    def get_tier(self):
+        return self.Tiers[self.Tier]
+    # ------------------------------------------------------------------------------------------
+
+    # Takes the loop period and the part of it spent waiting for the camera, in ms.
+    # Returns the new tier if it has changed, None otherwise
+    def update(self, period, wait):
+        if not self.Enabled:
+            return None
+
+        # Smoothed time actually spent working, waiting for frames is not a lack of CPU
+        work = max(period - wait, 0)
+        self.WorkTime = work if self.WorkTime is None else self.WorkTime * 0.9 + work * 0.1
+
+        if self.WorkTime > self.TargetPeriod:
+            self.OverBudget += 1
+            self.UnderBudget = 0
+        elif self.WorkTime < self.TargetPeriod * self.Settings.QualityHeadroom:
+            self.UnderBudget += 1
+            self.OverBudget = 0
+        else:
+            self.OverBudget = 0
+            self.UnderBudget = 0
+
+        tier = self.Tier
+        if self.OverBudget >= self.Settings.QualityDownAfter and tier < len(self.Tiers) - 1:
+            tier += 1
+        elif self.UnderBudget >= self.Settings.QualityUpAfter and tier > 0:
+            tier -= 1
+
+        if tier == self.Tier:
+            return None
+
+        logger.info("Quality tier {} -> {}, work time {:.1f} ms, target {:.1f} ms".format(
+            self.Tier, tier, self.WorkTime, self.TargetPeriod))
+        self.Tier = tier
+        self.OverBudget = 0
+        self.UnderBudget = 0
+        # Start measuring the new tier from scratch
+        self.WorkTime = None
+        return self.Tiers[tier]
+    # ------------------------------------------------------------------------------------------
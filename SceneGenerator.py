@@ -0,0 +1,136 @@
+import cv2
+import numpy as np
+
+# Ground truth columns of a visible object: visible centroid, visible bounding box and visible area
+TRUTH_CX = 0
+TRUTH_CY = 1
+TRUTH_X = 2
+TRUTH_Y = 3
+TRUTH_W = 4
+TRUTH_H = 5
+TRUTH_AREA = 6
+TRUTH_COLUMNS = 7
+
+
+class SceneObject(object):
+
+    def __init__(self, rng, width, height, length, min_size, max_size, min_speed, max_speed):
+        self.W = int(rng.integers(min_size, max_size + 1))
+        self.H = int(rng.integers(min_size, max_size + 1))
+        self.X = float(rng.uniform(0, width - self.W))
+        self.Y = float(rng.uniform(0, height - self.H))
+        speed = rng.uniform(min_speed, max_speed)
+        angle = rng.uniform(0, 2 * np.pi)
+        self.VX = speed * np.cos(angle)
+        self.VY = speed * np.sin(angle)
+        # Darker or brighter than the background texture, like most intruders against most scenes
+        low = 0 if rng.random() < 0.5 else 190
+        self.Color = tuple(int(c) for c in rng.integers(low, low + 66, 3))
+        # Objects walk in and out of the scene, so there are empty stretches as well
+        self.Start = int(rng.integers(0, max(length // 2, 1)))
+        self.End = int(rng.integers(self.Start + length // 4, length + 1))
+    # ------------------------------------------------------------------------------------------
+
+    def is_present(self, index):
+        return self.Start <= index < self.End
+    # ------------------------------------------------------------------------------------------
+
+    # Moves by one frame, bouncing off the frame edges
+    def step(self, width, height):
+        self.X += self.VX
+        self.Y += self.VY
+        if self.X < 0 or self.X > width - self.W:
+            self.VX = -self.VX
+            self.X = min(max(self.X, 0), width - self.W)
+        if self.Y < 0 or self.Y > height - self.H:
+            self.VY = -self.VY
+            self.Y = min(max(self.Y, 0), height - self.H)
+    # ------------------------------------------------------------------------------------------
+
+    def draw(self, image, color):
+        center = (int(self.X + self.W / 2), int(self.Y + self.H / 2))
+        cv2.ellipse(image, center, (self.W // 2, self.H // 2), 0, 0, 360, color, -1)
+    # ------------------------------------------------------------------------------------------
+
+
+# Renders a reproducible scene of moving blobs over a textured background with sensor noise, slow lighting
+# drift and static occluders in front of the blobs. Every frame comes with the ground truth of the visible
+# part of every object, in frame pixels
+class SceneGenerator(object):
+
+    def __init__(self, width=640, height=480, length=300, objects=2, noise=4.0, drift=0.1, drift_period=900,
+                 occluders=2, min_size=40, max_size=120, min_speed=2.0, max_speed=8.0, seed=0):
+        self.Width = width
+        self.Height = height
+        self.Length = length
+        self.Noise = noise
+        self.Drift = drift
+        self.DriftPeriod = drift_period
+        self.Rng = np.random.default_rng(seed)
+
+        # Low frequency texture, so the background is not flat
+        texture = self.Rng.integers(40, 200, (height // 40 + 2, width // 40 + 2, 3)).astype(np.uint8)
+        self.Background = cv2.resize(texture, (width, height), interpolation=cv2.INTER_CUBIC)
+
+        self.Objects = [SceneObject(self.Rng, width, height, length, min_size, max_size, min_speed, max_speed)
+                        for _ in range(objects)]
+        self.Occluders = np.zeros((height, width), np.uint8)
+        self.OccluderColors = []
+        for _ in range(occluders):
+            w = int(self.Rng.integers(width // 20, width // 8))
+            h = int(self.Rng.integers(height // 3, height))
+            x = int(self.Rng.integers(0, width - w))
+            y = int(self.Rng.integers(0, height - h + 1))
+            self.OccluderColors.append(((x, y, w, h), tuple(int(c) for c in self.Rng.integers(0, 256, 3))))
+            self.Occluders[y:y + h, x:x + w] = 255
+
+        self.Mask = np.zeros((height, width), np.uint8)
+        self.Index = 0
+    # ------------------------------------------------------------------------------------------
+
+    # Next frame and its ground truth, N x TRUTH_COLUMNS
+    def render(self):
+        frame = self.Background.copy()
+        truth = []
+        for scene_object in self.Objects:
+            if scene_object.is_present(self.Index):
+                scene_object.draw(frame, scene_object.Color)
+                truth.append(self.get_truth(scene_object))
+            scene_object.step(self.Width, self.Height)
+        for ((x, y, w, h), color) in self.OccluderColors:
+            frame[y:y + h, x:x + w] = color
+
+        # Lighting drifts slowly over the whole scene, the noise changes every frame
+        gain = 1.0 + self.Drift * np.sin(2 * np.pi * self.Index / max(self.DriftPeriod, 1))
+        if self.Noise > 0:
+            noise = self.Rng.normal(0, self.Noise, frame.shape)
+            frame = np.clip(frame * gain + noise, 0, 255).astype(np.uint8)
+        else:
+            frame = cv2.convertScaleAbs(frame, alpha=gain)
+
+        self.Index += 1
+        truth = [row for row in truth if row is not None]
+        return frame, np.array(truth, np.float64).reshape(-1, TRUTH_COLUMNS)
+    # ------------------------------------------------------------------------------------------
+
+    # Visible part of an object, None when it is fully hidden by the occluders
+    def get_truth(self, scene_object):
+        self.Mask[:] = 0
+        scene_object.draw(self.Mask, 255)
+        cv2.bitwise_and(self.Mask, cv2.bitwise_not(self.Occluders), dst=self.Mask)
+        moments = cv2.moments(self.Mask, binaryImage=True)
+        if moments["m00"] == 0:
+            return None
+        (x, y, w, h) = cv2.boundingRect(self.Mask)
+        return (moments["m10"] / moments["m00"], moments["m01"] / moments["m00"], x, y, w, h, moments["m00"])
+    # ------------------------------------------------------------------------------------------
+
+    def render_all(self):
+        frames = []
+        truths = []
+        for _ in range(self.Length):
+            (frame, truth) = self.render()
+            frames.append(frame)
+            truths.append(truth)
+        return frames, truths
+    # ------------------------------------------------------------------------------------------
@@ -0,0 +1,149 @@
+from LatencyMonitor import LatencyMonitor
+from Utils import Utils
+
+import threading
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Periodic task with its own rate. A task without a rate is either triggered, running once per signal(),
+# or continuous, running on every pass of the scheduler
+class Task(object):
+
+    def __init__(self, name, func, rate=0, triggered=False, window=300):
+        self.Name = name
+        self.Func = func
+        self.Period = 1000.0 / rate if rate > 0 else 0
+        self.Triggered = triggered
+        self.Signaled = False
+        self.NextTime = 0
+        self.Runs = 0
+        self.Overruns = 0
+        # How late the task started against its schedule and how long it ran, in ms
+        self.Jitter = LatencyMonitor(name + " jitter", window)
+        self.Duration = LatencyMonitor(name + " duration", window)
+        self.JitterHistogram = None
+        self.DurationHistogram = None
+        self.OverrunCounter = None
+    # ------------------------------------------------------------------------------------------
+
+    def is_due(self, now):
+        if self.Triggered:
+            return self.Signaled
+        if self.Period > 0:
+            return now >= self.NextTime
+        return True
+    # ------------------------------------------------------------------------------------------
+
+    def run(self, now):
+        self.Signaled = False
+        late = now - self.NextTime if self.Period > 0 else 0
+        self.Func()
+        end = Utils.now_ms()
+        duration = end - now
+
+        self.Runs += 1
+        self.Jitter.add(late)
+        self.Duration.add(duration)
+        if self.DurationHistogram is not None:
+            self.JitterHistogram.observe(late / 1000.0)
+            self.DurationHistogram.observe(duration / 1000.0)
+
+        if self.Period <= 0:
+            return
+
+        # Stay on the grid while on time, skip the missed slots after an overrun instead of catching up
+        self.NextTime += self.Period
+        if self.NextTime <= end:
+            self.Overruns += 1
+            if self.OverrunCounter is not None:
+                self.OverrunCounter.inc()
+            self.NextTime = end + self.Period
+    # ------------------------------------------------------------------------------------------
+
+
+# Runs tasks at their own rates on the monotonic clock from a single thread,
+# sleeps until the next task is due or a triggered task is signaled instead of spinning
+class Scheduler(object):
+
+    def __init__(self, metrics=None, window=300):
+        self.Tasks = []
+        self.Metrics = metrics
+        self.Window = window
+        self.Wakeup = threading.Event()
+        self.Running = False
+        self.IdleTime = 0
+    # ------------------------------------------------------------------------------------------
+
+    def add(self, name, func, rate=0, triggered=False):
+        task = Task(name, func, rate, triggered, self.Window)
+        if self.Metrics is not None:
+            task.JitterHistogram = self.Metrics.histogram(
+                "turret_task_jitter_seconds", "Delay of the task start against its schedule", task=name)
+            task.DurationHistogram = self.Metrics.histogram(
+                "turret_task_duration_seconds", "Duration of the task", task=name)
+            task.OverrunCounter = self.Metrics.counter(
+                "turret_task_overruns_total", "Task runs that missed the next slot", task=name)
+        self.Tasks.append(task)
+        return task
+    # ------------------------------------------------------------------------------------------
+
+    # Wakes the scheduler to run a triggered task, may be called from any thread
+    def signal(self, task):
+        task.Signaled = True
+        self.Wakeup.set()
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        self.Running = False
+        self.Wakeup.set()
+    # ------------------------------------------------------------------------------------------
+
+    def run(self):
+        self.Running = True
+        start = Utils.now_ms()
+        for task in self.Tasks:
+            task.NextTime = start
+
+        while self.Running:
+            self.Wakeup.clear()
+            idle = True
+            for task in self.Tasks:
+                now = Utils.now_ms()
+                if task.is_due(now):
+                    task.run(now)
+                    idle = False
+                if not self.Running:
+                    return
+
+            if not idle:
+                continue
+
+            # Nothing was due, sleep until the nearest periodic task or a signal
+            timeout = None
+            now = Utils.now_ms()
+            for task in self.Tasks:
+                if task.Triggered:
+                    continue
+                wait = task.NextTime - now if task.Period > 0 else 0
+                timeout = wait if timeout is None else min(timeout, wait)
+            if timeout is None or timeout > 0:
+                self.Wakeup.wait(timeout / 1000.0 if timeout is not None else None)
+                self.IdleTime += Utils.now_ms() - now
+    # ------------------------------------------------------------------------------------------
+
+    def report(self):
+        logger.info("{:<10} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+            "task", "runs", "overruns", "jit p50", "jit p99", "dur p50", "dur p99"))
+        for task in self.Tasks:
+            logger.info("{:<10} {:>8} {:>8} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+                task.Name, task.Runs, task.Overruns,
+                task.Jitter.get_percentile(50), task.Jitter.get_percentile(99),
+                task.Duration.get_percentile(50), task.Duration.get_percentile(99)))
+    # ------------------------------------------------------------------------------------------
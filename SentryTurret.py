@@ -2,11 +2,21 @@ from MotionDetector import MotionDetector
 from TurretController import TurretController
 from Settings import Settings
 from Utils import Utils
-import cv2
+from Profiler import Profiler
+from AudioMixer import AudioMixer
+from OverlayRenderer import OverlayRenderer
+from StreamServer import StreamServer
+from QualityController import QualityController
+from Metrics import MetricsRegistry
+from EventRecorder import EventRecorder
+from Scheduler import Scheduler
+from Calibration import Calibration
+from Startup import Startup
+from Journal import Journal
+from FireControl import FireControl
 import enum
-import datetime
 import random
-from playsound import playsound
+import threading
 
 import logging
 
@@ -39,21 +49,33 @@ class SentrySoundType(enum.Enum):
 class SentryTurret(object):
 
     def __init__(self, args):
+        self.Startup = Startup()
         self.Args = args
         self.NeedExit = False
         self.Settings = Settings("Settings.xml")
-        self.Detector = MotionDetector(self.Settings)
-        self.ScreenDimensions = self.Detector.get_dimensions()
-        self.Turret = TurretController(self.Settings)
-        self.StartTime = Utils.millis()
-        self.CurrentTime = self.StartTime
-        self.LastTime = self.StartTime
-        self.WarningTime = self.StartTime
-        self.LastShootTime = self.StartTime
-        self.LastPingTime = self.StartTime
-        self.State = SentryTurretState.STATE_UNKNOWN
-        self.Ammo = self.Settings.ShooterAmmo
-
+        self.Settings.Headless = bool(self.Args.get("headless")) or bool(self.Args.get("benchmark"))
+        if self.Settings.Headless:
+            # Nobody looks or listens in headless runs, so start detecting right away
+            self.Settings.SoundEnabled = False
+            self.Settings.InitTime = 0
+        if self.Args.get("benchmark"):
+            self.Settings.RecorderEnabled = False
+            self.Settings.JournalEnabled = False
+            self.Settings.StreamEnabled = False
+        self.Startup.mark("settings")
+        self.Metrics = MetricsRegistry.create(self.Settings)
+        self.Profiler = Profiler(enabled=bool(self.Args.get("benchmark")), metrics=self.Metrics)
+        self.Startup.mark("metrics")
+
+        # Devices start concurrently. Guarding only waits for the camera, the board handshake can take seconds
+        # and servo commands go nowhere until it is attached, sounds are muted until the mixer is up
+        self.Turret = TurretController(self.Settings, self.Metrics, connect=False)
+        self.Startup.start("board", self.Turret.connect, self.Settings.StartupBoardTimeout,
+                           on_ready=self.Turret.attach, on_late=TurretController.release)
+        self.Audio = None
+        # The init sound is played by the mixer itself when it attaches after the INIT state was entered
+        self.AudioLock = threading.Lock()
+        self.InitSoundPending = False
         self.Sounds = dict()
         self.Sounds = {SentrySoundType.SND_INIT: "data/turret_init.wav",
                        SentrySoundType.SND_ACTIVATE: "data/turret_activate.wav",
@@ -61,14 +83,94 @@ class SentryTurret(object):
                        SentrySoundType.SND_SHOOT_1: "data/turret_shoot_1.wav",
                        SentrySoundType.SND_SHOOT_2: "data/turret_shoot_2.wav",
                        SentrySoundType.SND_OUT_OF_AMMO: "data/turret_out_of_ammo.wav"}
+        # All sounds are decoded into memory once and played by a single mixer thread
+        self.Startup.start("audio", lambda: AudioMixer.create(self.Settings, self.Sounds),
+                           self.Settings.StartupAudioTimeout, on_ready=self.attach_audio, on_late=AudioMixer.stop)
+        camera = self.Startup.start("camera", self.create_detector, self.Settings.StartupCameraTimeout,
+                                    on_late=lambda detector: detector.stop())
+
+        # Pixel to yaw/pitch lookup tables, optionally the lens undistortion of the frames
+        self.Calibration = Calibration(self.Settings)
+        self.Stream = StreamServer.create(self.Settings, self.Metrics)
+        self.Renderer = OverlayRenderer(self.Settings, self.Stream)
+        self.Quality = QualityController(self.Settings)
+        self.Recorder = EventRecorder.create(self.Settings)
+        self.Journal = Journal.create(self.Settings)
+        self.JournalTime = None
+        self.Startup.mark("modules")
+
+        self.Detector = camera.wait()
+        self.Startup.mark("camera wait")
+        if self.Detector is None:
+            raise RuntimeError("Camera is not available")
+        self.ScreenDimensions = self.Detector.get_dimensions()
+        self.Detector.set_calibration(self.Calibration)
+        self.Detector.set_quality(self.Quality.get_tier())
+        self.StartTime = Utils.millis()
+        self.CurrentTime = self.StartTime
+        self.LastTime = self.StartTime
+        self.WarningTime = self.StartTime
+        self.LastPingTime = self.StartTime
+        self.LastDetectTime = Utils.now_ms()
+        self.LastIdleTime = 0
+        self.State = SentryTurretState.STATE_UNKNOWN
+        # Trigger pulses come from the fire control timer thread, the state machine only arms and disarms it
+        self.FireControl = FireControl.create(self.Settings, self.Turret.write_trigger, self.on_shot, self.Metrics)
+
+        self.ShotCounter = self.Metrics.counter("turret_shots_total", "Shots fired")
+        self.Metrics.callback("turret_ammo", "Ammo left", "gauge", lambda: self.FireControl.Ammo)
+        if self.Recorder is not None:
+            self.Metrics.callback("turret_recorder_events_total", "Recorded events", "counter",
+                                  lambda: self.Recorder.Events)
+            self.Metrics.callback("turret_recorder_dropped_total", "Frames dropped by the event recorder", "counter",
+                                  lambda: self.Recorder.DroppedFrames)
+        self.Metrics.callback("turret_state", "Current state machine state", "gauge", lambda: self.State.value)
+        self.Metrics.callback("turret_quality_tier", "Current processing quality tier, 0 is the best", "gauge",
+                              lambda: self.Quality.Tier)
+        self.Metrics.callback("turret_detection_latency_p50_seconds", "Median capture to detection latency", "gauge",
+                              lambda: self.Detector.DetectionLatency.get_percentile(50) / 1000.0)
+        self.Metrics.callback("turret_servo_latency_p50_seconds", "Median capture to servo write latency", "gauge",
+                              lambda: self.Turret.Latency.get_percentile(50) / 1000.0)
+
+        # Live frames are processed as they arrive, recorded ones as fast as possible
+        self.Scheduler = Scheduler(self.Metrics, self.Settings.LatencyWindow)
+        self.DetectTask = self.Scheduler.add("detect", self.detect, triggered=self.Detector.is_live())
+        self.Scheduler.add("control", self.update, self.Settings.SchedulerControlRate)
+        self.Scheduler.add("ping", self.ping, self.Settings.SchedulerPingRate)
+        self.Scheduler.add("render", self.render, self.Settings.SchedulerRenderRate)
+        self.Detector.set_frame_callback(lambda: self.Scheduler.signal(self.DetectTask))
+
+        self.Startup.mark("scheduler")
 
         self.set_state(SentryTurretState.STATE_INIT)
+        self.Startup.report()
     # ------------------------------------------------------------------------------------------
 
-    def process_input(self):
-        key = cv2.waitKey(1) & 0xFF
+    def create_detector(self):
+        if self.Settings.CamerasEnabled:
+            # Detection of every camera runs in its own process
+            from MultiCamera import MultiCameraDetector
+            return MultiCameraDetector(self.Settings, self.Profiler)
+        return MotionDetector(self.Settings, self.Args.get("video"), self.Profiler, self.Metrics)
+    # ------------------------------------------------------------------------------------------
+
+    def attach_audio(self, audio):
+        with self.AudioLock:
+            self.Audio = audio
+            if self.InitSoundPending and \
+                    self.State in (SentryTurretState.STATE_UNKNOWN, SentryTurretState.STATE_INIT):
+                self.play_sound(SentrySoundType.SND_INIT)
+            self.InitSoundPending = False
+    # ------------------------------------------------------------------------------------------
+
+    def exit(self):
+        self.NeedExit = True
+        self.Scheduler.stop()
+    # ------------------------------------------------------------------------------------------
+
+    def process_input(self, key):
         if key == ord("q"):
-            self.NeedExit = True
+            self.exit()
         if key == ord("r"):
             self.Detector.reset()
     # ------------------------------------------------------------------------------------------
@@ -81,25 +183,93 @@ class SentryTurret(object):
             logger.error("Failed to find sound " + str(sound_id))
             return
 
-        playsound(self.Sounds.get(sound_id), False)
+        if self.Audio is not None:
+            self.Audio.play(sound_id)
     # ------------------------------------------------------------------------------------------
 
     def run(self):
         logger.info("Starting...")
 
-        while not self.NeedExit:
-            self.update()
-            self.draw()
+        self.Scheduler.run()
 
         logger.info("Stopping...")
         # cleanup the camera and close any open windows
         self.Detector.stop()
+        self.FireControl.stop()
+        self.Turret.stop()
+        if self.Audio is not None:
+            self.Audio.stop()
+        if self.Recorder is not None:
+            self.Recorder.stop()
+        if self.Journal is not None:
+            self.Journal.close()
+        if self.Stream is not None:
+            self.Stream.stop()
+        self.Metrics.stop()
+        self.Profiler.report()
+        self.Scheduler.report()
+        logger.info(self.Detector.DetectionLatency.format())
+        logger.info(self.Turret.Latency.format())
     # ------------------------------------------------------------------------------------------
 
     def was_motion_within(self, time):
         return self.CurrentTime - self.Detector.get_last_motion_time() < time
     # ------------------------------------------------------------------------------------------
 
+    # Frame task, runs once per camera frame
+    def detect(self):
+        if not self.Detector.frame_ready():
+            return
+
+        now = Utils.now_ms()
+        period = now - self.LastDetectTime
+        self.LastDetectTime = now
+
+        self.Detector.update(period)
+        if self.Detector.EndOfStream:
+            logger.info("End of stream")
+            self.exit()
+            return
+        if self.Detector.Frame is None:
+            return
+
+        self.Profiler.begin()
+        if self.Recorder is not None:
+            # An event lasts while the turret is alarmed, plus the post-roll
+            if self.State in (SentryTurretState.STATE_WARNING, SentryTurretState.STATE_DETECTED):
+                self.Recorder.trigger(self.Detector.FrameTime)
+            self.Recorder.record(self.Detector.Frame, self.Detector.FrameTime)
+            self.Profiler.lap("record")
+        self.Profiler.frame()
+
+        # Time the scheduler slept since the previous frame is not a lack of CPU
+        idle = self.Scheduler.IdleTime - self.LastIdleTime
+        self.LastIdleTime = self.Scheduler.IdleTime
+        tier = self.Quality.update(period, idle + self.Detector.CaptureWait)
+        if tier is not None:
+            self.Detector.set_quality(tier)
+    # ------------------------------------------------------------------------------------------
+
+    # Keys are read from the window, so only when it has been rendered
+    def render(self):
+        self.process_input(self.Renderer.render(self))
+    # ------------------------------------------------------------------------------------------
+
+    def ping(self):
+        if self.State == SentryTurretState.STATE_ACTIVATED:
+            rate = self.Settings.ActivatedPingRate
+        elif self.State == SentryTurretState.STATE_WARNING:
+            rate = self.Settings.WarningPingRate
+        else:
+            return
+
+        now = Utils.millis()
+        if now - self.LastPingTime > rate:
+            self.play_sound(SentrySoundType.SND_PING)
+            self.LastPingTime = now
+    # ------------------------------------------------------------------------------------------
+
+    # Control task, state machine and servo targets
     def update(self):
         self.CurrentTime = Utils.millis()
         delta = self.CurrentTime - self.LastTime
@@ -110,9 +280,8 @@ class SentryTurret(object):
             if self.CurrentTime - self.StartTime > self.Settings.InitTime:
                 self.set_state(SentryTurretState.STATE_ACTIVATED)
 
-        self.process_input()
-
-        self.Detector.update(delta)
+        if self.Detector.Frame is None:
+            return
 
         # Reset detection
         #if self.CurrentTime - self.Detector.get_last_motion_time() > 3000:
@@ -120,21 +289,11 @@ class SentryTurret(object):
 
         # Activated state
         if self.State == SentryTurretState.STATE_ACTIVATED:
-            # Just ping with some interval
-            if self.CurrentTime - self.LastPingTime > self.Settings.ActivatedPingRate:
-                self.play_sound(SentrySoundType.SND_PING)
-                self.LastPingTime = self.CurrentTime
-
             if self.Detector.is_detected():
                 self.set_state(SentryTurretState.STATE_WARNING)
 
         # Warning state
         if self.State == SentryTurretState.STATE_WARNING:
-            # Just ping with some interval
-            if self.CurrentTime - self.LastPingTime > self.Settings.WarningPingRate:
-                self.play_sound(SentrySoundType.SND_PING)
-                self.LastPingTime = self.CurrentTime
-
             if self.CurrentTime - self.WarningTime > self.Settings.WarningTime:
                 if self.Detector.is_detected():
                     #if self.was_motion_within(1000):
@@ -146,47 +305,69 @@ class SentryTurret(object):
         if self.State == SentryTurretState.STATE_DETECTED:
             if not self.Detector.is_detected():
                 self.set_state(SentryTurretState.STATE_ACTIVATED)
+            elif self.FireControl.Ammo == 0:
+                self.set_state(SentryTurretState.STATE_OUT_OF_AMMO)
 
-            if self.CurrentTime - self.LastShootTime > self.Settings.ShooterRate:
-                if self.Ammo == 0:
-                    self.set_state(SentryTurretState.STATE_OUT_OF_AMMO)
-                else:
-                    self.shoot()
-
+        self.Profiler.begin()
         self.update_turret(delta)
+        self.Profiler.lap("turret")
+
+        if self.Journal is not None and self.Detector.FrameTime != self.JournalTime:
+            self.write_journal()
+            self.Profiler.lap("journal")
     # ------------------------------------------------------------------------------------------
 
     def update_turret(self, delta):
-        # Get target coordinates and calculate yaw pitch angles
-        target = self.Detector.get_target()
-
-        (scr_width, scr_height) = self.Detector.get_real_dimensions()
-
-        yaw = \
-            self.Settings.TurretYawMin + \
-            (self.Settings.TurretYawMax - self.Settings.TurretYawMin) / scr_width * target.X
-        pitch = \
-            self.Settings.TurretPitchMin + \
-            (self.Settings.TurretPitchMax - self.Settings.TurretPitchMin) / -scr_height * \
-            (target.Y - scr_height)
+        # Get target coordinates, lead a moving target a bit, and calculate yaw pitch angles
+        lead_time = self.Settings.TrackerLeadTime
+        if self.Settings.LatencyCompensate:
+            # The target is as old as the frame, aim where it will be when the servos get the command
+            lead_time += self.Turret.Latency.get_percentile(50)
+        if self.Settings.CamerasEnabled:
+            # Angles come from the pose of the camera holding the priority target
+            (yaw, pitch) = self.Detector.predict_angles(lead_time)
+        else:
+            target = self.Detector.predict_target(lead_time)
+            (scr_width, scr_height) = self.Detector.get_real_dimensions()
+            (yaw, pitch) = self.Calibration.lookup(scr_width, scr_height, target.X, target.Y)
 
         self.Turret.set_yaw(yaw)
         self.Turret.set_pitch(pitch)
 
         # Update turret itself
+        self.Turret.set_target_time(self.Detector.FrameTime)
         self.Turret.update(delta)
     # ------------------------------------------------------------------------------------------
 
-    def shoot(self):
-        if self.Ammo > 0:
-            snd = random.randint(0, 1)
-            if snd == 0:
-                self.play_sound(SentrySoundType.SND_SHOOT_1)
-            elif snd == 1:
-                self.play_sound(SentrySoundType.SND_SHOOT_2)
+    # One journal record per processed frame, positions in capture pixels
+    def write_journal(self):
+        self.JournalTime = self.Detector.FrameTime
+        (width, _) = self.Detector.get_dimensions()
+        (real_width, _) = self.Detector.get_real_dimensions()
+        scale = width / float(real_width)
+        target = self.Detector.get_target()
+        (blobs, area) = self.Detector.get_blob_stats()
+        (yaw, pitch) = self.Turret.get_yaw_pitch()
+        self.Journal.append(self.JournalTime, self.State.value, self.Detector.is_detected(),
+                            target.X * scale, target.Y * scale, blobs, area * scale * scale, yaw, pitch,
+                            self.FireControl.Ammo)
+    # ------------------------------------------------------------------------------------------
+
+    # Rolling capture to detection and capture to servo write latency distributions
+    def get_latency_stats(self):
+        return {"detection": self.Detector.DetectionLatency.get_stats(),
+                "servo": self.Turret.Latency.get_stats()}
+    # ------------------------------------------------------------------------------------------
 
-            self.Ammo -= 1
-            self.LastShootTime = self.CurrentTime + random.randint(0, self.Settings.ShooterRate / 4)
+    # Called from the fire control thread as a trigger pulse starts
+    def on_shot(self):
+        snd = random.randint(0, 1)
+        if snd == 0:
+            self.play_sound(SentrySoundType.SND_SHOOT_1)
+        elif snd == 1:
+            self.play_sound(SentrySoundType.SND_SHOOT_2)
+
+        self.ShotCounter.inc()
     # ------------------------------------------------------------------------------------------
 
     def set_state(self, state):
@@ -194,15 +375,24 @@ class SentryTurret(object):
             return
 
         logger.info("Switching to state " + self.get_state_text(state))
+        self.Metrics.counter("turret_state_transitions_total", "State machine transitions",
+                             source=self.State.name, target=state.name).inc()
 
         if self.State == SentryTurretState.STATE_INIT:
             if state == SentryTurretState.STATE_ACTIVATED:
                 self.Detector.set_active(True)
 
         if state == SentryTurretState.STATE_INIT:
-            self.play_sound(SentrySoundType.SND_INIT)
+            with self.AudioLock:
+                self.InitSoundPending = self.Audio is None
+                self.play_sound(SentrySoundType.SND_INIT)
             self.Detector.set_active(False)
 
+        if state == SentryTurretState.STATE_DETECTED:
+            self.FireControl.arm()
+        elif self.State == SentryTurretState.STATE_DETECTED:
+            self.FireControl.disarm()
+
         if state == SentryTurretState.STATE_WARNING:
             self.WarningTime = self.CurrentTime
             self.play_sound(SentrySoundType.SND_ACTIVATE)
@@ -241,33 +431,3 @@ class SentryTurret(object):
             return (0, 0, 255)
         return (255, 255, 255)
     # ------------------------------------------------------------------------------------------
-
-    def draw(self):
-        self.Detector.draw()
-
-        self.Detector.draw_text("State:", 4, 20, 0.5, (255, 255, 255), 1)
-        self.Detector.draw_text(
-            SentryTurret.get_state_text(self.State), 70, 20, 0.5, SentryTurret.get_state_color(self.State), 2)
-
-        self.Detector.draw_text("Ammo:", 4, 40, 0.5, (255, 255, 255), 1)
-        self.Detector.draw_text(
-            str(self.Ammo), 70, 40, 0.5,
-            (0, 255, 0) if self.Ammo > 50 else (0, 255, 255) if self.Ammo > 15 else (0, 0, 255), 2)
-
-        target = self.Detector.get_target()
-        self.Detector.draw_text("Target: {:2.1f} {:2.1f}".format(target.X, target.Y), 4, 60, 0.5, (255, 255, 255), 1)
-
-        (yaw, pitch) = self.Turret.get_yaw_pitch()
-        (r_yaw, r_pitch) = self.Turret.read_yaw_pitch()
-        self.Detector.draw_text("YP: {:2.1f}({:2.1f}) {:2.1f}({:2.1f})".format(yaw, r_yaw, pitch, r_pitch), 4, 80, 0.5, (0, 0, 0), 1)
-
-        #print(str(self.Detector.get_dimensions()[1]) + " " + str(self.Detector.get_height()))
-        self.Detector.draw_text(
-            datetime.datetime.now().strftime("%A %d %B %Y %I:%M:%S%p"),
-            10, self.Detector.get_real_dimensions()[1] - 10,
-            0.35,
-            (255, 255, 255),
-            1)
-
-        self.Detector.flush()
-    # ------------------------------------------------------------------------------------------
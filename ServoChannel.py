@@ -0,0 +1,193 @@
+from Utils import Utils
+
+import threading
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Background servo I/O worker. Only the latest yaw/pitch command is kept, writes are limited to the
+# servo update rate, changes below the deadband are not sent, and pin readback is cached.
+# With a trajectory planner commands become targets, and the planner setpoints are written
+# at the servo update rate until the servos get there
+class ServoChannel(object):
+
+    def __init__(self, write_yaw, write_pitch, read_back, rate, deadband, readback_rate, latency=None, metrics=None,
+                 planner=None):
+        self.WriteYaw = write_yaw
+        self.WritePitch = write_pitch
+        self.ReadBack = read_back
+        self.Period = 1000.0 / rate if rate > 0 else 0
+        self.Deadband = deadband
+        self.ReadbackPeriod = 1000.0 / readback_rate if readback_rate > 0 else 0
+        self.Latency = latency
+        self.Planner = planner if self.Period > 0 else None
+        self.PlanTime = None
+        self.LastStepTime = None
+
+        self.Condition = threading.Condition()
+        self.Thread = None
+        self.Running = False
+        self.Pending = None
+        self.Written = (None, None)
+        self.Readback = (0, 0)
+        self.LastWriteTime = 0
+        self.LastReadbackTime = 0
+
+        self.Submitted = 0
+        self.Coalesced = 0
+        self.Suppressed = 0
+        self.Writes = 0
+
+        self.YawWrites = self.PitchWrites = self.WriteDuration = None
+        if metrics is not None:
+            self.YawWrites = metrics.counter("turret_servo_writes_total", "Servo pin writes", axis="yaw")
+            self.PitchWrites = metrics.counter("turret_servo_writes_total", "Servo pin writes", axis="pitch")
+            self.WriteDuration = metrics.histogram("turret_servo_write_duration_seconds",
+                                                   "Duration of a servo command write")
+            metrics.callback("turret_servo_commands_total", "Servo commands submitted", "counter",
+                             lambda: self.Submitted)
+            metrics.callback("turret_servo_coalesced_total", "Servo commands replaced before written", "counter",
+                             lambda: self.Coalesced)
+            metrics.callback("turret_servo_suppressed_total", "Servo commands within the deadband", "counter",
+                             lambda: self.Suppressed)
+    # ------------------------------------------------------------------------------------------
+
+    def start(self):
+        self.Running = True
+        self.Thread = threading.Thread(target=self.run, name="ServoChannel", daemon=True)
+        self.Thread.start()
+        return self
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        with self.Condition:
+            self.Running = False
+            self.Condition.notify_all()
+
+        if self.Thread is not None:
+            self.Thread.join(timeout=1.0)
+            self.Thread = None
+
+        logger.info("Commands: {}, coalesced: {}, suppressed: {}, writes: {}".format(
+            self.Submitted, self.Coalesced, self.Suppressed, self.Writes))
+    # ------------------------------------------------------------------------------------------
+
+    # Never blocks on I/O, a command not written yet is replaced by the new one
+    def submit(self, yaw, pitch, timestamp=None):
+        with self.Condition:
+            if self.Pending is not None:
+                self.Coalesced += 1
+            self.Pending = (yaw, pitch, timestamp)
+            self.Submitted += 1
+            self.Condition.notify()
+    # ------------------------------------------------------------------------------------------
+
+    def get_readback(self):
+        return self.Readback
+    # ------------------------------------------------------------------------------------------
+
+    # Forgets what was written, the next command goes out regardless of the deadband
+    def invalidate(self):
+        with self.Condition:
+            self.Written = (None, None)
+    # ------------------------------------------------------------------------------------------
+
+    def run(self):
+        while True:
+            with self.Condition:
+                moving = self.Planner is not None and not self.Planner.is_settled()
+                if not moving:
+                    self.Condition.wait_for(lambda: self.Pending is not None or not self.Running,
+                                            self.ReadbackPeriod / 1000.0 if self.ReadbackPeriod > 0 else None)
+                if not self.Running:
+                    break
+
+                # Rate limit, newer commands keep replacing the pending one meanwhile
+                last_time = self.LastWriteTime if self.Planner is None else (self.LastStepTime or 0)
+                wait = last_time + self.Period - Utils.now_ms()
+                if (self.Pending is not None or moving) and wait > 0:
+                    self.Condition.wait_for(lambda: not self.Running, wait / 1000.0)
+                    if not self.Running:
+                        break
+
+                command = self.Pending
+                self.Pending = None
+
+            try:
+                if self.Planner is not None:
+                    command = self.plan(command)
+                if command is not None:
+                    self.write(command)
+                self.read_back()
+            except Exception as e:
+                logger.error("Servo I/O failed: " + str(e))
+    # ------------------------------------------------------------------------------------------
+
+    # One control tick, returns the setpoint to write or None when the servos are already there
+    def plan(self, command):
+        if command is not None:
+            (yaw, pitch, self.PlanTime) = command
+            self.Planner.set_target(yaw, pitch)
+        if self.Planner.is_settled():
+            self.LastStepTime = None
+            if command is None:
+                return None
+            # Already there or the very first command, the deadband decides whether to write
+            (yaw, pitch) = self.Planner.get_position()
+        else:
+            # A late tick moves farther instead of slowing the whole trajectory down
+            now = Utils.now_ms()
+            elapsed = self.Period if self.LastStepTime is None else min(now - self.LastStepTime, 2 * self.Period)
+            self.LastStepTime = now
+            (yaw, pitch) = self.Planner.step(max(elapsed, 1.0) / 1000.0)
+
+        # Latency is measured up to the first setpoint towards a new target
+        timestamp = self.PlanTime
+        self.PlanTime = None
+        return yaw, pitch, timestamp
+    # ------------------------------------------------------------------------------------------
+
+    def write(self, command):
+        (yaw, pitch, timestamp) = command
+        (written_yaw, written_pitch) = self.Written
+
+        write_yaw = written_yaw is None or abs(yaw - written_yaw) >= self.Deadband
+        write_pitch = written_pitch is None or abs(pitch - written_pitch) >= self.Deadband
+        if not write_yaw and not write_pitch:
+            self.Suppressed += 1
+            return
+
+        start = Utils.now_ms()
+        if write_yaw:
+            self.WriteYaw(yaw)
+            written_yaw = yaw
+        if write_pitch:
+            self.WritePitch(pitch)
+            written_pitch = pitch
+
+        self.Written = (written_yaw, written_pitch)
+        self.Writes += 1
+        self.LastWriteTime = Utils.now_ms()
+        if self.WriteDuration is not None:
+            self.WriteDuration.observe((self.LastWriteTime - start) / 1000.0)
+            if write_yaw:
+                self.YawWrites.inc()
+            if write_pitch:
+                self.PitchWrites.inc()
+        if self.Latency is not None and timestamp is not None:
+            self.Latency.add(self.LastWriteTime - timestamp)
+    # ------------------------------------------------------------------------------------------
+
+    def read_back(self):
+        now = Utils.now_ms()
+        if self.ReadbackPeriod <= 0 or now - self.LastReadbackTime < self.ReadbackPeriod:
+            return
+        self.Readback = self.ReadBack()
+        self.LastReadbackTime = now
+    # ------------------------------------------------------------------------------------------
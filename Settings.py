@@ -20,11 +20,27 @@ class Settings(object):
         self.WarningTime = 0
         self.DetectorMinArea = 2000
         self.DetectorTraceMaxObject = True
+        self.DetectorBlobs = "contours"
+
+        self.TrackerMaxDistance = 80
+        self.TrackerMaxMisses = 5
+        self.TrackerMinHits = 3
+        self.TrackerHistory = 20
+        self.TrackerProcessNoise = 0.0001
+        self.TrackerMeasurementNoise = 25.0
+        self.TrackerLeadTime = 0
+
+        self.LatencyWindow = 300
+        self.LatencyCompensate = False
         self.ActivatedPingRate = 2000
         self.WarningPingRate = 500
         self.ShooterRate = 1000
         self.ShooterAmmo = 100
+        self.ShooterTriggerDuration = 100
+        self.ShooterTriggerRelease = 30
+        self.ShooterTriggerPin = 3
 
+        self.TurretBoard = "due"
         self.TurretPort = "COM1"
         self.TurretYawMin = -45
         self.TurretYawMax = 45
@@ -32,8 +48,97 @@ class Settings(object):
         self.TurretPitchMax = 30
         self.YawPin = 0
         self.PitchPin = 1
+        self.ServoRate = 50
+        self.ServoDeadband = 0.5
+        self.ServoReadbackRate = 2
+
+        self.PlannerEnabled = True
+        self.PlannerYawSpeed = 400
+        self.PlannerYawAcceleration = 3000
+        self.PlannerPitchSpeed = 300
+        self.PlannerPitchAcceleration = 2000
+
+        self.CalibrationEnabled = False
+        self.CalibrationDirectory = "calibration"
+        self.CalibrationFile = "camera.json"
+        self.CalibrationDistance = 5.0
+        self.CalibrationUndistort = False
+
+        self.SimulatorBaud = 57600
+        self.SimulatorSlewRate = 300
+
+        self.QualityEnabled = False
+        self.QualityTargetFps = 30
+        self.QualityHeadroom = 0.7
+        self.QualityDownAfter = 30
+        self.QualityUpAfter = 300
+        self.QualityTiers = [{"width": 500, "blur": 21, "dilate": 2, "threshold": 50, "detect_every": 1}]
+
+        self.MetricsEnabled = False
+        self.MetricsExport = "http"
+        self.MetricsPort = 9108
+        self.MetricsFile = "metrics.prom"
+        self.MetricsInterval = 10
+
+        self.RecorderEnabled = False
+        self.RecorderDirectory = "events"
+        self.RecorderPreRoll = 3
+        self.RecorderPostRoll = 3
+        self.RecorderFps = 10
+        self.RecorderQueue = 30
+        self.RecorderCodec = "MJPG"
+
+        self.SchedulerControlRate = 100
+        self.SchedulerRenderRate = 30
+        self.SchedulerPingRate = 20
+
+        self.JournalEnabled = False
+        self.JournalDirectory = "journal"
+        self.JournalSegmentSize = 16
+        self.JournalIndexInterval = 256
+        self.JournalRetention = 7
+        self.JournalFlushInterval = 5
+
+        self.StreamEnabled = False
+        self.StreamAddress = "127.0.0.1"
+        self.StreamPort = 8081
+        self.StreamRate = 10
+        self.StreamQualities = [50, 80]
+        self.StreamMaxClients = 8
+
+        self.StartupCameraTimeout = 5
+        self.StartupBoardTimeout = 10
+        self.StartupAudioTimeout = 3
+
+        self.CamerasEnabled = False
+        self.CameraSlots = 4
+        self.Cameras = []
 
         self.SoundEnabled = False
+        self.SoundSink = "device"
+        self.SoundRate = 22050
+        self.SoundVoices = 4
+
+        # Runtime only, set from the command line
+        self.Headless = False
+
+        self.RenderMode = "reduced"
+        self.RenderRate = 10
+
+        self.CaptureThreaded = True
+        self.CaptureBufferSize = 2
+
+        self.BackgroundModel = "average"
+        self.BackgroundLearningRate = 0.01
+        self.BackgroundSelective = True
+        self.BackgroundGlobalChange = 0.5
+        self.BackgroundAbsorbRate = 0.002
+
+        self.PrescreenEnabled = True
+        self.PrescreenCols = 16
+        self.PrescreenRows = 12
+        self.PrescreenThreshold = 6
+        self.PrescreenMargin = 1
 
         self.load()
     # ------------------------------------------------------------------------------------------
@@ -52,12 +157,30 @@ class Settings(object):
             det_item = settings_item.find('detector')
             self.DetectorMinArea = int(det_item.attrib['min_area'])
             self.DetectorTraceMaxObject = True if det_item.attrib['trace_max_object'] == "1" else False
+            self.DetectorBlobs = det_item.attrib['blobs']
+
+            tracker_item = settings_item.find('tracker')
+            self.TrackerMaxDistance = float(tracker_item.attrib['max_distance'])
+            self.TrackerMaxMisses = int(tracker_item.attrib['max_misses'])
+            self.TrackerMinHits = int(tracker_item.attrib['min_hits'])
+            self.TrackerHistory = int(tracker_item.attrib['history'])
+            self.TrackerProcessNoise = float(tracker_item.attrib['process_noise'])
+            self.TrackerMeasurementNoise = float(tracker_item.attrib['measurement_noise'])
+            self.TrackerLeadTime = int(tracker_item.attrib['lead_time'])
+
+            latency_item = settings_item.find('latency')
+            self.LatencyWindow = int(latency_item.attrib['window'])
+            self.LatencyCompensate = True if latency_item.attrib['compensate'] == "1" else False
 
             shooter_item = settings_item.find('shooter')
             self.ShooterRate = int(shooter_item.attrib['rate'])
             self.ShooterAmmo = int(shooter_item.attrib['ammo'])
+            self.ShooterTriggerDuration = float(shooter_item.attrib['trigger_duration'])
+            self.ShooterTriggerRelease = float(shooter_item.attrib['trigger_release'])
+            self.ShooterTriggerPin = int(shooter_item.attrib['trigger_pin'])
 
             turret_item = settings_item.find('turret')
+            self.TurretBoard = turret_item.attrib['board']
             self.TurretPort = turret_item.attrib['port']
             self.TurretYawMin = int(turret_item.attrib['yaw_min'])
             self.TurretYawMax = int(turret_item.attrib['yaw_max'])
@@ -65,9 +188,126 @@ class Settings(object):
             self.TurretPitchMax = int(turret_item.attrib['pitch_max'])
             self.YawPin = int(turret_item.attrib['yaw_pin'])
             self.PitchPin = int(turret_item.attrib['pitch_pin'])
+            self.ServoRate = float(turret_item.attrib['servo_rate'])
+            self.ServoDeadband = float(turret_item.attrib['deadband'])
+            self.ServoReadbackRate = float(turret_item.attrib['readback_rate'])
+
+            planner_item = settings_item.find('planner')
+            self.PlannerEnabled = True if planner_item.attrib['enabled'] == "1" else False
+            self.PlannerYawSpeed = float(planner_item.attrib['yaw_speed'])
+            self.PlannerYawAcceleration = float(planner_item.attrib['yaw_acceleration'])
+            self.PlannerPitchSpeed = float(planner_item.attrib['pitch_speed'])
+            self.PlannerPitchAcceleration = float(planner_item.attrib['pitch_acceleration'])
+
+            calibration_item = settings_item.find('calibration')
+            self.CalibrationEnabled = True if calibration_item.attrib['enabled'] == "1" else False
+            self.CalibrationDirectory = calibration_item.attrib['directory']
+            self.CalibrationFile = calibration_item.attrib['file']
+            self.CalibrationDistance = float(calibration_item.attrib['distance'])
+            self.CalibrationUndistort = True if calibration_item.attrib['undistort'] == "1" else False
+
+            simulator_item = settings_item.find('simulator')
+            self.SimulatorBaud = int(simulator_item.attrib['baud'])
+            self.SimulatorSlewRate = float(simulator_item.attrib['slew_rate'])
+
+            quality_item = settings_item.find('quality')
+            self.QualityEnabled = True if quality_item.attrib['enabled'] == "1" else False
+            self.QualityTargetFps = float(quality_item.attrib['target_fps'])
+            self.QualityHeadroom = float(quality_item.attrib['headroom'])
+            self.QualityDownAfter = int(quality_item.attrib['down_after'])
+            self.QualityUpAfter = int(quality_item.attrib['up_after'])
+            tiers = []
+            for tier_item in quality_item.findall('tier'):
+                tiers.append({"width": int(tier_item.attrib['width']),
+                              "blur": int(tier_item.attrib['blur']),
+                              "dilate": int(tier_item.attrib['dilate']),
+                              "threshold": int(tier_item.attrib['threshold']),
+                              "detect_every": int(tier_item.attrib['detect_every'])})
+            if tiers:
+                self.QualityTiers = tiers
+
+            metrics_item = settings_item.find('metrics')
+            self.MetricsEnabled = True if metrics_item.attrib['enabled'] == "1" else False
+            self.MetricsExport = metrics_item.attrib['export']
+            self.MetricsPort = int(metrics_item.attrib['port'])
+            self.MetricsFile = metrics_item.attrib['file']
+            self.MetricsInterval = float(metrics_item.attrib['interval'])
+
+            recorder_item = settings_item.find('recorder')
+            self.RecorderEnabled = True if recorder_item.attrib['enabled'] == "1" else False
+            self.RecorderDirectory = recorder_item.attrib['directory']
+            self.RecorderPreRoll = float(recorder_item.attrib['pre_roll'])
+            self.RecorderPostRoll = float(recorder_item.attrib['post_roll'])
+            self.RecorderFps = float(recorder_item.attrib['fps'])
+            self.RecorderQueue = int(recorder_item.attrib['queue'])
+            self.RecorderCodec = recorder_item.attrib['codec']
+
+            scheduler_item = settings_item.find('scheduler')
+            self.SchedulerControlRate = float(scheduler_item.attrib['control_rate'])
+            self.SchedulerRenderRate = float(scheduler_item.attrib['render_rate'])
+            self.SchedulerPingRate = float(scheduler_item.attrib['ping_rate'])
+
+            journal_item = settings_item.find('journal')
+            self.JournalEnabled = True if journal_item.attrib['enabled'] == "1" else False
+            self.JournalDirectory = journal_item.attrib['directory']
+            self.JournalSegmentSize = int(journal_item.attrib['segment_size'])
+            self.JournalIndexInterval = int(journal_item.attrib['index_interval'])
+            self.JournalRetention = float(journal_item.attrib['retention'])
+            self.JournalFlushInterval = float(journal_item.attrib['flush_interval'])
+
+            stream_item = settings_item.find('stream')
+            self.StreamEnabled = True if stream_item.attrib['enabled'] == "1" else False
+            self.StreamAddress = stream_item.attrib['address']
+            self.StreamPort = int(stream_item.attrib['port'])
+            self.StreamRate = float(stream_item.attrib['rate'])
+            self.StreamQualities = [int(quality) for quality in stream_item.attrib['quality'].split(",")]
+            self.StreamMaxClients = int(stream_item.attrib['max_clients'])
+
+            startup_item = settings_item.find('startup')
+            self.StartupCameraTimeout = float(startup_item.attrib['camera_timeout'])
+            self.StartupBoardTimeout = float(startup_item.attrib['board_timeout'])
+            self.StartupAudioTimeout = float(startup_item.attrib['audio_timeout'])
+
+            cameras_item = settings_item.find('cameras')
+            self.CamerasEnabled = True if cameras_item.attrib['enabled'] == "1" else False
+            self.CameraSlots = int(cameras_item.attrib['slots'])
+            self.Cameras = []
+            for camera_item in cameras_item.findall('camera'):
+                self.Cameras.append({"source": camera_item.attrib['source'],
+                                     "yaw": float(camera_item.attrib['yaw']),
+                                     "pitch": float(camera_item.attrib['pitch']),
+                                     "hfov": float(camera_item.attrib['hfov']),
+                                     "vfov": float(camera_item.attrib['vfov']),
+                                     "width": int(camera_item.attrib['width']),
+                                     "height": int(camera_item.attrib['height'])})
 
             sound_item = settings_item.find('sound')
             self.SoundEnabled = True if sound_item.attrib['enabled'] == "1" else False
+            self.SoundSink = sound_item.attrib['sink']
+            self.SoundRate = int(sound_item.attrib['rate'])
+            self.SoundVoices = int(sound_item.attrib['voices'])
+
+            capture_item = settings_item.find('capture')
+            self.CaptureThreaded = True if capture_item.attrib['threaded'] == "1" else False
+            self.CaptureBufferSize = int(capture_item.attrib['buffer_size'])
+
+            background_item = settings_item.find('background')
+            self.BackgroundModel = background_item.attrib['model']
+            self.BackgroundLearningRate = float(background_item.attrib['learning_rate'])
+            self.BackgroundSelective = True if background_item.attrib['selective'] == "1" else False
+            self.BackgroundGlobalChange = float(background_item.attrib['global_change'])
+            self.BackgroundAbsorbRate = float(background_item.attrib['absorb_rate'])
+
+            render_item = settings_item.find('render')
+            self.RenderMode = render_item.attrib['mode']
+            self.RenderRate = float(render_item.attrib['rate'])
+
+            prescreen_item = settings_item.find('prescreen')
+            self.PrescreenEnabled = True if prescreen_item.attrib['enabled'] == "1" else False
+            self.PrescreenCols = int(prescreen_item.attrib['cols'])
+            self.PrescreenRows = int(prescreen_item.attrib['rows'])
+            self.PrescreenThreshold = int(prescreen_item.attrib['threshold'])
+            self.PrescreenMargin = int(prescreen_item.attrib['margin'])
         except Exception as e:
             logger.error("Failed to load settings: " + str(e))
     # ------------------------------------------------------------------------------------------
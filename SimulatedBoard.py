@@ -0,0 +1,127 @@
+from Utils import Utils
+
+import collections
+import threading
+import time
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Pin of the simulated board. The value read back is the servo position, which moves towards
+# the last written value no faster than the slew rate
+class SimulatedPin(object):
+
+    def __init__(self, board, pin_number, mode):
+        self.Board = board
+        self.PinNumber = pin_number
+        self.Mode = mode
+        self.value = None
+        self.Position = 0.0
+        self.PositionTime = Utils.now_ms()
+    # ------------------------------------------------------------------------------------------
+
+    def update_position(self, now):
+        if self.value is not None:
+            step = self.Board.SlewRate * (now - self.PositionTime) / 1000.0
+            error = self.value - self.Position
+            self.Position = self.value if abs(error) <= step else self.Position + (step if error > 0 else -step)
+        self.PositionTime = now
+    # ------------------------------------------------------------------------------------------
+
+    def write(self, value):
+        # Same as pyfirmata, an unchanged value is not sent
+        if value is self.value:
+            return
+        self.update_position(Utils.now_ms())
+        self.value = value
+        self.Board.send(self.PinNumber, value)
+    # ------------------------------------------------------------------------------------------
+
+    def read(self):
+        self.update_position(Utils.now_ms())
+        return self.Position
+    # ------------------------------------------------------------------------------------------
+
+
+# In-process stand-in for a Firmata board (pyfirmata interface subset) on a serial link of the given baud rate.
+# Every write takes the serial transmission time of its message and is recorded
+class SimulatedBoard(object):
+
+    # Firmata analog/digital messages are 3 bytes, 10 bits per byte on the wire
+    MESSAGE_BYTES = 3
+
+    def __init__(self, baud, slew_rate, record_limit=100000):
+        self.Baud = baud
+        self.SlewRate = slew_rate
+        self.MessageTime = SimulatedBoard.MESSAGE_BYTES * 10 * 1000.0 / baud
+        self.Pins = dict()
+        self.Lock = threading.Lock()
+        self.LinkFreeTime = 0
+        self.BusyTime = 0
+        self.StartTime = Utils.now_ms()
+        self.Writes = collections.deque(maxlen=record_limit)
+        self.digital = SimulatedPins(self)
+
+        logger.info("Simulated board at {} baud, {:.3f} ms per message".format(baud, self.MessageTime))
+    # ------------------------------------------------------------------------------------------
+
+    # Pin definition as in pyfirmata, e.g. 'd:3:p'
+    def get_pin(self, pin_def):
+        (_, number, mode) = pin_def.split(':')
+        return self.get_pin_number(int(number), mode)
+    # ------------------------------------------------------------------------------------------
+
+    def get_pin_number(self, number, mode='o'):
+        pin = self.Pins.get(number)
+        if pin is None:
+            pin = self.Pins[number] = SimulatedPin(self, number, mode)
+        return pin
+    # ------------------------------------------------------------------------------------------
+
+    # Blocks for the transmission time, messages queue up behind each other on a saturated link
+    def send(self, pin_number, value):
+        with self.Lock:
+            now = Utils.now_ms()
+            start = max(now, self.LinkFreeTime)
+            self.LinkFreeTime = start + self.MessageTime
+            self.BusyTime += self.MessageTime
+            self.Writes.append((start, pin_number, value))
+            done = self.LinkFreeTime
+
+        delay = (done - Utils.now_ms()) / 1000.0
+        if delay > 0:
+            time.sleep(delay)
+    # ------------------------------------------------------------------------------------------
+
+    def get_writes(self):
+        with self.Lock:
+            return list(self.Writes)
+    # ------------------------------------------------------------------------------------------
+
+    # Share of the time the serial link was busy since the board was created
+    def get_link_utilization(self):
+        elapsed = Utils.now_ms() - self.StartTime
+        return self.BusyTime / elapsed if elapsed > 0 else 0
+    # ------------------------------------------------------------------------------------------
+
+    def exit(self):
+        pass
+    # ------------------------------------------------------------------------------------------
+
+
+# board.digital[n] access like in pyfirmata
+class SimulatedPins(object):
+
+    def __init__(self, board):
+        self.Board = board
+    # ------------------------------------------------------------------------------------------
+
+    def __getitem__(self, number):
+        return self.Board.get_pin_number(number)
+    # ------------------------------------------------------------------------------------------
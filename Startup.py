@@ -0,0 +1,122 @@
+import threading
+import time
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Device initializer running on its own thread. It is declared timed out once its timeout passes,
+# an initializer that still finishes after that is handed to on_late to release what it opened
+class StartupTask(object):
+
+    def __init__(self, name, func, timeout, on_ready=None, on_late=None):
+        self.Name = name
+        self.Func = func
+        self.Timeout = timeout
+        self.OnReady = on_ready
+        self.OnLate = on_late
+        self.State = "pending"
+        self.Result = None
+        self.Duration = None
+        self.StartTime = time.monotonic()
+        self.Lock = threading.Lock()
+        self.Done = threading.Event()
+        self.Timer = threading.Timer(timeout, self.expire)
+        self.Timer.daemon = True
+        self.Thread = threading.Thread(target=self.run, name="Startup-" + name, daemon=True)
+    # ------------------------------------------------------------------------------------------
+
+    def start(self):
+        self.Timer.start()
+        self.Thread.start()
+        return self
+    # ------------------------------------------------------------------------------------------
+
+    def run(self):
+        result = None
+        error = None
+        try:
+            result = self.Func()
+        except Exception as e:
+            error = e
+        duration = time.monotonic() - self.StartTime
+
+        with self.Lock:
+            late = self.State == "timeout"
+            if not late:
+                self.State = "failed" if error is not None else "ready"
+                self.Result = result
+                self.Duration = duration
+
+        if late:
+            logger.warning("{} finished {:.2f} s after start, past its {:.1f} s timeout".format(
+                self.Name, duration, self.Timeout))
+            if error is None and self.OnLate is not None:
+                self.OnLate(result)
+            return
+
+        self.Timer.cancel()
+        if error is not None:
+            logger.error("{} failed after {:.2f} s: {}".format(self.Name, duration, error))
+        else:
+            if self.OnReady is not None:
+                self.OnReady(result)
+            logger.info("{} ready in {:.2f} s".format(self.Name, duration))
+        self.Done.set()
+    # ------------------------------------------------------------------------------------------
+
+    def expire(self):
+        with self.Lock:
+            if self.State != "pending":
+                return
+            self.State = "timeout"
+            self.Duration = self.Timeout
+        logger.error("{} not ready after {:.1f} s, continuing without it".format(self.Name, self.Timeout))
+        self.Done.set()
+    # ------------------------------------------------------------------------------------------
+
+    # Blocks until the initializer finished or timed out, the result or None
+    def wait(self):
+        self.Done.wait()
+        return self.Result if self.State == "ready" else None
+    # ------------------------------------------------------------------------------------------
+
+
+# Startup sequence: sequential steps are marked as they complete, device initializers run concurrently
+class Startup(object):
+
+    def __init__(self):
+        self.StartTime = time.monotonic()
+        self.LastMark = self.StartTime
+        self.Steps = []
+        self.Tasks = []
+    # ------------------------------------------------------------------------------------------
+
+    def start(self, name, func, timeout, on_ready=None, on_late=None):
+        task = StartupTask(name, func, timeout, on_ready, on_late).start()
+        self.Tasks.append(task)
+        return task
+    # ------------------------------------------------------------------------------------------
+
+    # Time spent since the previous mark
+    def mark(self, name):
+        now = time.monotonic()
+        self.Steps.append((name, now - self.LastMark))
+        self.LastMark = now
+    # ------------------------------------------------------------------------------------------
+
+    def report(self):
+        logger.info("Startup took {:.2f} s".format(time.monotonic() - self.StartTime))
+        for (name, duration) in self.Steps:
+            logger.info("  {:<12} {:>8.3f} s".format(name, duration))
+        for task in self.Tasks:
+            with task.Lock:
+                state = task.State
+                duration = task.Duration if task.Duration is not None else time.monotonic() - task.StartTime
+            logger.info("  {:<12} {:>8.3f} s  {} (timeout {:.1f} s)".format(task.Name, duration, state, task.Timeout))
+    # ------------------------------------------------------------------------------------------
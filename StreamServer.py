@@ -0,0 +1,255 @@
+import threading
+import time
+import cv2
+import numpy as np
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+# Streamed views: the annotated frame and the detector debug images
+STREAM_VIEWS = ("view", "thresh", "delta")
+
+PAGE = """<html><head><title>Sentry Turret</title></head><body style="background:#222">
+<img src="/view.mjpg"/> <img src="/thresh.mjpg"/> <img src="/delta.mjpg"/>
+</body></html>"""
+
+
+# MJPEG over HTTP for remote monitoring. publish() only copies a frame, and only of views somebody watches.
+# An encoder thread turns the latest frame of a view into one JPEG per quality level in use at no more than
+# rate frames per second, every client thread sends the newest JPEG when it is ready for the next one,
+# so a slow client skips frames instead of queueing them and never holds back anybody else
+class StreamServer(object):
+
+    def __init__(self, address, port, rate, qualities, max_clients, metrics=None):
+        self.Address = address
+        self.Port = port
+        self.Period = 1.0 / rate if rate > 0 else 0
+        self.Qualities = sorted(qualities)
+        self.MaxClients = max_clients
+        self.Server = None
+        self.Thread = None
+        self.Encoder = None
+        self.Running = False
+
+        # Watched (view, quality) pairs and their client counts
+        self.Clients = dict()
+        self.ClientCount = 0
+        # Latest published frame of every view and the views published since the last encode. A pending frame
+        # is swapped with the encoder buffer of its view instead of copied again
+        self.Lock = threading.Lock()
+        self.FrameReady = threading.Condition(self.Lock)
+        self.Pending = dict()
+        self.Dirty = set()
+        self.Buffers = dict()
+        # Newest JPEG of every (view, quality): (count encoded, bytes)
+        self.JpegReady = threading.Condition()
+        self.Latest = dict()
+
+        self.Encoded = 0
+        self.Dropped = 0
+        if metrics is not None:
+            metrics.callback("turret_stream_clients", "Connected MJPEG clients", "gauge", lambda: self.ClientCount)
+            metrics.callback("turret_stream_encoded_total", "JPEG frames encoded for streaming", "counter",
+                             lambda: self.Encoded)
+            metrics.callback("turret_stream_dropped_total", "Frames slow clients skipped", "counter",
+                             lambda: self.Dropped)
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def create(settings, metrics=None):
+        if not settings.StreamEnabled:
+            return None
+        return StreamServer(settings.StreamAddress, settings.StreamPort, settings.StreamRate, settings.StreamQualities,
+                            settings.StreamMaxClients, metrics).start()
+    # ------------------------------------------------------------------------------------------
+
+    def start(self):
+        # Loaded only when streaming is enabled
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                (path, _, query) = self.path.partition("?")
+                if path == "/":
+                    body = PAGE.encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/html")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                view = path.strip("/").replace(".mjpg", "")
+                if view not in STREAM_VIEWS:
+                    self.send_error(404)
+                    return
+                server.serve_client(self, view, server.get_quality(query))
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.Server = ThreadingHTTPServer((self.Address, self.Port), Handler)
+            self.Server.daemon_threads = True
+        except OSError as e:
+            logger.error("Failed to start stream server on port {}: {}".format(self.Port, str(e)))
+            return self
+
+        with self.JpegReady:
+            self.Latest.clear()
+        self.Running = True
+        self.Encoder = threading.Thread(target=self.encode, name="StreamEncoder", daemon=True)
+        self.Encoder.start()
+        self.Thread = threading.Thread(target=self.Server.serve_forever, name="StreamServer", daemon=True)
+        self.Thread.start()
+        logger.info("Streaming on http://{}:{}/".format(self.Address, self.Port))
+        return self
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        with self.Lock:
+            self.Running = False
+            self.FrameReady.notify()
+        with self.JpegReady:
+            self.JpegReady.notify_all()
+        if self.Server is not None:
+            self.Server.shutdown()
+            self.Server.server_close()
+            self.Server = None
+        if self.Encoder is not None:
+            self.Encoder.join(timeout=1.0)
+        with self.JpegReady:
+            self.Latest.clear()
+        logger.info("Stream frames encoded: {}, skipped by slow clients: {}".format(self.Encoded, self.Dropped))
+    # ------------------------------------------------------------------------------------------
+
+    # Requested JPEG quality, the nearest configured level so encodings are shared
+    def get_quality(self, query):
+        requested = self.Qualities[0]
+        for item in query.split("&"):
+            (name, _, value) = item.partition("=")
+            if name == "quality" and value.isdigit():
+                requested = int(value)
+        return min(self.Qualities, key=lambda quality: abs(quality - requested))
+    # ------------------------------------------------------------------------------------------
+
+    def is_watched(self, view):
+        return any(key[0] == view for key in self.Clients)
+    # ------------------------------------------------------------------------------------------
+
+    def has_clients(self):
+        return self.ClientCount > 0
+    # ------------------------------------------------------------------------------------------
+
+    # Called from the render loop, a no-op for views nobody watches
+    def publish(self, view, frame):
+        if frame is None or not self.is_watched(view):
+            return
+        with self.Lock:
+            pending = self.Pending.get(view)
+            if pending is None or pending.shape != frame.shape:
+                pending = self.Pending[view] = np.empty_like(frame)
+            np.copyto(pending, frame)
+            self.Dirty.add(view)
+            self.FrameReady.notify()
+    # ------------------------------------------------------------------------------------------
+
+    def encode(self):
+        last_time = 0
+        while True:
+            with self.Lock:
+                # Only new frames are encoded, also when the rate does not limit the loop
+                self.FrameReady.wait_for(lambda: self.Dirty or not self.Running)
+                if not self.Running:
+                    break
+                # Take the new frames, the publisher gets the spare buffers of their views back
+                frames = dict()
+                for view in self.Dirty:
+                    frames[view] = self.Pending[view]
+                    spare = self.Buffers.pop(view, None)
+                    if spare is not None and spare.shape == frames[view].shape:
+                        self.Pending[view] = spare
+                    else:
+                        del self.Pending[view]
+                self.Dirty.clear()
+                watched = list(self.Clients.keys())
+
+            for (view, frame) in frames.items():
+                for quality in sorted(set(q for (v, q) in watched if v == view)):
+                    ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                    if not ok:
+                        continue
+                    with self.JpegReady:
+                        (count, _) = self.Latest.get((view, quality), (0, None))
+                        self.Latest[(view, quality)] = (count + 1, jpeg.tobytes())
+                        self.JpegReady.notify_all()
+                    self.Encoded += 1
+
+            # Buffers of views that lost their clients are released
+            with self.Lock:
+                self.Buffers.update(frames)
+                for view in list(self.Buffers.keys()):
+                    if not self.is_watched(view):
+                        del self.Buffers[view]
+                        self.Pending.pop(view, None)
+                        self.Dirty.discard(view)
+
+            # Newer frames keep replacing the pending ones meanwhile
+            delay = last_time + self.Period - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            last_time = time.monotonic()
+    # ------------------------------------------------------------------------------------------
+
+    # Runs on the client thread of the HTTP server until the client goes away
+    def serve_client(self, handler, view, quality):
+        key = (view, quality)
+        with self.Lock:
+            if self.ClientCount >= self.MaxClients:
+                handler.send_error(503, "Too many clients")
+                return
+            self.Clients[key] = self.Clients.get(key, 0) + 1
+            self.ClientCount += 1
+        logger.info("Stream client {} watching {} at quality {}".format(handler.client_address[0], view, quality))
+
+        try:
+            handler.send_response(200)
+            handler.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+            handler.send_header("Cache-Control", "no-cache")
+            handler.end_headers()
+            handler.connection.settimeout(10.0)
+            # A JPEG encoded before the client came may be long stale, the client waits for a fresh one
+            with self.JpegReady:
+                joined = self.Latest.get(key, (None, None))[0]
+            sent = joined
+            while self.Running:
+                with self.JpegReady:
+                    self.JpegReady.wait_for(
+                        lambda: not self.Running or self.Latest.get(key, (sent, None))[0] != sent, 1.0)
+                    (sequence, jpeg) = self.Latest.get(key, (None, None))
+                if jpeg is None or sequence == sent:
+                    continue
+                # Frames encoded while the previous one was still being written are never sent
+                if sent is not None and sent != joined and sequence > sent + 1:
+                    self.Dropped += sequence - sent - 1
+                handler.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " +
+                                    str(len(jpeg)).encode("ascii") + b"\r\n\r\n" + jpeg + b"\r\n")
+                sent = sequence
+        except OSError:
+            pass
+        finally:
+            with self.Lock:
+                self.Clients[key] -= 1
+                if self.Clients[key] == 0:
+                    del self.Clients[key]
+                self.ClientCount -= 1
+            if key not in self.Clients:
+                with self.JpegReady:
+                    self.Latest.pop(key, None)
+            logger.info("Stream client {} left".format(handler.client_address[0]))
+    # ------------------------------------------------------------------------------------------
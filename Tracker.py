@@ -0,0 +1,194 @@
+from Vector2 import Vector2
+from BlobExtractor import BLOB_AREA, BLOB_CX, BLOB_CY
+
+import numpy as np
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Single tracked object with a constant velocity Kalman filter over (x, y, vx, vy).
+# Velocity is in pixels per millisecond
+class Track(object):
+
+    MEASUREMENT = np.array([[1.0, 0.0, 0.0, 0.0],
+                            [0.0, 1.0, 0.0, 0.0]])
+
+    def __init__(self, track_id, x, y, area, settings):
+        self.Id = track_id
+        self.Settings = settings
+        self.State = np.array([x, y, 0.0, 0.0])
+        self.Covariance = np.diag([settings.TrackerMeasurementNoise] * 2 + [1.0, 1.0])
+        self.Transition = np.eye(4)
+        self.Area = area
+        self.Hits = 1
+        self.Misses = 0
+        self.Age = 0
+
+        # Fixed size ring of the filtered positions
+        self.History = np.zeros((settings.TrackerHistory, 2), np.float64)
+        self.HistoryIndex = 0
+        self.HistoryCount = 0
+        self.add_history()
+    # ------------------------------------------------------------------------------------------
+
+    def add_history(self):
+        self.History[self.HistoryIndex] = self.State[:2]
+        self.HistoryIndex = (self.HistoryIndex + 1) % len(self.History)
+        self.HistoryCount = min(self.HistoryCount + 1, len(self.History))
+    # ------------------------------------------------------------------------------------------
+
+    # History positions from the oldest to the newest
+    def get_history(self):
+        if self.HistoryCount < len(self.History):
+            return self.History[:self.HistoryCount]
+        return np.concatenate((self.History[self.HistoryIndex:], self.History[:self.HistoryIndex]))
+    # ------------------------------------------------------------------------------------------
+
+    def predict(self, dt):
+        self.Transition[0, 2] = dt
+        self.Transition[1, 3] = dt
+
+        # Piecewise white acceleration noise
+        q = self.Settings.TrackerProcessNoise
+        dt2 = dt * dt
+        noise = np.array([[dt2 * dt2 / 4, 0, dt2 * dt / 2, 0],
+                          [0, dt2 * dt2 / 4, 0, dt2 * dt / 2],
+                          [dt2 * dt / 2, 0, dt2, 0],
+                          [0, dt2 * dt / 2, 0, dt2]]) * q
+
+        self.State = self.Transition.dot(self.State)
+        self.Covariance = self.Transition.dot(self.Covariance).dot(self.Transition.T) + noise
+        self.Age += 1
+    # ------------------------------------------------------------------------------------------
+
+    def correct(self, x, y, area):
+        h = Track.MEASUREMENT
+        innovation = np.array([x, y]) - self.State[:2]
+        s = self.Covariance[:2, :2] + np.eye(2) * self.Settings.TrackerMeasurementNoise
+        gain = self.Covariance.dot(h.T).dot(np.linalg.inv(s))
+
+        self.State = self.State + gain.dot(innovation)
+        self.Covariance = (np.eye(4) - gain.dot(h)).dot(self.Covariance)
+        self.Area = area
+        self.Hits += 1
+        self.Misses = 0
+        self.add_history()
+    # ------------------------------------------------------------------------------------------
+
+    def miss(self):
+        self.Misses += 1
+        self.add_history()
+    # ------------------------------------------------------------------------------------------
+
+    def is_confirmed(self):
+        return self.Hits >= self.Settings.TrackerMinHits
+    # ------------------------------------------------------------------------------------------
+
+    def get_position(self):
+        return Vector2(self.State[0], self.State[1])
+    # ------------------------------------------------------------------------------------------
+
+    def get_velocity(self):
+        return Vector2(self.State[2], self.State[3])
+    # ------------------------------------------------------------------------------------------
+
+    def extrapolate(self, t_ahead_ms):
+        return Vector2(self.State[0] + self.State[2] * t_ahead_ms, self.State[1] + self.State[3] * t_ahead_ms)
+    # ------------------------------------------------------------------------------------------
+
+
+# Associates blobs to persistent tracks frame by frame (greedy nearest neighbour within a gate)
+# and picks the primary track to aim at
+class Tracker(object):
+
+    def __init__(self, settings):
+        self.Settings = settings
+        self.Tracks = []
+        self.NextId = 1
+        self.PrimaryId = None
+    # ------------------------------------------------------------------------------------------
+
+    def reset(self):
+        self.Tracks = []
+        self.PrimaryId = None
+    # ------------------------------------------------------------------------------------------
+
+    # Moves all tracks to a new processing resolution
+    def rescale(self, factor):
+        for track in self.Tracks:
+            track.State *= factor
+            track.History *= factor
+    # ------------------------------------------------------------------------------------------
+
+    def update(self, blobs, dt):
+        dt = max(float(dt), 1.0)
+        for track in self.Tracks:
+            track.predict(dt)
+
+        matched_tracks = set()
+        matched_blobs = set()
+
+        if len(self.Tracks) > 0 and len(blobs) > 0:
+            positions = np.array([track.State[:2] for track in self.Tracks])
+            distances = np.hypot(positions[:, None, 0] - blobs[None, :, BLOB_CX],
+                                 positions[:, None, 1] - blobs[None, :, BLOB_CY])
+
+            # Closest pairs first, pairs outside the gate are never associated
+            for index in np.argsort(distances, axis=None):
+                (t, b) = divmod(int(index), len(blobs))
+                if distances[t, b] > self.Settings.TrackerMaxDistance:
+                    break
+                if t in matched_tracks or b in matched_blobs:
+                    continue
+                self.Tracks[t].correct(blobs[b, BLOB_CX], blobs[b, BLOB_CY], blobs[b, BLOB_AREA])
+                matched_tracks.add(t)
+                matched_blobs.add(b)
+
+        for t, track in enumerate(self.Tracks):
+            if t not in matched_tracks:
+                track.miss()
+
+        self.Tracks = [track for track in self.Tracks if track.Misses <= self.Settings.TrackerMaxMisses]
+
+        for b in range(len(blobs)):
+            if b not in matched_blobs:
+                self.Tracks.append(Track(self.NextId, blobs[b, BLOB_CX], blobs[b, BLOB_CY], blobs[b, BLOB_AREA],
+                                         self.Settings))
+                self.NextId += 1
+
+        self.update_primary()
+    # ------------------------------------------------------------------------------------------
+
+    # Stay on the current primary while it lives, otherwise take the largest confirmed track
+    def update_primary(self):
+        candidates = [track for track in self.Tracks if track.is_confirmed()]
+        if any(track.Id == self.PrimaryId for track in candidates):
+            return
+
+        self.PrimaryId = None
+        if len(candidates) > 0:
+            primary = max(candidates, key=lambda track: track.Area)
+            self.PrimaryId = primary.Id
+            logger.info("Tracking target {}".format(primary.Id))
+    # ------------------------------------------------------------------------------------------
+
+    def get_primary(self):
+        for track in self.Tracks:
+            if track.Id == self.PrimaryId:
+                return track
+        return None
+    # ------------------------------------------------------------------------------------------
+
+    # Position of the primary target t_ahead_ms from now, None if there is no target
+    def predict(self, t_ahead_ms):
+        primary = self.get_primary()
+        if primary is None:
+            return None
+        return primary.extrapolate(t_ahead_ms)
+    # ------------------------------------------------------------------------------------------
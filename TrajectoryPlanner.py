@@ -0,0 +1,96 @@
+import math
+
+
+# Online trapezoidal velocity profile of one servo axis. Every step accelerates towards the target,
+# cruises at the speed limit and brakes just in time to stop on it, the target may change at any step.
+# Speed and acceleration are in axis units per second, a limit of 0 disables it
+class AxisPlanner(object):
+
+    def __init__(self, max_speed, max_acceleration):
+        self.MaxSpeed = max_speed
+        self.MaxAcceleration = max_acceleration
+        self.Position = None
+        self.Velocity = 0.0
+        self.Target = None
+    # ------------------------------------------------------------------------------------------
+
+    def set_target(self, target):
+        self.Target = target
+        # The servo position is unknown until the first command, so that one goes straight
+        if self.Position is None:
+            self.Position = target
+    # ------------------------------------------------------------------------------------------
+
+    def is_settled(self):
+        return self.Target is None or (self.Position == self.Target and self.Velocity == 0)
+    # ------------------------------------------------------------------------------------------
+
+    # Advances by dt seconds and returns the new setpoint
+    def step(self, dt):
+        if self.is_settled():
+            return self.Position
+
+        error = self.Target - self.Position
+        if self.MaxSpeed <= 0 and self.MaxAcceleration <= 0:
+            self.Position = self.Target
+            return self.Position
+
+        # Fastest speed that still allows stopping on the target
+        speed = abs(error) / dt
+        if self.MaxSpeed > 0:
+            speed = min(speed, self.MaxSpeed)
+        if self.MaxAcceleration > 0:
+            # Discrete braking distance v*dt + (v - a*dt)*dt + ... solved for v
+            step = self.MaxAcceleration * dt
+            speed = min(speed, step * (math.sqrt(0.25 + 2.0 * abs(error) / (step * dt)) - 0.5))
+        desired = math.copysign(speed, error)
+
+        if self.MaxAcceleration > 0:
+            change = self.MaxAcceleration * dt
+            self.Velocity += min(max(desired - self.Velocity, -change), change)
+        else:
+            self.Velocity = desired
+
+        self.Position += self.Velocity * dt
+        # Landed on the target, or crossed it slowly enough to stop there
+        remaining = self.Target - self.Position
+        crossed = remaining * error < 0 and (self.MaxAcceleration <= 0 or abs(self.Velocity) <= self.MaxAcceleration * dt)
+        if abs(remaining) < 1e-6 or crossed:
+            self.Position = self.Target
+            self.Velocity = 0.0
+        return self.Position
+    # ------------------------------------------------------------------------------------------
+
+
+# Yaw and pitch trajectories stepped together at the servo control rate
+class TrajectoryPlanner(object):
+
+    def __init__(self, settings):
+        self.Yaw = AxisPlanner(settings.PlannerYawSpeed, settings.PlannerYawAcceleration)
+        self.Pitch = AxisPlanner(settings.PlannerPitchSpeed, settings.PlannerPitchAcceleration)
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def create(settings):
+        if not settings.PlannerEnabled:
+            return None
+        return TrajectoryPlanner(settings)
+    # ------------------------------------------------------------------------------------------
+
+    def set_target(self, yaw, pitch):
+        self.Yaw.set_target(yaw)
+        self.Pitch.set_target(pitch)
+    # ------------------------------------------------------------------------------------------
+
+    def is_settled(self):
+        return self.Yaw.is_settled() and self.Pitch.is_settled()
+    # ------------------------------------------------------------------------------------------
+
+    def get_position(self):
+        return self.Yaw.Position, self.Pitch.Position
+    # ------------------------------------------------------------------------------------------
+
+    # dt in seconds, returns the yaw and pitch setpoints
+    def step(self, dt):
+        return self.Yaw.step(dt), self.Pitch.step(dt)
+    # ------------------------------------------------------------------------------------------
@@ -1,4 +1,8 @@
-from pyfirmata import ArduinoDue, util
+from LatencyMonitor import LatencyMonitor
+from ServoChannel import ServoChannel
+from TrajectoryPlanner import TrajectoryPlanner
+from SimulatedBoard import SimulatedBoard
+import threading
 import time
 import logging
 
@@ -12,26 +16,95 @@ logger = logging.getLogger(__name__)
 
 class TurretController(object):
 
-    def __init__(self, settings):
+    # Without connect the board is attached later by connect() and attach(), servo commands are dropped until then
+    def __init__(self, settings, metrics=None, connect=True):
         self.Settings = settings
         self.Yaw = 0
         self.TargetYaw = 0
         self.Pitch = 0
         self.TargetPitch = 0
-        try:
-            self.Board = ArduinoDue(self.Settings.TurretPort)
+        # Capture time of the frame the current target comes from and the capture to pin write latency
+        self.TargetTime = None
+        self.Latency = LatencyMonitor("Servo", self.Settings.LatencyWindow)
+        self.Board = None
+        self.YawPin = None
+        self.PitchPin = None
+        self.TriggerPin = None
+        # Servo and trigger writes come from different threads but share one serial link
+        self.WriteLock = threading.Lock()
 
-            # set up pins as digital pings with PWM
-            self.YawPin = self.Board.get_pin('d:' + str(self.Settings.YawPin) + ':p')
-            self.PitchPin = self.Board.get_pin('d:' + str(self.Settings.PitchPin) + ':p')
+        # Serial I/O runs on its own thread, so a slow link never holds back frame processing
+        self.Channel = ServoChannel(
+            self.write_yaw, self.write_pitch, self.poll_yaw_pitch,
+            self.Settings.ServoRate, self.Settings.ServoDeadband, self.Settings.ServoReadbackRate,
+            self.Latency, metrics, TrajectoryPlanner.create(self.Settings)).start()
 
-            # For analog ports
-            #it = util.Iterator(self.Board)
-            #it.start()
+        if connect:
+            try:
+                self.attach(self.connect())
+            except Exception as e:
+                logger.error("Failed to initialize: " + str(e))
+    # ------------------------------------------------------------------------------------------
+
+    def stop(self):
+        self.Channel.stop()
+    # ------------------------------------------------------------------------------------------
+
+    # Opens the board and its servo pins, the handshake may take seconds
+    def connect(self):
+        board = TurretController.create_board(self.Settings)
+
+        # set up pins as digital pings with PWM
+        yaw_pin = board.get_pin('d:' + str(self.Settings.YawPin) + ':p')
+        pitch_pin = board.get_pin('d:' + str(self.Settings.PitchPin) + ':p')
+        trigger_pin = board.get_pin('d:' + str(self.Settings.ShooterTriggerPin) + ':o')
+
+        # For analog ports
+        #it = util.Iterator(board)
+        #it.start()
+        return board, yaw_pin, pitch_pin, trigger_pin
+    # ------------------------------------------------------------------------------------------
+
+    def attach(self, connection):
+        (board, self.YawPin, self.PitchPin, self.TriggerPin) = connection
+        self.Board = board
+        # Commands sent before the board was there went nowhere, write the current target again
+        self.Channel.invalidate()
+        if self.Channel.Submitted > 0:
+            self.Channel.submit(self.Yaw, self.Pitch, self.TargetTime)
+    # ------------------------------------------------------------------------------------------
+
+    # A connection that is not wanted any more, e.g. it finished past its timeout
+    @staticmethod
+    def release(connection):
+        connection[0].exit()
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def create_board(settings):
+        if settings.TurretBoard == "simulated":
+            return SimulatedBoard(settings.SimulatorBaud, settings.SimulatorSlewRate)
+        # pyfirmata is only loaded when there is a real board to talk to
+        from pyfirmata import ArduinoDue
+        return ArduinoDue(settings.TurretPort)
+    # ------------------------------------------------------------------------------------------
+
+    def write_yaw(self, value):
+        if self.Board is not None:
+            with self.WriteLock:
+                self.YawPin.write(value)
+    # ------------------------------------------------------------------------------------------
+
+    def write_pitch(self, value):
+        if self.Board is not None:
+            with self.WriteLock:
+                self.PitchPin.write(value)
+    # ------------------------------------------------------------------------------------------
 
-        except Exception as e:
-            self.Board = None
-            logger.error("Failed to initialize: " + str(e))
+    def write_trigger(self, value):
+        if self.Board is not None:
+            with self.WriteLock:
+                self.TriggerPin.write(value)
     # ------------------------------------------------------------------------------------------
 
     def move_servos(self, yaw, pitch):
@@ -49,25 +122,30 @@ class TurretController(object):
         self.TargetPitch = value
     # ------------------------------------------------------------------------------------------
 
+    def set_target_time(self, frame_time):
+        self.TargetTime = frame_time
+    # ------------------------------------------------------------------------------------------
+
     def update(self, delta):
-        if self.TargetYaw != self.Yaw:
-            if self.Board is not None:
-                #self.Board.digital[self.Settings.YawPin].write(self.TargetYaw)
-                self.YawPin.write(self.TargetYaw)
-            self.Yaw = self.TargetYaw
+        if self.TargetYaw == self.Yaw and self.TargetPitch == self.Pitch:
+            return
 
-        if self.TargetPitch != self.Pitch:
-            if self.Board is not None:
-                #self.Board.digital[self.Settings.PitchPin].write(self.TargetPitch)
-                self.PitchPin.write(self.TargetPitch)
-            self.Pitch = self.TargetPitch
+        # Rate limit, deadband and the latency measurement are up to the channel
+        self.Channel.submit(self.TargetYaw, self.TargetPitch, self.TargetTime)
+        self.Yaw = self.TargetYaw
+        self.Pitch = self.TargetPitch
     # ------------------------------------------------------------------------------------------
 
     def get_yaw_pitch(self):
         return self.Yaw, self.Pitch
     # ------------------------------------------------------------------------------------------
 
+    # Cached readback, refreshed by the channel at the readback rate
     def read_yaw_pitch(self):
+        return self.Channel.get_readback()
+    # ------------------------------------------------------------------------------------------
+
+    def poll_yaw_pitch(self):
         yaw = 0
         pitch = 0
         if self.Board is not None:
@@ -4,6 +4,34 @@ import time
 class Utils(object):
 
     @staticmethod
+    # Monotonic, the wall clock may jump and must not drive timing
     def millis():
-        return round(time.time() * 1000)
+        return round(time.monotonic() * 1000)
+    # ------------------------------------------------------------------------------------------
+
+    # Monotonic high resolution time in milliseconds, for timestamps and latency measurements
+    @staticmethod
+    def now_ms():
+        return time.perf_counter() * 1000.0
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def percentile(values, percent):
+        if not values:
+            return 0
+        ordered = sorted(values)
+        index = int(round(percent / 100.0 * (len(ordered) - 1)))
+        return ordered[min(max(index, 0), len(ordered) - 1)]
+    # ------------------------------------------------------------------------------------------
+
+    # Initializer of the analysis and tuning process pools
+    @staticmethod
+    def init_worker():
+        # Loaded here, Utils is imported everywhere and must stay light
+        import cv2
+        import logging
+
+        # Parallelism comes from the processes, OpenCV threads would only compete for the same cores
+        cv2.setNumThreads(1)
+        logging.getLogger().setLevel(logging.WARNING)
     # ------------------------------------------------------------------------------------------
@@ -0,0 +1,136 @@
+import glob
+import os
+import cv2
+import numpy as np
+import logging
+
+# Enable logging
+logging.basicConfig(
+    format='%(asctime)s [%(thread)d] %(name)s[%(levelname)s]: %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Image sequence with the same interface as cv2.VideoCapture, frames are read in file name order
+class ImageSequenceCapture(object):
+
+    def __init__(self, files):
+        self.Files = files
+        self.Position = 0
+        self.Width = 0
+        self.Height = 0
+
+        if len(self.Files) > 0:
+            image = cv2.imread(self.Files[0])
+            if image is not None:
+                self.Height, self.Width = image.shape[:2]
+    # ------------------------------------------------------------------------------------------
+
+    def isOpened(self):
+        return len(self.Files) > 0
+    # ------------------------------------------------------------------------------------------
+
+    def read(self, image=None):
+        if self.Position >= len(self.Files):
+            return False, None
+
+        frame = cv2.imread(self.Files[self.Position])
+        self.Position += 1
+        return frame is not None, frame
+    # ------------------------------------------------------------------------------------------
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.Width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.Height
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.Files)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.Position
+        return 0
+    # ------------------------------------------------------------------------------------------
+
+    def set(self, prop, value):
+        return False
+    # ------------------------------------------------------------------------------------------
+
+    def release(self):
+        self.Files = []
+    # ------------------------------------------------------------------------------------------
+
+
+# In-memory capture cycling over prepared frames, decodes into the given image like a real camera does.
+# Benchmarks and the parameter tuner feed the detector through it
+class FrameListCapture(object):
+
+    def __init__(self, frames):
+        self.Frames = frames
+        self.Position = 0
+    # ------------------------------------------------------------------------------------------
+
+    def isOpened(self):
+        return True
+    # ------------------------------------------------------------------------------------------
+
+    def read(self, image=None):
+        frame = self.Frames[self.Position % len(self.Frames)]
+        self.Position += 1
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame.copy()
+    # ------------------------------------------------------------------------------------------
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.Frames[0].shape[1]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.Frames[0].shape[0]
+        return 0
+    # ------------------------------------------------------------------------------------------
+
+    def release(self):
+        pass
+    # ------------------------------------------------------------------------------------------
+
+
+class VideoSource(object):
+
+    IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+    # Opens a live camera (None or camera index), a video file, an image directory or a glob pattern
+    @staticmethod
+    def open(source=None):
+        if source is None:
+            return cv2.VideoCapture(0, cv2.CAP_DSHOW)
+
+        # Already opened capture-like object
+        if hasattr(source, "read"):
+            return source
+
+        if isinstance(source, int) or str(source).isdigit():
+            return cv2.VideoCapture(int(source), cv2.CAP_DSHOW)
+
+        files = []
+        if os.path.isdir(source):
+            files = [os.path.join(source, name) for name in os.listdir(source)]
+        elif glob.has_magic(source):
+            files = glob.glob(source)
+
+        if files:
+            files = sorted(f for f in files if f.lower().endswith(VideoSource.IMAGE_EXTENSIONS))
+            logger.info("Opening image sequence of {} frames".format(len(files)))
+            return ImageSequenceCapture(files)
+
+        logger.info("Opening video file " + source)
+        return cv2.VideoCapture(source)
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def is_live(source):
+        if hasattr(source, "read"):
+            return False
+        return source is None or isinstance(source, int) or str(source).isdigit()
+    # ------------------------------------------------------------------------------------------
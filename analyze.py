@@ -0,0 +1,219 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import cv2
+
+from BlobExtractor import BLOB_AREA
+from MotionDetector import MotionDetector
+from Settings import Settings
+from Utils import Utils
+from VideoSource import VideoSource
+
+
+# One JSON object per line
+class JsonlWriter(object):
+
+    def __init__(self, path):
+        self.File = open(path, "w")
+
+    def write(self, record):
+        self.File.write(json.dumps(record, separators=(",", ":")))
+        self.File.write("\n")
+
+    def close(self):
+        self.File.close()
+# ------------------------------------------------------------------------------------------
+
+
+# Columnar output, pyarrow is only needed when it is asked for
+class ParquetWriter(object):
+
+    ROW_GROUP = 65536
+
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        self.Arrow = pyarrow
+        self.Path = path
+        self.Writer = None
+        self.Columns = dict()
+
+    def write(self, record):
+        for name, value in record.items():
+            self.Columns.setdefault(name, []).append(value)
+        if len(self.Columns["frame"]) >= ParquetWriter.ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if not self.Columns:
+            return
+        table = self.Arrow.table(self.Columns)
+        if self.Writer is None:
+            self.Writer = self.Arrow.parquet.ParquetWriter(self.Path, table.schema)
+        self.Writer.write_table(table)
+        self.Columns = dict()
+
+    def close(self):
+        self.flush()
+        if self.Writer is not None:
+            self.Writer.close()
+# ------------------------------------------------------------------------------------------
+
+
+# Splits every video into segments of at most segment seconds, a segment is the unit of work of a worker
+def make_jobs(files, segment, warmup, output_dir, output_format):
+    jobs = []
+    for index, path in enumerate(files):
+        capture = cv2.VideoCapture(path)
+        frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        capture.release()
+
+        name = "{:04d}_{}".format(index, os.path.splitext(os.path.basename(path))[0])
+        length = int(segment * fps) if segment > 0 and frames > 0 else 0
+        starts = range(0, frames, length) if length > 0 else [0]
+        for part, start in enumerate(starts):
+            end = start + length if length > 0 else None
+            part_path = os.path.join(output_dir, "{}.part{:05d}.{}".format(name, part, output_format))
+            jobs.append({"file": path, "name": name, "start": start, "end": end, "warmup": warmup, "fps": fps,
+                         "output": part_path, "format": output_format})
+    return jobs
+# ------------------------------------------------------------------------------------------
+
+
+def run_job(job, settings_path, overrides):
+    settings = Settings(settings_path)
+    settings.Headless = True
+    settings.RenderMode = "headless"
+    settings.CaptureThreaded = False
+    # Fixed processing quality, records must not depend on how busy the machine is
+    settings.QualityEnabled = False
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+    # The segment starts early enough for the background model and the tracks to settle
+    first = max(job["start"] - job["warmup"], 0)
+    capture = VideoSource.open(job["file"])
+    if first > 0:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, first)
+    detector = MotionDetector(settings, capture)
+    detector.set_active(True)
+
+    writer = ParquetWriter(job["output"]) if job["format"] == "parquet" else JsonlWriter(job["output"])
+    period = 1000.0 / job["fps"]
+    frame_index = first
+    records = 0
+    detections = 0
+    begin = time.perf_counter()
+    while job["end"] is None or frame_index < job["end"]:
+        detector.update(period)
+        if detector.EndOfStream:
+            break
+        if frame_index >= job["start"] and detector.Frame is not None:
+            record = make_record(detector, job, frame_index)
+            writer.write(record)
+            records += 1
+            detections += 1 if record["detected"] else 0
+        frame_index += 1
+
+    writer.close()
+    capture.release()
+    return {"name": job["name"], "file": job["file"], "output": job["output"], "frames": records,
+            "detections": detections, "seconds": time.perf_counter() - begin}
+# ------------------------------------------------------------------------------------------
+
+
+# Detection state of the current frame, coordinates and areas in source pixels
+def make_record(detector, job, frame_index):
+    scale = detector.SourceShape[1] / float(detector.Frame.shape[1])
+    blobs = detector.Blobs
+    area = int(blobs[:, BLOB_AREA].max() * scale * scale) if len(blobs) > 0 else 0
+    target = None
+    primary = detector.Tracker.get_primary()
+    if primary is not None:
+        position = primary.get_position()
+        target = [round(position.X * scale, 1), round(position.Y * scale, 1)]
+    return {"file": job["file"], "frame": frame_index, "time": round(frame_index / job["fps"], 3),
+            "detected": bool(detector.is_detected()), "blobs": detector.BlobCount, "area": area,
+            "target_x": target[0] if target else None, "target_y": target[1] if target else None}
+# ------------------------------------------------------------------------------------------
+
+
+# JSONL parts are concatenated into one file per video, parquet parts stay as a dataset directory
+def merge_parts(results, output_dir, output_format):
+    by_name = dict()
+    for result in results:
+        by_name.setdefault(result["name"], []).append(result["output"])
+
+    for name, parts in by_name.items():
+        parts.sort()
+        if output_format == "parquet":
+            directory = os.path.join(output_dir, name)
+            os.makedirs(directory, exist_ok=True)
+            for part in parts:
+                shutil.move(part, os.path.join(directory, os.path.basename(part)))
+            continue
+        with open(os.path.join(output_dir, name + ".jsonl"), "wb") as target:
+            for part in parts:
+                with open(part, "rb") as source:
+                    shutil.copyfileobj(source, target)
+                os.remove(part)
+# ------------------------------------------------------------------------------------------
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replays recorded videos through the motion detector in parallel "
+                                             "and writes per-frame detection records")
+    ap.add_argument("videos", nargs="+", help="video files or glob patterns")
+    ap.add_argument("-o", "--output-dir", default="analysis", help="directory of the per-video records")
+    ap.add_argument("-f", "--format", choices=("jsonl", "parquet"), default="jsonl", help="record format")
+    ap.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(), help="worker processes")
+    ap.add_argument("-s", "--settings", default="Settings.xml", help="detector settings")
+    ap.add_argument("-a", "--min-area", type=int, help="override the detector minimum area")
+    ap.add_argument("--segment", type=float, default=300.0,
+                    help="split videos into segments of this many seconds, 0 processes whole files")
+    ap.add_argument("--warmup", type=int, default=30, help="frames replayed before a segment without records")
+    args = ap.parse_args()
+
+    files = []
+    for pattern in args.videos:
+        matches = sorted(glob.glob(pattern))
+        files.extend(matches if matches else [pattern])
+
+    overrides = dict()
+    if args.min_area is not None:
+        overrides["DetectorMinArea"] = args.min_area
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = make_jobs(files, args.segment, args.warmup, args.output_dir, args.format)
+    print("{} videos, {} segments, {} workers".format(len(files), len(jobs), args.jobs))
+
+    begin = time.perf_counter()
+    results = []
+    with multiprocessing.Pool(args.jobs, initializer=Utils.init_worker) as pool:
+        # Segments go to workers as they become free
+        pending = [pool.apply_async(run_job, (job, args.settings, overrides)) for job in jobs]
+        for result in pending:
+            results.append(result.get())
+    elapsed = time.perf_counter() - begin
+    merge_parts(results, args.output_dir, args.format)
+
+    frames = sum(result["frames"] for result in results)
+    print("{:<40} {:>9} {:>11}".format("video", "frames", "detections"))
+    totals = dict()
+    for result in results:
+        total = totals.setdefault(result["file"], [0, 0])
+        total[0] += result["frames"]
+        total[1] += result["detections"]
+    for path, (count, detections) in totals.items():
+        print("{:<40} {:>9} {:>11}".format(path[-40:], count, detections))
+    print("{} frames in {:.1f} s, {:.0f} FPS".format(frames, elapsed, frames / elapsed if elapsed > 0 else 0))
+# ------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    main()
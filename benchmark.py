@@ -0,0 +1,414 @@
+import argparse
+import sys
+import time
+import cv2
+import numpy as np
+
+from MotionDetector import MotionDetector
+from BlobExtractor import BlobExtractor, ContourBlobExtractor
+from Settings import Settings
+from Profiler import Profiler
+from TurretController import TurretController
+from FireControl import FireControl
+from Utils import Utils
+from VideoSource import FrameListCapture
+import math
+
+
+# Wraps the cv2 module and counts large arrays returned by OpenCV calls that are not one of the dst buffers
+class CountingCv2(object):
+
+    def __init__(self, module, min_bytes):
+        self.Module = module
+        self.MinBytes = min_bytes
+        self.Allocations = 0
+
+    def count(self, result, buffers):
+        if isinstance(result, np.ndarray):
+            if result.nbytes >= self.MinBytes and not any(result is buffer for buffer in buffers):
+                self.Allocations += 1
+        elif isinstance(result, tuple):
+            for item in result:
+                self.count(item, buffers)
+
+    def __getattr__(self, name):
+        attr = getattr(self.Module, name)
+        if not callable(attr) or isinstance(attr, type):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # Drawing functions return their input image, dst= outputs return the given buffer
+            self.count(result, args + tuple(kwargs.values()))
+            return result
+        return wrapper
+# ------------------------------------------------------------------------------------------
+
+
+def make_frames(count, width, height, moving=True):
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        frame = np.full((height, width, 3), 90, np.uint8)
+        frame += rng.integers(0, 8, frame.shape, dtype=np.uint8)
+        if moving:
+            x = (i * 7) % (width - 100)
+            cv2.rectangle(frame, (x, height // 3), (x + 80, height // 3 + 120), (20, 200, 220), -1)
+        frames.append(frame)
+    return frames
+# ------------------------------------------------------------------------------------------
+
+
+def make_detector(frames, profiler=None, **settings_overrides):
+    settings = Settings("Settings.xml")
+    settings.Headless = True
+    for name, value in settings_overrides.items():
+        setattr(settings, name, value)
+    detector = MotionDetector(settings, FrameListCapture(frames), profiler)
+    detector.set_active(True)
+    return detector
+# ------------------------------------------------------------------------------------------
+
+
+# The detection pipeline as it was before the preallocated buffers
+def legacy_pipeline(cv, capture, first_frame):
+    _, frame = capture.read()
+    height = int(frame.shape[0] * 500 / float(frame.shape[1]))
+    frame = cv.resize(frame, (500, height), interpolation=cv2.INTER_AREA)
+    gray = cv.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray = cv.GaussianBlur(gray, (21, 21), 0)
+    if first_frame is None:
+        return gray, 0
+    frame_delta = cv.absdiff(first_frame, gray)
+    thresh = cv.threshold(frame_delta, 50, 255, cv2.THRESH_BINARY)[1]
+    thresh = cv.dilate(thresh, None, iterations=2)
+    copy = thresh.copy()
+    contours = cv.findContours(copy, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    return first_frame, 1
+# ------------------------------------------------------------------------------------------
+
+
+def run_legacy(frames, count, cv=cv2):
+    capture = FrameListCapture(frames)
+    first_frame, _ = legacy_pipeline(cv, capture, None)
+    start = time.perf_counter()
+    for _ in range(count):
+        legacy_pipeline(cv, capture, first_frame)
+    return (time.perf_counter() - start) * 1000.0 / count
+# ------------------------------------------------------------------------------------------
+
+
+def make_buffers(shape):
+    height = int(shape[0] * 500 / float(shape[1]))
+    return {"raw": np.empty(shape, np.uint8), "frame": np.empty((height, 500, 3), np.uint8),
+            "gray": np.empty((height, 500), np.uint8), "delta": np.empty((height, 500), np.uint8),
+            "mask": np.empty((height, 500), np.uint8), "thresh": np.empty((height, 500), np.uint8)}
+# ------------------------------------------------------------------------------------------
+
+
+# The same pipeline as legacy_pipeline, every stage writing into the preallocated buffers
+def buffered_pipeline(cv, capture, buffers, first_frame):
+    _, frame = capture.read(buffers["raw"])
+    cv.resize(frame, buffers["frame"].shape[1::-1], dst=buffers["frame"], interpolation=cv2.INTER_AREA)
+    cv.cvtColor(buffers["frame"], cv2.COLOR_BGR2GRAY, dst=buffers["gray"])
+    cv.GaussianBlur(buffers["gray"], (21, 21), 0, dst=buffers["gray"])
+    if first_frame is None:
+        return buffers["gray"].copy(), 0
+    cv.absdiff(first_frame, buffers["gray"], dst=buffers["delta"])
+    cv.threshold(buffers["delta"], 50, 255, cv2.THRESH_BINARY, dst=buffers["mask"])
+    cv.dilate(buffers["mask"], None, dst=buffers["thresh"], iterations=2)
+    contours = cv.findContours(buffers["thresh"], cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    return first_frame, 1
+# ------------------------------------------------------------------------------------------
+
+
+def run_buffered(frames, count, cv=cv2):
+    capture = FrameListCapture(frames)
+    buffers = make_buffers(frames[0].shape)
+    first_frame, _ = buffered_pipeline(cv, capture, buffers, None)
+    start = time.perf_counter()
+    for _ in range(count):
+        buffered_pipeline(cv, capture, buffers, first_frame)
+    return (time.perf_counter() - start) * 1000.0 / count
+# ------------------------------------------------------------------------------------------
+
+
+def run_detector(detector, count):
+    detector.update(0)
+    start = time.perf_counter()
+    for _ in range(count):
+        detector.update(0)
+    return (time.perf_counter() - start) * 1000.0 / count
+# ------------------------------------------------------------------------------------------
+
+
+def bench_buffers(args):
+    frames = make_frames(16, args.width, args.height)
+    min_bytes = 500 * 100
+
+    # Allocation count per frame, the capture copy counts as the legacy camera decode
+    legacy_cv = CountingCv2(cv2, min_bytes)
+    capture = FrameListCapture(frames)
+    first_frame, _ = legacy_pipeline(legacy_cv, capture, None)
+    legacy_cv.Allocations = 0
+    for _ in range(args.frames):
+        legacy_pipeline(legacy_cv, capture, first_frame)
+    legacy_allocs = (legacy_cv.Allocations + 2 * args.frames) / float(args.frames)
+
+    buffered_cv = CountingCv2(cv2, min_bytes)
+    capture = FrameListCapture(frames)
+    buffers = make_buffers(frames[0].shape)
+    first_frame, _ = buffered_pipeline(buffered_cv, capture, buffers, None)
+    buffered_cv.Allocations = 0
+    for _ in range(args.frames):
+        buffered_pipeline(buffered_cv, capture, buffers, first_frame)
+    buffered_allocs = buffered_cv.Allocations / float(args.frames)
+
+    # The full detector adds prescreen, tracking and background learning, its time is not comparable
+    detector = make_detector(frames)
+    detector_module = sys.modules[MotionDetector.__module__]
+    detector_cv = CountingCv2(cv2, min_bytes)
+    detector_module.cv2 = detector_cv
+    try:
+        detector.update(0)
+        detector.update(0)
+        detector_cv.Allocations = 0
+        for _ in range(args.frames):
+            detector.update(0)
+    finally:
+        detector_module.cv2 = cv2
+    detector_allocs = detector_cv.Allocations / float(args.frames)
+
+    # Best of several rounds, to keep other load on the machine out of the comparison
+    detector = make_detector(frames)
+    legacy_ms = min(run_legacy(frames, args.frames) for _ in range(args.rounds))
+    buffered_ms = min(run_buffered(frames, args.frames) for _ in range(args.rounds))
+    detector_ms = min(run_detector(detector, args.frames) for _ in range(args.rounds))
+
+    print("{:<10} {:>14} {:>10}".format("pipeline", "allocs/frame", "ms/frame"))
+    print("{:<10} {:>14.1f} {:>10.3f}".format("legacy", legacy_allocs, legacy_ms))
+    print("{:<10} {:>14.1f} {:>10.3f}".format("buffered", buffered_allocs, buffered_ms))
+    print("{:<10} {:>14.1f} {:>10.3f}".format("detector", detector_allocs, detector_ms))
+    print("saved {:.3f} ms per frame".format(legacy_ms - buffered_ms))
+# ------------------------------------------------------------------------------------------
+
+
+def bench_prescreen(args):
+    print("{:<8} {:<10} {:>10} {:>16}".format("scene", "prescreen", "ms/frame", "after blur, ms"))
+    for moving in (False, True):
+        frames = make_frames(16, args.width, args.height, moving)
+        for enabled in (False, True):
+            profiler = Profiler()
+            detector = make_detector(frames, profiler, PrescreenEnabled=enabled)
+            ms = min(run_detector(detector, args.frames) for _ in range(args.rounds))
+            # Everything the pre-screen can skip: tile grid, threshold, dilate, background update, contours
+            stages = [profiler.Stages.get(stage, []) for stage in ("prescreen", "diff", "contours")]
+            after_blur = sum(Utils.percentile(timings, 50) for timings in stages)
+            print("{:<8} {:<10} {:>10.3f} {:>16.3f}".format(
+                "moving" if moving else "still", "on" if enabled else "off", ms, after_blur))
+# ------------------------------------------------------------------------------------------
+
+
+# Frames of a static textured scene with a change: an object entering at frame 20 and stopping, the ghost of an
+# object present only in the seed frame, or a lighting step at frame 20
+def make_background_scene(scenario, count, width, height):
+    rng = np.random.default_rng(0)
+    texture = rng.integers(40, 180, (height // 40 + 2, width // 40 + 2, 3)).astype(np.uint8)
+    before = cv2.resize(texture, (width, height), interpolation=cv2.INTER_CUBIC)
+    if scenario == "lighting":
+        after = cv2.add(before, (60, 60, 60, 0))
+    else:
+        after = before.copy()
+        cv2.rectangle(after, (width // 3, height // 3), (width // 3 + 120, height // 3 + 160), (20, 200, 220), -1)
+    # A few noisy variants of both images are cycled, the capture copies them anyway
+    noises = [rng.integers(0, 4, before.shape, dtype=np.uint8) for _ in range(8)]
+    before = [cv2.add(before, noise) for noise in noises]
+    after = [cv2.add(after, noise) for noise in noises]
+    if scenario == "ghost":
+        return [after[0]] + [before[i % 8] for i in range(1, count)]
+    return [before[i % 8] if i < 20 else after[i % 8] for i in range(count)]
+# ------------------------------------------------------------------------------------------
+
+
+# Frames until a change stops being detected, with selective learning off, on without absorbing and as configured
+def bench_background(args):
+    print("{:<10} {:<22} {:>16}".format("scene", "learning", "detected until"))
+    for scenario in ("stopped", "ghost", "lighting"):
+        frames = make_background_scene(scenario, args.length, args.width, args.height)
+        settings = Settings("Settings.xml")
+        for (name, selective, absorb_rate) in (("full", False, 0), ("selective", True, 0),
+                                               ("selective + absorb", True, settings.BackgroundAbsorbRate)):
+            detector = make_detector(frames, CaptureThreaded=False, QualityEnabled=False, BackgroundModel="average",
+                                     BackgroundSelective=selective, BackgroundAbsorbRate=absorb_rate)
+            last = None
+            for index in range(len(frames)):
+                detector.update(1000.0 / 30)
+                if detector.Detected:
+                    last = index
+            detector.stop()
+            if last is None:
+                result = "never"
+            elif last == len(frames) - 1:
+                result = "end, never learned"
+            else:
+                result = "frame {}".format(last)
+            print("{:<10} {:<22} {:>16}".format(scenario, name, result))
+# ------------------------------------------------------------------------------------------
+
+
+def bench_blobs(args):
+    settings = Settings("Settings.xml")
+    settings.DetectorMinArea = 50
+    components = BlobExtractor(settings)
+    contours = ContourBlobExtractor(settings)
+    rng = np.random.default_rng(0)
+
+    # Both extractors return every blob, trace_max_object is applied by the detector.
+    # Five separate blobs, one with a hole that is not a blob of its own
+    mask = np.zeros((args.height * 500 // args.width, 500), np.uint8)
+    for index in range(5):
+        cv2.rectangle(mask, (10 + index * 90, 50), (70 + index * 90, 150), 255, -1)
+    cv2.rectangle(mask, (25, 80), (55, 120), 0, -1)
+    components.allocate(mask.shape)
+    counts = (len(components.extract(mask)), len(contours.extract(mask)))
+    print("5 blobs found, components: {}, contours: {}{}".format(
+        counts[0], counts[1], "" if counts == (5, 5) else "  MISMATCH"))
+
+    print("{:>8} {:>10} {:>11} {:>11} {:>14} {:>14}".format(
+        "spots", "contours", "comp blobs", "cont blobs", "components ms", "contours ms"))
+    for spots in (10, 100, 1000, 3000):
+        # Busy scene like foliage, many small regions of which only some pass min_area
+        mask = np.zeros((args.height * 500 // args.width, 500), np.uint8)
+        for _ in range(spots):
+            center = (int(rng.integers(0, mask.shape[1])), int(rng.integers(0, mask.shape[0])))
+            cv2.circle(mask, center, int(rng.integers(1, 6)), 255, -1)
+        components.allocate(mask.shape)
+        regions = len(cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2])
+        # Small spots near min_area differ, pixel count against polygon area
+        counts = (len(components.extract(mask)), len(contours.extract(mask)))
+
+        timings = []
+        for extractor in (components, contours):
+            best = None
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                for _ in range(args.frames // 10):
+                    extractor.extract(mask)
+                elapsed = (time.perf_counter() - start) * 1000.0 / (args.frames // 10)
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        print("{:>8} {:>10} {:>11} {:>11} {:>14.3f} {:>14.3f}".format(spots, regions, counts[0], counts[1],
+                                                                    timings[0], timings[1]))
+# ------------------------------------------------------------------------------------------
+
+
+def bench_servo(args):
+    print("{:<12} {:>9} {:>9} {:>9} {:>8} {:>9} {:>12} {:>10}".format(
+        "config", "commands", "writes", "writes/s", "link %", "p50 ms", "update us", "error deg"))
+    # Unlimited is close to the old behaviour of writing every changed command right away
+    for (name, rate, deadband, planner) in (("unlimited", 0, 0, False), ("no planner", None, None, False),
+                                            ("settings", None, None, True)):
+        settings = Settings("Settings.xml")
+        settings.TurretBoard = "simulated"
+        settings.PlannerEnabled = settings.PlannerEnabled and planner
+        if rate is not None:
+            settings.ServoRate = rate
+            settings.ServoDeadband = deadband
+        turret = TurretController(settings)
+
+        # Target sweeping back and forth at the vision loop rate
+        frame_period = 1.0 / args.vision_rate
+        update_time = 0
+        error = []
+        start = time.perf_counter()
+        for i in range(int(args.duration * args.vision_rate)):
+            t = i * frame_period
+            turret.set_yaw(40 * math.sin(t * 2.0))
+            turret.set_pitch(25 * math.sin(t * 1.3))
+            turret.set_target_time(Utils.now_ms())
+            begin = time.perf_counter()
+            turret.update(frame_period * 1000)
+            update_time += time.perf_counter() - begin
+            error.append(abs(turret.Board.digital[settings.YawPin].read() - turret.TargetYaw))
+            delay = start + t + frame_period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        elapsed = time.perf_counter() - start
+        turret.stop()
+
+        writes = len(turret.Board.get_writes())
+        print("{:<12} {:>9} {:>9} {:>9.0f} {:>8.1f} {:>9.2f} {:>12.1f} {:>10.2f}".format(
+            name, turret.Channel.Submitted, writes, writes / elapsed, turret.Board.get_link_utilization() * 100,
+            turret.Latency.get_percentile(50), update_time * 1e6 / len(error), sum(error) / len(error)))
+# ------------------------------------------------------------------------------------------
+
+
+# Trigger pulses of a burst against the simulated board while the main thread runs the detector flat out
+def bench_fire(args):
+    settings = Settings("Settings.xml")
+    settings.TurretBoard = "simulated"
+    settings.ShooterRate = args.rate
+    turret = TurretController(settings)
+    fire_control = FireControl(turret.write_trigger, args.rate, settings.ShooterTriggerDuration, args.shots,
+                               release=settings.ShooterTriggerRelease)
+    # The fire cadence must hold with the vision loop busy
+    detector = make_detector(make_frames(50, args.width, args.height))
+    fire_control.start()
+    fire_control.burst(args.shots)
+    while fire_control.Burst > 0 or fire_control.Shots < args.shots:
+        detector.update(0)
+    time.sleep((settings.ShooterTriggerDuration + 50) / 1000.0)
+    fire_control.stop()
+    turret.stop()
+
+    edges = [(start, value) for (start, pin, value) in turret.Board.get_writes() if pin == settings.ShooterTriggerPin]
+    rises = [start for (start, value) in edges if value == 1]
+    widths = [fall - rise for ((rise, high), (fall, low)) in zip(edges, edges[1:]) if high == 1 and low == 0]
+    intervals = np.diff(rises)
+    print("{} pulses, width ms: mean {:.2f}, min {:.2f}, max {:.2f} (set {:.0f})".format(
+        len(widths), np.mean(widths), np.min(widths), np.max(widths), settings.ShooterTriggerDuration))
+    print("interval ms: mean {:.1f}, min {:.1f}, max {:.1f} (rate {} + up to {})".format(
+        np.mean(intervals), np.min(intervals), np.max(intervals), args.rate, args.rate // 4))
+    for monitor in (fire_control.StartError, fire_control.PulseError):
+        print(monitor.format())
+# ------------------------------------------------------------------------------------------
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Detector micro benchmarks")
+    ap.add_argument("-f", "--frames", type=int, default=500, help="number of frames to process")
+    ap.add_argument("-r", "--rounds", type=int, default=5, help="timing rounds, the best one is reported")
+    ap.add_argument("--width", type=int, default=640, help="source frame width")
+    ap.add_argument("--height", type=int, default=480, help="source frame height")
+    sub = ap.add_subparsers(dest="bench", required=True)
+    sub.add_parser("buffers", help="allocations and time per frame, legacy vs preallocated buffers")
+    sub.add_parser("prescreen", help="time per frame with and without the tile grid pre-screen")
+    sub.add_parser("blobs", help="blob extraction time of both backends on busy masks")
+    background = sub.add_parser("background", help="frames until a stopped object, a seed frame ghost or a "
+                                                   "lighting step are learned into the background")
+    background.add_argument("--length", type=int, default=1000, help="frames per scene")
+    servo = sub.add_parser("servo", help="servo command throughput against the simulated Firmata board")
+    servo.add_argument("--duration", type=float, default=5.0, help="seconds to run each configuration")
+    servo.add_argument("--vision-rate", type=float, default=120.0, help="target updates per second")
+    fire = sub.add_parser("fire", help="trigger pulse timing of a burst with the detector running")
+    fire.add_argument("--shots", type=int, default=20, help="shots in the burst")
+    fire.add_argument("--rate", type=int, default=200, help="ms between shots")
+    args = ap.parse_args()
+
+    if args.bench == "buffers":
+        bench_buffers(args)
+    elif args.bench == "prescreen":
+        bench_prescreen(args)
+    elif args.bench == "blobs":
+        bench_blobs(args)
+    elif args.bench == "background":
+        bench_background(args)
+    elif args.bench == "servo":
+        bench_servo(args)
+    elif args.bench == "fire":
+        bench_fire(args)
+# ------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    main()
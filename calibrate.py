@@ -0,0 +1,106 @@
+import argparse
+import glob
+import os
+import numpy as np
+
+from Calibration import Calibration
+from Settings import Settings
+
+
+def parse_size(text):
+    (width, height) = text.lower().split("x")
+    return int(width), int(height)
+# ------------------------------------------------------------------------------------------
+
+
+def get_model_path(settings):
+    return os.path.join(settings.CalibrationDirectory, settings.CalibrationFile)
+# ------------------------------------------------------------------------------------------
+
+
+def calibrate_intrinsics(settings, args):
+    images = sorted(glob.glob(args.images))
+    model, error = Calibration.fit_intrinsics(images, parse_size(args.board), args.square)
+
+    # Keep the turret pose of an earlier calibration
+    path = get_model_path(settings)
+    if os.path.exists(path):
+        previous = Calibration.load(path)
+        model["rotation"] = previous["rotation"]
+        model["translation"] = previous["translation"]
+
+    Calibration.save(path, model)
+    print("Camera matrix:\n{}".format(model["camera_matrix"]))
+    print("Distortion: {}".format(model["distortion"]))
+    print("Reprojection error: {:.3f} px, saved {}".format(error, path))
+# ------------------------------------------------------------------------------------------
+
+
+# Aim points CSV: u, v, yaw, pitch[, distance] per line, pixels at the calibration image size
+def calibrate_turret(settings, args):
+    points = np.loadtxt(args.points, delimiter=",", ndmin=2, comments="#")
+    if points.shape[1] < 4:
+        raise ValueError("Expected u, v, yaw, pitch[, distance] columns")
+    distances = points[:, 4] if points.shape[1] > 4 else np.full(len(points), settings.CalibrationDistance)
+
+    path = get_model_path(settings)
+    if os.path.exists(path):
+        model = Calibration.load(path)
+    else:
+        # No chessboard calibration yet, assume an ideal lens
+        model = Calibration.default_model(*parse_size(args.size), fov=args.fov)
+
+    before = Calibration.fit_turret(model, points[:, :2], points[:, 2:4], distances, iterations=0)["rms_deg"]
+    model = Calibration.fit_turret(model, points[:, :2], points[:, 2:4], distances)
+    Calibration.save(path, model)
+    print("Rotation (rad): {}".format(model["rotation"]))
+    print("Translation (m): {}".format(model["translation"]))
+    print("Aim error: {:.3f} deg before, {:.3f} deg after, {} points, saved {}".format(
+        before, model["rms_deg"], len(points), path))
+# ------------------------------------------------------------------------------------------
+
+
+# Precomputes the lookup tables of every processing resolution of the quality tiers
+def build_tables(settings, args):
+    settings.CalibrationEnabled = True
+    calibration = Calibration(settings)
+    if calibration.Model is None:
+        return
+    (src_width, src_height) = calibration.Model["image_size"]
+    widths = sorted(set(tier["width"] for tier in settings.QualityTiers))
+    for width in widths:
+        # Same rounding as the detector buffers
+        height = int(src_height * width / float(src_width))
+        table = calibration.get_table(width, height)
+        print("{} x {}: yaw {:.1f}..{:.1f}, pitch {:.1f}..{:.1f}".format(
+            width, height, table[..., 0].min(), table[..., 0].max(), table[..., 1].min(), table[..., 1].max()))
+# ------------------------------------------------------------------------------------------
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Camera and turret calibration")
+    ap.add_argument("-s", "--settings", default="Settings.xml", help="settings file with the <calibration> section")
+    sub = ap.add_subparsers(dest="step", required=True)
+    intrinsics = sub.add_parser("intrinsics", help="camera matrix and lens distortion from chessboard shots")
+    intrinsics.add_argument("--images", required=True, help="glob pattern of the chessboard images")
+    intrinsics.add_argument("--board", default="9x6", help="inner corners of the chessboard, columns x rows")
+    intrinsics.add_argument("--square", type=float, default=0.025, help="chessboard square size in meters")
+    turret = sub.add_parser("turret", help="camera to turret pose from recorded aim points")
+    turret.add_argument("--points", required=True, help="CSV of u, v, yaw, pitch[, distance] aim points")
+    turret.add_argument("--size", default="640x480", help="image size of the aim points without intrinsics")
+    turret.add_argument("--fov", type=float, default=60.0, help="horizontal field of view without intrinsics")
+    sub.add_parser("tables", help="precompute the lookup tables of the quality tier resolutions")
+    args = ap.parse_args()
+
+    settings = Settings(args.settings)
+    if args.step == "intrinsics":
+        calibrate_intrinsics(settings, args)
+    elif args.step == "turret":
+        calibrate_turret(settings, args)
+    elif args.step == "tables":
+        build_tables(settings, args)
+# ------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,10 @@ from SentryTurret import SentryTurret
 def main():
     # construct the argument parser and parse the arguments
     ap = argparse.ArgumentParser()
-    ap.add_argument("-v", "--video", help="path to the video file")
+    ap.add_argument("-v", "--video", help="path to the video file, image directory or glob pattern")
+    ap.add_argument("--headless", action="store_true", help="run without display and sounds")
+    ap.add_argument("-b", "--benchmark", action="store_true",
+                    help="headless replay as fast as possible, print per-stage timings at the end")
     ap.add_argument("-a", "--min-area", type=int, default=2000, help="minimum area size")
     args = vars(ap.parse_args())
 
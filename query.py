@@ -0,0 +1,87 @@
+import argparse
+import datetime
+import sys
+import time
+
+from Journal import JournalReader
+from Settings import Settings
+
+# Values of SentryTurretState, not imported to keep the tool free of the camera and board modules
+STATE_NAMES = {0: "UNKNOWN", 1: "INIT", 2: "ACTIVATED", 3: "WARNING", 4: "DETECTED", 5: "OUT_OF_AMMO"}
+
+
+def parse_time(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+# ------------------------------------------------------------------------------------------
+
+
+def format_time(wall_time):
+    return datetime.datetime.fromtimestamp(wall_time).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+# ------------------------------------------------------------------------------------------
+
+
+def show_info(reader, args):
+    segments = reader.get_segments()
+    print("{:<48} {:<23} {:<23} {:>9}".format("segment", "first", "last", "records"))
+    for (path, first, last, count) in segments:
+        print("{:<48} {:<23} {:<23} {:>9}".format(path[-48:], format_time(first), format_time(last), count))
+    print("{} segments, {} records".format(len(segments), sum(segment[3] for segment in segments)))
+# ------------------------------------------------------------------------------------------
+
+
+def run_query(reader, args):
+    end = parse_time(args.end) if args.end else time.time()
+    if args.start:
+        start = parse_time(args.start)
+    else:
+        start = end - args.last
+
+    begin = time.perf_counter()
+    records = reader.query(start, end)
+    elapsed = time.perf_counter() - begin
+    if args.detected:
+        records = records[records["detected"] != 0]
+    if args.state:
+        states = [value for value, name in STATE_NAMES.items() if name in args.state]
+        records = records[(records["state"][:, None] == states).any(axis=1)]
+
+    separator = "," if args.csv else " "
+    columns = ("time", "state", "detected", "blobs", "x", "y", "area", "yaw", "pitch", "ammo")
+    print(separator.join(columns))
+    for record in records:
+        print(separator.join((format_time(record["wall_time"]), STATE_NAMES.get(int(record["state"]), "?"),
+                              str(record["detected"]), str(record["blobs"]), "{:.1f}".format(record["x"]),
+                              "{:.1f}".format(record["y"]), "{:.0f}".format(record["area"]),
+                              "{:.2f}".format(record["yaw"]), "{:.2f}".format(record["pitch"]), str(record["ammo"]))))
+    print("{} records in {:.1f} ms".format(len(records), elapsed * 1000.0), file=sys.stderr)
+# ------------------------------------------------------------------------------------------
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Reads the detection journal")
+    ap.add_argument("-s", "--settings", default="Settings.xml", help="settings file with the <journal> section")
+    ap.add_argument("-d", "--directory", help="journal directory instead of the one in the settings")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("info", help="segments and the time ranges they cover")
+    query = sub.add_parser("query", help="records of a time window")
+    query.add_argument("--from", dest="start", help="window start, ISO date and time, e.g. 2024-05-01T21:30")
+    query.add_argument("--to", dest="end", help="window end, ISO date and time, now when omitted")
+    query.add_argument("--last", type=float, default=600.0, help="window length in seconds without --from")
+    query.add_argument("--state", nargs="+", choices=sorted(STATE_NAMES.values()), help="only records in these states")
+    query.add_argument("--detected", action="store_true", help="only records with a detection")
+    query.add_argument("--csv", action="store_true", help="comma separated output")
+    args = ap.parse_args()
+
+    directory = args.directory
+    if directory is None:
+        directory = Settings(args.settings).JournalDirectory
+    reader = JournalReader(directory)
+    if args.command == "info":
+        show_info(reader, args)
+    elif args.command == "query":
+        run_query(reader, args)
+# ------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    main()
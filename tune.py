@@ -0,0 +1,185 @@
+import argparse
+import itertools
+import multiprocessing
+import time
+import numpy as np
+
+from BlobExtractor import BLOB_X, BLOB_Y, BLOB_W, BLOB_H
+from MotionDetector import MotionDetector
+from SceneGenerator import SceneGenerator, TRUTH_CX, TRUTH_CY, TRUTH_X, TRUTH_Y, TRUTH_W, TRUTH_H
+from Settings import Settings
+from Utils import Utils
+from VideoSource import FrameListCapture
+
+# Rendered scenes of the worker process, every configuration is scored on the same frames
+SCENES = dict()
+
+
+def parse_list(text, kind=int):
+    return [kind(value) for value in text.split(",")]
+# ------------------------------------------------------------------------------------------
+
+
+def get_scenes(scene_args):
+    key = tuple(sorted(scene_args.items()))
+    if key not in SCENES:
+        seeds = scene_args["seeds"]
+        options = dict(scene_args)
+        del options["seeds"]
+        SCENES[key] = [SceneGenerator(seed=seed, **options).render_all() for seed in range(seeds)]
+    return SCENES[key]
+# ------------------------------------------------------------------------------------------
+
+
+def run_config(config, settings_path, scene_args, warmup):
+    settings = Settings(settings_path)
+    settings.Headless = True
+    settings.RenderMode = "headless"
+    settings.CaptureThreaded = False
+    settings.QualityEnabled = False
+    # The candidate is the only tier, so min_area is in pixels of its processing width
+    settings.QualityTiers = [{"width": config["width"], "blur": config["blur"], "dilate": config["dilate"],
+                              "threshold": config["threshold"], "detect_every": 1}]
+    settings.DetectorMinArea = config["min_area"]
+    # Every blob is scored, not only the largest one
+    settings.DetectorTraceMaxObject = False
+
+    truths_total = hits = blobs_total = blobs_matched = 0
+    errors = []
+    elapsed = 0.0
+    frames_scored = 0
+    for (frames, truths) in get_scenes(scene_args):
+        detector = MotionDetector(settings, FrameListCapture(frames))
+        detector.set_active(True)
+        for index, truth in enumerate(truths):
+            begin = time.perf_counter()
+            detector.update(1000.0 / 30)
+            if index < warmup:
+                continue
+            elapsed += time.perf_counter() - begin
+            frames_scored += 1
+
+            scale = frames[0].shape[1] / float(detector.Frame.shape[1])
+            boxes = detector.Blobs[:, [BLOB_X, BLOB_Y, BLOB_W, BLOB_H]] * scale
+            truths_total += len(truth)
+            blobs_total += len(boxes)
+            for row in truth:
+                inside = (boxes[:, 0] <= row[TRUTH_CX]) & (row[TRUTH_CX] <= boxes[:, 0] + boxes[:, 2]) & \
+                    (boxes[:, 1] <= row[TRUTH_CY]) & (row[TRUTH_CY] <= boxes[:, 1] + boxes[:, 3])
+                hits += 1 if inside.any() else 0
+            for box in boxes:
+                overlap = (box[0] < truth[:, TRUTH_X] + truth[:, TRUTH_W]) & (truth[:, TRUTH_X] < box[0] + box[2]) & \
+                    (box[1] < truth[:, TRUTH_Y] + truth[:, TRUTH_H]) & (truth[:, TRUTH_Y] < box[1] + box[3])
+                blobs_matched += 1 if overlap.any() else 0
+
+            primary = detector.Tracker.get_primary()
+            if primary is not None and len(truth) > 0:
+                position = primary.get_position()
+                distances = np.hypot(truth[:, TRUTH_CX] - position.X * scale, truth[:, TRUTH_CY] - position.Y * scale)
+                errors.append(distances.min())
+        detector.stop()
+
+    return dict(config,
+                cost=elapsed * 1000.0 / max(frames_scored, 1),
+                recall=hits / float(truths_total) if truths_total else 1.0,
+                precision=blobs_matched / float(blobs_total) if blobs_total else 1.0,
+                error=float(np.mean(errors)) if errors else float("inf"))
+# ------------------------------------------------------------------------------------------
+
+
+# Results no other result beats on every objective: lower cost and error, higher recall and precision
+def pareto_front(results):
+    front = []
+    for result in results:
+        dominated = False
+        for other in results:
+            if other is result:
+                continue
+            no_worse = other["cost"] <= result["cost"] and other["error"] <= result["error"] and \
+                other["recall"] >= result["recall"] and other["precision"] >= result["precision"]
+            better = other["cost"] < result["cost"] or other["error"] < result["error"] or \
+                other["recall"] > result["recall"] or other["precision"] > result["precision"]
+            if no_worse and better:
+                dominated = True
+                break
+        if not dominated:
+            front.append(result)
+    return front
+# ------------------------------------------------------------------------------------------
+
+
+def write_fragment(path, best, settings, args):
+    with open(path, "w") as f:
+        f.write("<!-- tune.py: {} scenes of {} frames, recall {:.3f}, precision {:.3f}, centroid error {:.1f} px, "
+                "{:.2f} ms per frame -->\n".format(args.scenes, args.frames, best["recall"], best["precision"],
+                                                   best["error"], best["cost"]))
+        f.write('<detector min_area="{}" trace_max_object="{}" blobs="{}"/>\n'.format(
+            best["min_area"], "1" if settings.DetectorTraceMaxObject else "0", settings.DetectorBlobs))
+        f.write("<!-- first tier of <quality>, min_area is in pixels of its width -->\n")
+        f.write('<tier width="{}" blur="{}" dilate="{}" threshold="{}" detect_every="1"/>\n'.format(
+            best["width"], best["blur"], best["dilate"], best["threshold"]))
+# ------------------------------------------------------------------------------------------
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Scores detector parameter grids on synthetic scenes with ground truth "
+                                             "and writes the fastest configuration meeting the accuracy bar")
+    ap.add_argument("-s", "--settings", default="Settings.xml", help="base detector settings")
+    ap.add_argument("-o", "--output", default="tuned.xml", help="Settings.xml fragment of the chosen configuration")
+    ap.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(), help="worker processes")
+    ap.add_argument("--width", default="240,320,400,500", help="processing widths")
+    ap.add_argument("--blur", default="9,15,21", help="blur kernel sizes, odd")
+    ap.add_argument("--dilate", default="1,2", help="dilate iterations")
+    ap.add_argument("--threshold", default="30,50,70", help="difference thresholds")
+    ap.add_argument("--min-area", default="500,1000,2000", help="minimum blob areas")
+    ap.add_argument("--scenes", type=int, default=3, help="synthetic scenes, one per seed")
+    ap.add_argument("--frames", type=int, default=300, help="frames per scene")
+    ap.add_argument("--objects", type=int, default=2, help="moving objects per scene")
+    ap.add_argument("--noise", type=float, default=4.0, help="sensor noise standard deviation")
+    ap.add_argument("--drift", type=float, default=0.1, help="relative lighting drift amplitude")
+    ap.add_argument("--drift-period", type=int, default=900, help="lighting drift period in frames")
+    ap.add_argument("--occluders", type=int, default=2, help="static occluders per scene")
+    ap.add_argument("--warmup", type=int, default=30, help="frames per scene before scoring starts")
+    ap.add_argument("--min-recall", type=float, default=0.9, help="accuracy bar: minimum recall")
+    ap.add_argument("--min-precision", type=float, default=0.8, help="accuracy bar: minimum precision")
+    ap.add_argument("--max-error", type=float, default=25.0, help="accuracy bar: maximum mean centroid error in px")
+    args = ap.parse_args()
+
+    scene_args = {"seeds": args.scenes, "length": args.frames, "objects": args.objects, "noise": args.noise,
+                  "drift": args.drift, "drift_period": args.drift_period, "occluders": args.occluders}
+    grid = [{"width": width, "blur": blur | 1, "dilate": dilate, "threshold": threshold, "min_area": min_area}
+            for (width, blur, dilate, threshold, min_area) in itertools.product(
+                parse_list(args.width), parse_list(args.blur), parse_list(args.dilate), parse_list(args.threshold),
+                parse_list(args.min_area))]
+    print("{} configurations, {} scenes of {} frames, {} workers".format(len(grid), args.scenes, args.frames,
+                                                                        args.jobs))
+
+    begin = time.perf_counter()
+    with multiprocessing.Pool(args.jobs, initializer=Utils.init_worker) as pool:
+        pending = [pool.apply_async(run_config, (config, args.settings, scene_args, args.warmup)) for config in grid]
+        results = [result.get() for result in pending]
+    print("Scored in {:.1f} s".format(time.perf_counter() - begin))
+
+    front = sorted(pareto_front(results), key=lambda result: result["cost"])
+    print("Pareto front:")
+    print("{:>6} {:>5} {:>7} {:>10} {:>9} {:>8} {:>8} {:>10} {:>9}".format(
+        "width", "blur", "dilate", "threshold", "min_area", "ms", "recall", "precision", "error px"))
+    for result in front:
+        print("{width:>6} {blur:>5} {dilate:>7} {threshold:>10} {min_area:>9} {cost:>8.2f} {recall:>8.3f} "
+              "{precision:>10.3f} {error:>9.1f}".format(**result))
+
+    accepted = [result for result in front if result["recall"] >= args.min_recall and
+                result["precision"] >= args.min_precision and result["error"] <= args.max_error]
+    if not accepted:
+        print("No configuration meets recall >= {}, precision >= {}, error <= {} px".format(
+            args.min_recall, args.min_precision, args.max_error))
+        return
+    best = accepted[0]
+    write_fragment(args.output, best, Settings(args.settings), args)
+    print("Fastest accepted: width {width}, blur {blur}, dilate {dilate}, threshold {threshold}, "
+          "min_area {min_area}, {cost:.2f} ms per frame, written to ".format(**best) + args.output)
+# ------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    main()